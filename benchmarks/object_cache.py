@@ -0,0 +1,55 @@
+'''
+Cost of loading an object from a cached row (unpickling it) compared with
+copying an already deserialized object from the object cache.
+
+    python -m benchmarks.object_cache
+'''
+from benchmarks.state_compression import get_samples
+from benchmarks.utils import print_results
+from benchmarks.utils import setup_app
+from benchmarks.utils import Timer
+from guillotina._settings import app_settings
+from guillotina.db.cache import objects
+from guillotina.db.reader import reader
+
+import asyncio
+import pickle
+
+
+ITERATIONS = 1000
+
+
+def run():
+    rows = []
+    for name, ob in get_samples():
+        result = {
+            'zoid': 'foobar',
+            'tid': 1,
+            'id': 'foobar',
+            'state': pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL)
+        }
+
+        app_settings['object_cache'] = {'max_size': 0}
+        objects._object_cache = None
+        with Timer() as row_cache:
+            for _ in range(ITERATIONS):
+                reader(result)
+
+        app_settings['object_cache'] = {'max_size': 100 * 1024 * 1024}
+        reader(result)
+        with Timer() as object_cache:
+            for _ in range(ITERATIONS):
+                reader(result)
+
+        rows.append((
+            name, len(result['state']),
+            row_cache.duration / ITERATIONS * 1000000,
+            object_cache.duration / ITERATIONS * 1000000,
+            row_cache.duration / object_cache.duration))
+    print_results('Object cache', (
+        'type', 'size', 'row cache (us)', 'object cache (us)', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    setup_app(asyncio.get_event_loop())
+    run()
@@ -0,0 +1,72 @@
+'''
+Compression ratio and cpu cost of the state codecs for the kinds of objects
+guillotina stores.
+
+    python -m benchmarks.state_compression
+'''
+from benchmarks.utils import print_results
+from benchmarks.utils import setup_app
+from benchmarks.utils import Timer
+from guillotina.annotations import AnnotationData
+from guillotina.db.compression import _codecs_by_name
+from guillotina.registry import Registry
+from guillotina.tests.utils import create_content
+
+import asyncio
+import pickle
+
+
+ITERATIONS = 1000
+
+
+def get_samples():
+    small = create_content()
+    small.title = 'Item'
+
+    large = create_content()
+    large.title = 'Item with a lot of text'
+    large.description = ' '.join(['Lorem ipsum dolor sit amet'] * 2000)
+
+    folder = create_content(type_name='Folder')
+
+    registry = Registry()
+    for idx in range(200):
+        registry[f'guillotina.tests.setting{idx}'] = f'value {idx}'
+
+    annotation = AnnotationData()
+    for idx in range(200):
+        annotation[f'key{idx}'] = {'value': idx, 'text': 'foobar' * 10}
+
+    return [
+        ('small item', small),
+        ('large item', large),
+        ('folder', folder),
+        ('registry', registry),
+        ('annotation', annotation)
+    ]
+
+
+def run():
+    rows = []
+    for name, ob in get_samples():
+        state = pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL)
+        for codec in _codecs_by_name.values():
+            with Timer() as compress:
+                for _ in range(ITERATIONS):
+                    compressed = codec.compress(state)
+            with Timer() as decompress:
+                for _ in range(ITERATIONS):
+                    codec.decompress(compressed)
+            rows.append((
+                name, codec.name, len(state), len(compressed),
+                len(state) / len(compressed),
+                compress.duration / ITERATIONS * 1000000,
+                decompress.duration / ITERATIONS * 1000000))
+    print_results('State compression', (
+        'type', 'codec', 'size', 'compressed', 'ratio',
+        'compress (us)', 'decompress (us)'), rows)
+
+
+if __name__ == '__main__':
+    setup_app(asyncio.get_event_loop())
+    run()
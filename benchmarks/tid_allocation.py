@@ -0,0 +1,48 @@
+'''
+Commits per second for concurrent writers with tids allocated one by one
+and in blocks.
+
+    DSN=postgres://postgres:@localhost:5432/guillotina python -m benchmarks.tid_allocation
+'''
+from benchmarks.utils import cleanup
+from benchmarks.utils import get_storage
+from benchmarks.utils import print_results
+from benchmarks.utils import setup_app
+from benchmarks.utils import Timer
+from guillotina.db.transaction_manager import TransactionManager
+from guillotina.tests.utils import create_content
+
+import asyncio
+
+
+WRITERS = (1, 8, 64)
+BLOCK_SIZES = (1, 100)
+COMMITS_PER_WRITER = 50
+
+
+async def writer(tm):
+    for _ in range(COMMITS_PER_WRITER):
+        txn = await tm.begin()
+        txn.register(create_content())
+        await tm.commit(txn=txn)
+
+
+async def run():
+    rows = []
+    for block_size in BLOCK_SIZES:
+        for writers in WRITERS:
+            storage = await get_storage(tid_block_size=block_size)
+            tm = TransactionManager(storage)
+            with Timer() as timer:
+                await asyncio.gather(*[writer(tm) for _ in range(writers)])
+            commits = writers * COMMITS_PER_WRITER
+            rows.append((block_size, writers, commits, commits / timer.duration))
+            await cleanup(storage)
+    print_results('TID allocation', ('tid block size', 'writers', 'commits',
+                                     'commits/sec'), rows)
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    setup_app(loop)
+    loop.run_until_complete(run())
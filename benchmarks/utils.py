@@ -0,0 +1,63 @@
+from guillotina import testing
+from guillotina.content import load_cached_schema
+from guillotina.db.storages.pg import PostgresqlStorage
+from guillotina.factory import make_app
+
+import asyncio
+import os
+import time
+
+
+DSN = os.environ.get('DSN', 'postgres://postgres:@localhost:5432/guillotina')
+
+
+def setup_app(loop=None):
+    '''
+    Configure guillotina so content can be created and stored, the app
+    itself uses the in memory dummy storage
+    '''
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    settings = testing.get_settings()
+    app = make_app(settings=settings, loop=loop)
+    app.config.execute_actions()
+    load_cached_schema()
+    return app
+
+
+async def get_storage(**kwargs):
+    options = {
+        'dsn': DSN,
+        'name': 'db',
+        'pool_size': 80,
+        'transaction_strategy': 'resolve'
+    }
+    options.update(kwargs)
+    storage = PostgresqlStorage(**options)
+    await storage.initialize()
+    return storage
+
+
+async def cleanup(storage):
+    await storage.remove()
+    await storage.create()
+    await storage.finalize()
+
+
+class Timer:
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.duration = time.time() - self.start
+
+
+def print_results(title, header, rows):
+    print(title)
+    print('  '.join(f'{h:>16}' for h in header))
+    for row in rows:
+        print('  '.join(
+            f'{v:>16.2f}' if isinstance(v, float) else f'{v:>16}' for v in row))
+    print()
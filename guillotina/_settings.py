@@ -15,6 +15,28 @@ app_settings = {
     "default_static_filenames": ['index.html', 'index.htm'],
     "utilities": [],
     "store_json": True,
+    "memory_cache": {
+        "max_size": 100 * 1024 * 1024  # bytes, for the `memory` cache strategy
+    },
+    "pinned_cache": {
+        # records of objects with `__immutable_cache__`
+        "max_size": 10 * 1024 * 1024,  # bytes
+        "validate_interval": 10  # seconds before checking the tid again
+    },
+    "object_cache": {
+        # deserialized objects by (oid, tid), 0 disables it
+        "max_size": 0  # bytes of pickled state
+    },
+    "warmup": {
+        "on_startup": False,
+        "max_connections": 4,
+        "access_log": None,  # log to load the most accessed paths from
+        "top_paths": 100
+    },
+    "state_compression": {
+        "codec": None,  # zlib, lz4 or dotted name of a codec
+        "min_size": 1024
+    },
     "root_user": {
         "password": ""
     },
@@ -50,7 +72,8 @@ app_settings = {
         'testdata': 'guillotina.commands.testdata.TestDataCommand',
         'initialize-db': 'guillotina.commands.initialize_db.DatabaseInitializationCommand',
         'apigen': 'guillotina.commands.apigen.APIGenCommand',
-        'run': 'guillotina.commands.run.RunCommand'
+        'run': 'guillotina.commands.run.RunCommand',
+        'warmup': 'guillotina.commands.warmup.WarmupCommand'
     },
     "json_schema_definitions": {},  # json schemas available to reference in docs
     "default_layer": interfaces.IDefaultLayer,
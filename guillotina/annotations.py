@@ -1,6 +1,7 @@
 from collections import UserDict
 from guillotina import configure
 from guillotina.db.orm.base import BaseObject
+from guillotina.db.writer import get_partition_id
 from guillotina.interfaces import IAnnotationData
 from guillotina.interfaces import IAnnotations
 from guillotina.interfaces import IResource
@@ -66,6 +67,9 @@ class AnnotationsAdapter(object):
         annotations[key] = value
         value.__of__ = self.obj._p_oid
         value.__name__ = key
+        # annotations only reference the oid of the object, store them
+        # with the partition of the object
+        value.__partition_id__ = get_partition_id(self.obj)
         value.__new_marker__ = True
         # we register the value
         value._p_jar = self.obj._p_jar
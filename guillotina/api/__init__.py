@@ -2,6 +2,7 @@
 from . import addons  # noqa
 from . import app  # noqa
 from . import behaviors  # noqa
+from . import cache  # noqa
 from . import container  # noqa
 from . import content  # noqa
 from . import files  # noqa
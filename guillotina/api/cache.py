@@ -0,0 +1,89 @@
+from guillotina import configure
+from guillotina.browser import ErrorResponse
+from guillotina.interfaces import IApplication
+from guillotina.interfaces import IDatabase
+
+
+def get_storages(context):
+    if IDatabase.providedBy(context):
+        # services of a database are called on its root object
+        return {context.__db_id__: context._p_jar._manager._storage}
+    return {
+        _id: db._db.storage for _id, db in context if IDatabase.providedBy(db)
+    }
+
+
+@configure.service(
+    context=IApplication, method='GET',
+    permission='guillotina.ManageCache', name='@cache-stats',
+    summary='Get statistics of the storage caches of the process')
+@configure.service(
+    context=IDatabase, method='GET',
+    permission='guillotina.ManageCache', name='@cache-stats',
+    summary='Get statistics of the storage cache of the process')
+async def cache_stats(context, request):
+    return {
+        _id: storage.get_cache_stats()
+        for _id, storage in get_storages(context).items()
+    }
+
+
+@configure.service(
+    context=IApplication, method='POST',
+    permission='guillotina.ManageCache', name='@cache-clear',
+    summary='Clear the storage caches of the process',
+    parameters=[{
+        "name": "body",
+        "in": "body",
+        "schema": {
+            "properties": {
+                "oid": {
+                    "type": "string"
+                },
+                "prefix": {
+                    "type": "string"
+                }
+            }
+        }
+    }])
+@configure.service(
+    context=IDatabase, method='POST',
+    permission='guillotina.ManageCache', name='@cache-clear',
+    summary='Clear the storage cache of the process',
+    parameters=[{
+        "name": "body",
+        "in": "body",
+        "schema": {
+            "properties": {
+                "oid": {
+                    "type": "string"
+                },
+                "prefix": {
+                    "type": "string"
+                }
+            }
+        }
+    }])
+async def cache_clear(context, request):
+    data = await request.json()
+    oid = data.get('oid')
+    prefix = data.get('prefix')
+    if not oid and not prefix:
+        return ErrorResponse(
+            'RequiredParam',
+            "Property 'oid' or 'prefix' is required")
+
+    for storage in get_storages(context).values():
+        cache = storage.get_cache()
+        if oid:
+            # the object and its children, variants and annotations
+            keys = [oid]
+            cache.delete_pinned(keys)
+            await cache.delete_all(keys)
+            for key_prefix in (oid + '/', oid + '-'):
+                cache.delete_pinned_prefix(key_prefix)
+                await cache.delete_prefix(key_prefix)
+        else:
+            cache.delete_pinned_prefix(prefix)
+            await cache.delete_prefix(prefix)
+    return {}
@@ -1,3 +1,4 @@
+from guillotina.db.writer import get_partition_id
 from guillotina.exceptions import BlobChunkNotFound
 from guillotina.transactions import get_transaction
 from io import BytesIO
@@ -19,6 +20,7 @@ class Blob:
     def __init__(self, resource):
         self.bid = uuid.uuid4().hex
         self.resource_zoid = resource._p_oid
+        self.resource_part = get_partition_id(resource)
         self.size = 0
         self.chunks = 0
 
@@ -56,7 +58,8 @@ class BlobFile:
         self._started_writing = True
 
         await self.transaction.write_blob_chunk(
-            self.blob.bid, self.blob.resource_zoid, self.blob.chunks, data)
+            self.blob.bid, self.blob.resource_zoid, self.blob.chunks, data,
+            part=getattr(self.blob, 'resource_part', None))
 
         self.blob.chunks += 1
         self.blob.size += len(data)
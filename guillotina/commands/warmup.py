@@ -0,0 +1,25 @@
+from guillotina._settings import app_settings
+from guillotina.commands import Command
+from guillotina.component import getUtility
+from guillotina.db.warmup import Warmup
+from guillotina.interfaces import IApplication
+
+
+class WarmupCommand(Command):
+    description = 'Load the objects requests need in the storage caches'
+
+    def get_parser(self):
+        parser = super(WarmupCommand, self).get_parser()
+        parser.add_argument('--access-log', help='Access log to load the most accessed paths from')
+        parser.add_argument('--top-paths', type=int, help='Number of paths of the access log to load')
+        parser.add_argument('--max-connections', type=int,
+                            help='Maximum number of database connections to use')
+        return parser
+
+    async def run(self, arguments, settings, app):
+        config = app_settings['warmup'].copy()
+        for name in ('access_log', 'top_paths', 'max_connections'):
+            if getattr(arguments, name) is not None:
+                config[name] = getattr(arguments, name)
+        warmup = await Warmup(getUtility(IApplication, name='root'), config).run()
+        print(f'Loaded {warmup.loaded_bytes} bytes in {warmup.duration:.2f} seconds')
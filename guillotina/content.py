@@ -494,17 +494,18 @@ class Folder(Resource):
         """
         return await self._get_transaction().keys(self._p_oid)
 
-    async def async_items(self, suppress_events=False) -> typing.Iterator[typing.Tuple[str, IResource]]:  # noqa
+    async def async_items(self, suppress_events=False, annotations=()) -> typing.Iterator[typing.Tuple[str, IResource]]:  # noqa
         """
-        Asynchronously iterate through contents of folder
+        Asynchronously iterate through contents of folder, the annotations
+        ids are loaded with one query for each page of items
         """
-        async for key, value in self._get_transaction().items(self):
+        async for key, value in self._get_transaction().items(self, annotations=annotations):
             if not suppress_events:
                 await notify(ObjectLoadedEvent(value))
             yield key, value
 
-    async def async_values(self, suppress_events=False) -> typing.Iterator[typing.Tuple[str, IResource]]:  # noqa
-        async for key, value in self._get_transaction().items(self):
+    async def async_values(self, suppress_events=False, annotations=()) -> typing.Iterator[typing.Tuple[str, IResource]]:  # noqa
+        async for key, value in self._get_transaction().items(self, annotations=annotations):
             if not suppress_events:
                 await notify(ObjectLoadedEvent(value))
             yield value
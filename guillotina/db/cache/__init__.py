@@ -1 +1,2 @@
 from . import dummy  # noqa
+from . import memory  # noqa
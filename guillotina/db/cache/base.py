@@ -1,7 +1,47 @@
+from collections import OrderedDict
 from guillotina import glogging
+from guillotina._settings import app_settings
+from guillotina.db.cache.lru import get_generation
+from guillotina.db.cache.lru import LRUCache
+from guillotina.db.cache.objects import get_object_cache
+
+import time
 
 
 logger = glogging.getLogger('guillotina')
+_pinned = None
+# [hits, misses] of the cache lookups of the process by variant
+_lookups = {}
+
+# cached for children that do not exist
+TOMBSTONE = {'tombstone': True}
+
+
+def is_tombstone(value):
+    return isinstance(value, dict) and value.get('tombstone', False)
+
+
+def get_pinned_cache():
+    '''
+    records of objects with `__immutable_cache__`, kept in the process for
+    all the cache strategies
+    '''
+    global _pinned
+    if _pinned is None:
+        settings = app_settings.get('pinned_cache') or {}
+        _pinned = LRUCache(settings.get('max_size', 10 * 1024 * 1024))
+    return _pinned
+
+
+def get_lookup_stats():
+    stats = {}
+    for variant, (hits, misses) in _lookups.items():
+        stats[variant] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses)
+        }
+    return stats
 
 
 class BaseCache:
@@ -11,6 +51,7 @@ class BaseCache:
     def __init__(self, storage, transaction):
         self._storage = storage
         self._transaction = transaction
+        self._pinned = get_pinned_cache()
 
     def get_key(self, oid=None, container=None, id=None, variant=None):
         key = ''
@@ -41,6 +82,23 @@ class BaseCache:
         '''
         raise NotImplemented()
 
+    def get_generation(self):
+        '''
+        generation of the invalidations, got before loading values to set
+        '''
+        return get_generation()
+
+    def invalidated_since(self, generation, oid=None, container=None, id=None,
+                          variant=None):
+        '''
+        whether the key has been invalidated after generation, values loaded
+        before could be stale and are not set then
+        '''
+        return False
+
+    def pinned_invalidated_since(self, oid, generation):
+        return self._pinned.invalidated_since(oid, generation)
+
     async def clear(self):
         raise NotImplemented()
 
@@ -50,6 +108,38 @@ class BaseCache:
     async def delete_all(self, keys):
         raise NotImplemented()
 
+    async def delete_prefix(self, prefix):
+        '''
+        delete the keys starting with prefix
+        '''
+        raise NotImplemented()
+
+    def record_lookup(self, hit, oid=None, container=None, id=None, variant=None):
+        if variant is None:
+            variant = 'object' if id is None else 'child'
+        lookups = _lookups.setdefault(variant, [0, 0])
+        lookups[0 if hit else 1] += 1
+
+    def get_stats(self):
+        stats = {
+            'lookups': get_lookup_stats(),
+            'pinned': self._pinned.get_stats()
+        }
+        object_cache = get_object_cache()
+        if object_cache is not None:
+            stats['objects'] = object_cache.get_stats()
+        return stats
+
+    def get_parent_id(self, ob):
+        parent_id = getattr(ob.__parent__, '_p_oid', None)
+        if parent_id is None and self._transaction is not None:
+            # objects loaded on their own have a copy of their parent from
+            # the stored state, without oid
+            loaded = self._transaction._loaded_states.get(ob._p_oid)
+            if loaded is not None:
+                parent_id = loaded[1]
+        return parent_id
+
     def get_cache_keys(self, ob, type_='modified'):
         keys = []
 
@@ -61,24 +151,81 @@ class BaseCache:
                 self.get_key(oid=ob.__of__, variant='annotation-keys')
             ]
         else:
+            parent_id = self.get_parent_id(ob)
             if type_ == 'modified':
                 keys = [
                     self.get_key(oid=ob._p_oid),
-                    self.get_key(container=ob.__parent__, id=ob.id)
+                    self.get_key(oid=parent_id, id=ob.id)
                 ]
             elif type_ == 'added':
                 keys = [
-                    self.get_key(container=ob.__parent__, variant='len'),
-                    self.get_key(container=ob.__parent__, variant='keys')
+                    # tombstone of the child
+                    self.get_key(oid=parent_id, id=ob.id),
+                    self.get_key(oid=parent_id, variant='len'),
+                    self.get_key(oid=parent_id, variant='keys')
                 ]
             elif type_ == 'deleted':
                 keys = [
                     self.get_key(oid=ob._p_oid),
-                    self.get_key(container=ob.__parent__, id=ob.id),
-                    self.get_key(container=ob.__parent__, variant='len'),
-                    self.get_key(container=ob.__parent__, variant='keys')
+                    self.get_key(oid=parent_id, id=ob.id),
+                    self.get_key(oid=parent_id, id=ob.id, variant='contains'),
+                    self.get_key(oid=parent_id, variant='len'),
+                    self.get_key(oid=parent_id, variant='keys')
                 ]
         return keys
 
+    def get_transaction_cache_keys(self):
+        '''
+        keys to invalidate for the objects written by the transaction
+        '''
+        keys = []
+        txn = self._transaction
+        for type_, objects in (('modified', txn.savepoint_modified),
+                               ('added', txn.savepoint_added),
+                               ('modified', txn.modified),
+                               ('added', txn.added),
+                               ('deleted', txn.deleted)):
+            for ob in objects.values():
+                keys.extend(self.get_cache_keys(ob, type_))
+        # objects added to the same parent invalidate the same keys
+        return list(OrderedDict.fromkeys(keys))
+
+    async def get_pinned(self, oid):
+        '''
+        pinned records are checked against the tid of the object in the
+        database once they are older than the `validate_interval` setting
+        '''
+        entry = self._pinned.get(oid)
+        if entry is None:
+            return None
+        result, validated = entry
+        generation = self.get_generation()
+        interval = (app_settings.get('pinned_cache') or {}).get('validate_interval', 10)
+        if time.time() - validated > interval:
+            try:
+                tid = await self._storage.get_object_tid(self._transaction, oid)
+            except KeyError:
+                tid = None
+            if tid != result['tid']:
+                self._pinned.delete(oid)
+                return None
+            if not self._pinned.invalidated_since(oid, generation):
+                self._pinned.set(oid, (result, time.time()))
+        return result
+
+    def set_pinned(self, result):
+        self._pinned.set(result['zoid'], (result, time.time()))
+
+    def delete_pinned(self, keys):
+        for key in keys:
+            self._pinned.delete(key)
+
+    def delete_pinned_prefix(self, prefix):
+        self.delete_pinned([key for key in self._pinned.keys() if key.startswith(prefix)])
+
+    def clear_pinned(self):
+        self._pinned.clear()
+
     async def close(self, invalidate=True):
-        pass
+        if invalidate:
+            self.delete_pinned(self.get_transaction_cache_keys())
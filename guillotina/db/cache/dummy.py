@@ -25,3 +25,6 @@ class DummyCache(BaseCache):
 
     async def delete_all(self, keys):
         pass
+
+    async def delete_prefix(self, prefix):
+        pass
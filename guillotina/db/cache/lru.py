@@ -0,0 +1,133 @@
+from collections import OrderedDict
+
+import sys
+
+
+# invalidations of all the caches are stamped with one counter so the
+# generation read before loading a value can be checked against any of them
+_generation = 0
+
+
+def get_generation():
+    return _generation
+
+
+def _next_generation():
+    global _generation
+    _generation += 1
+    return _generation
+
+
+def get_size(value):
+    '''
+    approximate memory used by a cached value, the pickled state is most
+    of the size of records
+    '''
+    if isinstance(value, (bytes, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_size(v) for v in value)
+    if hasattr(value, 'keys') and hasattr(value, 'values'):
+        return sys.getsizeof(value) + sum(get_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    '''
+    Least recently used cache bounded by the approximate size of its values
+    in bytes instead of the number of entries
+    '''
+
+    # number of recently invalidated keys kept to check sets against
+    max_invalidated_keys = 10000
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        # generation of the last invalidation of the recently invalidated keys
+        self._invalidated = OrderedDict()
+        # values loaded before this generation are not trusted anymore
+        self._invalidated_before = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def invalidated_since(self, key, generation):
+        '''
+        whether key has been invalidated after generation, values loaded
+        before are not set since they could be older than the invalidation.
+        Assumed to be the case once the invalidation is not tracked anymore
+        '''
+        return (generation < self._invalidated_before or
+                self._invalidated.get(key, 0) > generation)
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = get_size(value)
+        if size > self.max_size:
+            return
+        self._remove(key)
+        self._data[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def _remove(self, key):
+        try:
+            _, size = self._data.pop(key)
+        except KeyError:
+            return False
+        self.size -= size
+        return True
+
+    def delete(self, key):
+        # keys not in the cache can be being loaded
+        self._invalidated[key] = _next_generation()
+        self._invalidated.move_to_end(key)
+        if len(self._invalidated) > self.max_invalidated_keys:
+            _, generation = self._invalidated.popitem(last=False)
+            self._invalidated_before = generation
+        if self._remove(key):
+            self.invalidations += 1
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+        self._invalidated.clear()
+        self._invalidated_before = _next_generation()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': lookups and self.hits / lookups,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._data),
+            'size': self.size,
+            'max_size': self.max_size
+        }
@@ -0,0 +1,63 @@
+from guillotina import configure
+from guillotina._settings import app_settings
+from guillotina.db.cache.base import BaseCache
+from guillotina.db.cache.lru import LRUCache
+from guillotina.db.interfaces import IStorage
+from guillotina.db.interfaces import IStorageCache
+from guillotina.db.interfaces import ITransaction
+
+
+_lru = None
+
+
+def get_memory_cache():
+    '''
+    the lru is shared by all the transactions of the process
+    '''
+    global _lru
+    if _lru is None:
+        settings = app_settings.get('memory_cache') or {}
+        _lru = LRUCache(settings.get('max_size', 100 * 1024 * 1024))
+    return _lru
+
+
+@configure.adapter(for_=(IStorage, ITransaction), provides=IStorageCache, name="memory")
+class MemoryCache(BaseCache):
+
+    def __init__(self, storage, transaction):
+        super().__init__(storage, transaction)
+        self._lru = get_memory_cache()
+
+    async def get(self, **kwargs):
+        value = self._lru.get(self.get_key(**kwargs))
+        self.record_lookup(value is not None, **kwargs)
+        return value
+
+    async def set(self, value, **kwargs):
+        self._lru.set(self.get_key(**kwargs), value)
+
+    def invalidated_since(self, generation, **kwargs):
+        return self._lru.invalidated_since(self.get_key(**kwargs), generation)
+
+    async def clear(self):
+        self._lru.clear()
+
+    async def delete(self, key):
+        self._lru.delete(key)
+
+    async def delete_all(self, keys):
+        for key in keys:
+            self._lru.delete(key)
+
+    async def delete_prefix(self, prefix):
+        await self.delete_all([key for key in self._lru.keys() if key.startswith(prefix)])
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats['memory'] = self._lru.get_stats()
+        return stats
+
+    async def close(self, invalidate=True):
+        await super().close(invalidate=invalidate)
+        if invalidate:
+            await self.delete_all(self.get_transaction_cache_keys())
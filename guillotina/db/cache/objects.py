@@ -0,0 +1,61 @@
+from guillotina._settings import app_settings
+from guillotina.db.cache.lru import LRUCache
+from zope.interface.declarations import Declaration
+
+import copy
+import datetime
+import decimal
+import uuid
+
+
+_object_cache = None
+
+# values that can be shared by the copies of an object
+IMMUTABLE_TYPES = frozenset([
+    str, bytes, int, float, bool, complex, type(None), frozenset, type,
+    datetime.datetime, datetime.date, datetime.time, datetime.timedelta,
+    decimal.Decimal, uuid.UUID
+])
+
+
+def get_object_cache():
+    '''
+    deserialized objects by (oid, tid), None if it is not enabled
+    '''
+    global _object_cache
+    if _object_cache is None:
+        settings = app_settings.get('object_cache') or {}
+        if not settings.get('max_size'):
+            return None
+        _object_cache = LRUCache(settings['max_size'])
+    return _object_cache
+
+
+def clone_value(value):
+    '''
+    copy of a value sharing everything that can not be mutated, faster
+    than a deepcopy for the str/int/datetime values most objects have
+    '''
+    type_ = type(value)
+    if type_ in IMMUTABLE_TYPES or isinstance(value, Declaration):
+        return value
+    if type_ is dict:
+        return {k: clone_value(v) for k, v in value.items()}
+    if type_ is list:
+        return [clone_value(v) for v in value]
+    if type_ is tuple:
+        return tuple(clone_value(v) for v in value)
+    if type_ is set:
+        return set(value)
+    return copy.deepcopy(value)
+
+
+def clone(ob):
+    '''
+    private copy of a cached object for a transaction
+    '''
+    klass = type(ob)
+    args = getattr(ob, '__getnewargs__', lambda: ())()
+    new = klass.__new__(klass, *args)
+    new.__setstate__(clone_value(ob.__getstate__()))
+    return new
@@ -0,0 +1,93 @@
+from guillotina._settings import app_settings
+from guillotina.utils import resolve_dotted_name
+
+import zlib
+
+
+try:
+    import lz4.frame
+    HAS_LZ4 = True
+except ImportError:
+    HAS_LZ4 = False
+
+
+# compressed states start with this byte followed by the id of the codec,
+# pickles never start with it so uncompressed rows stay readable
+MAGIC = b'\x00'
+
+
+class ZlibCodec:
+    id = b'z'
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Codec:
+    id = b'4'
+    name = 'lz4'
+
+    def compress(self, data):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+_codecs_by_id = {}
+_codecs_by_name = {}
+
+
+def register_codec(codec):
+    '''
+    codecs need an `id`(one byte), a `name` and `compress`/`decompress` methods
+    '''
+    if len(codec.id) != 1:
+        raise ValueError(f'Codec id must be one byte: {codec.id}')
+    _codecs_by_id[codec.id] = codec
+    _codecs_by_name[codec.name] = codec
+
+
+def get_codec(name):
+    if name not in _codecs_by_name:
+        # dotted name of a custom codec
+        codec = resolve_dotted_name(name)
+        if isinstance(codec, type):
+            codec = codec()
+        register_codec(codec)
+        _codecs_by_name[name] = codec
+    return _codecs_by_name[name]
+
+
+register_codec(ZlibCodec())
+if HAS_LZ4:
+    register_codec(LZ4Codec())
+
+
+def encode_state(state):
+    settings = app_settings.get('state_compression') or {}
+    codec_name = settings.get('codec')
+    if codec_name is None or len(state) < settings.get('min_size', 1024):
+        return state
+    codec = get_codec(codec_name)
+    compressed = codec.compress(state)
+    if len(compressed) + 2 >= len(state):
+        # not worth it
+        return state
+    return MAGIC + codec.id + compressed
+
+
+def decode_state(state):
+    if state[:1] != MAGIC:
+        return state
+    codec_id = state[1:2]
+    if codec_id not in _codecs_by_id:
+        raise KeyError(f'No codec registered to decompress state: {codec_id}')
+    return _codecs_by_id[codec_id].decompress(memoryview(state)[2:])
@@ -0,0 +1,47 @@
+from guillotina.db.compression import decode_state
+from guillotina.exceptions import ConflictError
+
+import pickle
+
+
+_marker = object()
+
+
+def get_state(state):
+    '''
+    __getstate__ of a stored state
+    '''
+    return pickle.loads(decode_state(state)).__getstate__()
+
+
+def merge_dicts(old, committed, new):
+    resolved = dict(committed)
+    for key in set(old) | set(new):
+        base = old.get(key, _marker)
+        ours = new.get(key, _marker)
+        if ours is base or ours == base:
+            # not changed by us
+            continue
+        theirs = committed.get(key, _marker)
+        if theirs is not base and theirs != base and theirs != ours:
+            raise ConflictError(f'Conflicting changes to {key}')
+        if ours is _marker:
+            resolved.pop(key, None)
+        else:
+            resolved[key] = ours
+    return resolved
+
+
+def merge_states(old, committed, new):
+    '''
+    three-way merge of the states of an object: the one it was loaded with,
+    the one committed by another transaction since and ours. Changes to
+    different attributes are merged, ConflictError is raised when both
+    changed the same attribute.
+    '''
+    if isinstance(new, tuple):
+        # (instance dict, slots)
+        return tuple(
+            merge_dicts(o or {}, c or {}, n or {}) if n is not None else None
+            for o, c, n in zip(old, committed, new))
+    return merge_dicts(old, committed, new)
@@ -8,16 +8,20 @@ from guillotina.interfaces import IDatabaseConfigurationFactory
 from guillotina.utils import resolve_dotted_name
 
 
+def _convert_dsn(dsn):
+    if isinstance(dsn, str):
+        return dsn
+    return "{scheme}://{user}:{password}@{host}:{port}/{dbname}".format(**dsn)
+
+
 async def _PGConfigurationFactory(key, dbconfig, app,
                                   storage_factory=PostgresqlStorage):
     # b/w compat, we don't use this for storage options anymore
     config = dbconfig.get('configuration', {})
 
-    if isinstance(dbconfig['dsn'], str):
-        dsn = dbconfig['dsn']
-    else:
-        dsn = "{scheme}://{user}:{password}@{host}:{port}/{dbname}".format(
-            **dbconfig['dsn'])
+    dsn = _convert_dsn(dbconfig['dsn'])
+    if 'replicas' in dbconfig:
+        dbconfig['replicas'] = [_convert_dsn(replica) for replica in dbconfig['replicas']]
 
     partition_object = None
     if 'partition' in dbconfig:
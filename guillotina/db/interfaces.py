@@ -30,9 +30,24 @@ class IStorage(Interface):
     async def load(txn, oid):
         pass
 
+    async def open_replica():
+        '''
+        connection to use for read only transactions
+        '''
+
+    async def load_many(txn, oids):
+        '''
+        load records for oids, records not found are not returned
+        '''
+
     async def store(oid, old_serial, writer, obj, txn):
         pass
 
+    async def store_many(txn, objects):
+        '''
+        store ordered list of (oid, old_serial, writer, obj) tuples
+        '''
+
     async def delete(txn, oid):
         pass
 
@@ -45,8 +60,25 @@ class IStorage(Interface):
     async def get_current_tid(txn):
         pass
 
+    async def get_object_tid(txn, oid):
+        '''
+        tid of the object in the database, KeyError if it does not exist
+        '''
+
+    def get_cache():
+        '''
+        cache of the storage not bound to a transaction
+        '''
+
+    def get_cache_stats():
+        '''
+        statistics of the cache of the storage
+        '''
+
     async def get_conflicts(txn, full=False):
-        pass
+        '''
+        records of objects modified or deleted by txn with newer tids
+        '''
 
     async def commit(txn):
         pass
@@ -54,11 +86,28 @@ class IStorage(Interface):
     async def abort(txn):
         pass
 
+    async def savepoint(txn, name):
+        '''
+        create a savepoint of the db transaction of txn
+        '''
+
+    async def rollback_to_savepoint(txn, name):
+        '''
+        roll back the db transaction of txn to the savepoint
+        '''
+
     async def keys(txn, oid):
         pass
 
-    async def get_child(txn, parent_oid, id):
-        pass
+    async def get_child(txn, parent_oid, id, part=None):
+        '''
+        part is the partition of the child when it is known
+        '''
+
+    async def get_children(txn, parent_oid, ids, part=None):
+        '''
+        load records for children ids of parent, missing ids are not returned
+        '''
 
     async def has_key(txn, parent_oid, id):
         pass
@@ -69,13 +118,19 @@ class IStorage(Interface):
     async def items(txn, oid):
         pass
 
-    async def get_annotation(txn, oid, id):
+    async def get_annotation(txn, oid, id, part=None):
         pass
 
+    async def get_annotations(txn, oids, id, part=None):
+        '''
+        load records of the id annotation of the oids, with the oid they
+        annotate as `of`. Objects without the annotation are not returned
+        '''
+
     async def get_annotation_keys(txn, oid):
         pass
 
-    async def write_blob_chunk(txn, bid, oid, chunk_index, data):
+    async def write_blob_chunk(txn, bid, oid, chunk_index, data, part=None):
         pass
 
     async def read_blob_chunk(txn, bid, chunk=0):
@@ -105,6 +160,11 @@ class ITransactionStrategy(Interface):
         Begin transaction, should set ._tid on transaction if supports transactions
         '''
 
+    async def tpc_connect():
+        '''
+        The transaction got its connection, start the transaction on the db
+        '''
+
     async def tpc_vote():
         '''
         Returns true if no conflicts, false if conflicts
@@ -1,3 +1,4 @@
+from guillotina.db.conflicts import merge_states
 from guillotina.db.orm.interfaces import IBaseObject
 from sys import intern
 from zope.interface import implementer
@@ -15,7 +16,8 @@ SPECIAL_NAMES = ('__class__',
                  '__dict__',
                  '__of__',
                  '__setstate__',
-                 '__parent__')
+                 '__parent__',
+                 '__partition_id__')
 
 # And this is an implementation detail of this class; it holds
 # the standard names plus the slot names, allowing for just one
@@ -43,7 +45,11 @@ class BaseObject(object):
     # This slots are NOT going to be on the serialization on the DB
     __slots__ = (
         '__jar', '__oid', '__serial', '__of', '__parent', '__annotations',
-        '__name', '__immutable_cache', '__new_marker', '__locked')
+        '__name', '__immutable_cache', '__new_marker', '__locked', '__part')
+
+    # types setting it get the changes committed by concurrent transactions
+    # merged with theirs by _p_resolve_conflict instead of conflict errors
+    __merge_conflicts__ = False
 
     def __new__(cls, *args, **kw):
         inst = super(BaseObject, cls).__new__(cls)
@@ -57,6 +63,7 @@ class BaseObject(object):
         _OSA(inst, '_BaseObject__immutable_cache', False)
         _OSA(inst, '_BaseObject__new_marker', False)
         _OSA(inst, '_BaseObject__locked', False)
+        _OSA(inst, '_BaseObject__part', None)
         return inst
 
     def __repr__(self):
@@ -189,6 +196,14 @@ class BaseObject(object):
         return (copyreg.__newobj__,
                 (type(self),) + gna(), self.__getstate__())
 
+    def _p_resolve_conflict(self, old_state, committed_state, new_state):
+        '''
+        state to commit when another transaction committed the object after
+        it was loaded with old_state, raise ConflictError if it can not be
+        resolved. By default changes to different attributes are merged.
+        '''
+        return merge_states(old_state, committed_state, new_state)
+
     def _p_register(self):
         jar = _OGA(self, '_BaseObject__jar')
         if jar is not None:
@@ -260,3 +275,16 @@ class BaseObject(object):
         _OSA(self, '_BaseObject__locked', False)
 
     __locked__ = property(_get_locked, _set_locked, _del_locked)
+
+    # __partition_id__: partition the object is stored in, set when
+    # the object is loaded or stored. None until then
+    def _get_part(self):
+        return _OGA(self, '_BaseObject__part')
+
+    def _set_part(self, value):
+        _OSA(self, '_BaseObject__part', value)
+
+    def _del_part(self):
+        _OSA(self, '_BaseObject__part', None)
+
+    __partition_id__ = property(_get_part, _set_part, _del_part)
@@ -1,9 +1,29 @@
+from guillotina.db.cache.objects import clone
+from guillotina.db.cache.objects import get_object_cache
+from guillotina.db.compression import decode_state
+
 import pickle
 
 
+def _loads(result):
+    object_cache = get_object_cache()
+    if object_cache is None:
+        return pickle.loads(decode_state(result['state']))
+    key = (result['zoid'], result['tid'])
+    # cached objects are never returned, only copies of them
+    template = object_cache.get(key)
+    if template is None:
+        template = pickle.loads(decode_state(result['state']))
+        object_cache.set(key, template, size=len(result['state']))
+    return clone(template)
+
+
 def reader(result):
-    obj = pickle.loads(result['state'])
+    obj = _loads(result)
     obj._p_oid = result['zoid']
     obj._p_serial = result['tid']
     obj.__name__ = result['id']
+    # asyncpg records have no get()
+    if 'part' in result.keys() and result['part'] is not None:
+        obj.__partition_id__ = result['part']
     return obj
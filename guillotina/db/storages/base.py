@@ -1,3 +1,8 @@
+from guillotina.component import getSiteManager
+from guillotina.db.interfaces import IStorageCache
+from guillotina.db.interfaces import ITransaction
+from guillotina.exceptions import InvalidSavepoint
+from zope.interface import providedBy
 
 
 class BaseStorage(object):
@@ -14,3 +19,66 @@ class BaseStorage(object):
 
     def read_only(self):
         return self._read_only
+
+    def get_cache(self):
+        '''
+        cache of the storage, not bound to a transaction, to apply
+        invalidations from other processes
+        '''
+        factory = getSiteManager().adapters.lookup(
+            (providedBy(self), ITransaction), IStorageCache, name=self._cache_strategy)
+        return factory(self, None)
+
+    def get_cache_stats(self):
+        stats = self.get_cache().get_stats()
+        stats['strategy'] = self._cache_strategy
+        return stats
+
+    async def open_replica(self):
+        # storages without replicas serve read only transactions themselves
+        return await self.open()
+
+    def is_replica_connection(self, con):
+        return False
+
+    async def store_many(self, txn, objects):
+        '''
+        Store a list of (oid, old_serial, writer, obj) tuples in order.
+        Storages that support it should batch the writes.
+        '''
+        for oid, old_serial, writer, obj in objects:
+            await self.store(oid, old_serial, writer, obj, txn)
+
+    async def savepoint(self, txn, name):
+        raise InvalidSavepoint(f'{self.__class__.__name__} does not support savepoints')
+
+    async def rollback_to_savepoint(self, txn, name):
+        raise InvalidSavepoint(f'{self.__class__.__name__} does not support savepoints')
+
+    async def get_object_tid(self, txn, oid):
+        return (await self.load(txn, oid))['tid']
+
+    async def load_many(self, txn, oids):
+        results = []
+        for oid in oids:
+            try:
+                results.append(await self.load(txn, oid))
+            except KeyError:
+                pass
+        return results
+
+    async def get_children(self, txn, parent_oid, ids, part=None):
+        results = []
+        for id in ids:
+            result = await self.get_child(txn, parent_oid, id, part=part)
+            if result is not None:
+                results.append(result)
+        return results
+
+    async def get_annotations(self, txn, oids, id, part=None):
+        results = []
+        for oid in oids:
+            result = await self.get_annotation(txn, oid, id, part=part)
+            if result is not None:
+                results.append(dict(result, of=oid))
+        return results
@@ -1,6 +1,7 @@
 from guillotina import glogging
 from guillotina.db.storages import pg
 from guillotina.exceptions import ConflictError
+from guillotina.exceptions import InvalidSavepoint
 from guillotina.exceptions import TIDConflictError
 
 import asyncpg
@@ -52,6 +53,7 @@ RETURNING tid, otid"""
 
 
 NEXT_TID = """SELECT unique_rowid()"""
+NEXT_TID_BLOCK = """SELECT unique_rowid() FROM generate_series(1, $1::int)"""
 MAX_TID = "SELECT COALESCE(MAX(tid), 0) from objects;"
 
 DELETE_FROM_BLOBS = """DELETE FROM blobs WHERE zoid = $1::varchar(32);"""
@@ -67,57 +69,88 @@ DELETE_BY_PARENT_OID = '''DELETE FROM objects
 WHERE parent_id = $1::varchar(32);'''
 GET_OIDS_BY_PARENT = '''SELECT zoid FROM objects
 WHERE parent_id = $1::varchar(32);'''
+# keyset pagination, $2 is the last zoid of the previous batch
 BATCHED_GET_CHILDREN_OIDS = """SELECT zoid FROM objects
-WHERE parent_id = $1::varchar(32)
+WHERE parent_id = $1::varchar(32) AND zoid > $2::varchar(32)
 ORDER BY zoid
-LIMIT $2::int
-OFFSET $3::int"""
+LIMIT $3::int"""
+
+BATCHED_GET_CHILDREN_OIDS_OF_PARENTS = """SELECT zoid FROM objects
+WHERE parent_id = ANY($1::varchar(32)[]) AND zoid > $2::varchar(32)
+ORDER BY zoid
+LIMIT $3::int"""
 
 DELETE_FROM_OBJECTS = """
     DELETE FROM objects WHERE zoid = $1::varchar(32);
 """
+DELETE_OBJECTS_AND_ANNOTATIONS = """
+    DELETE FROM objects
+    WHERE zoid = ANY($1::varchar(32)[]) OR of = ANY($1::varchar(32)[]);
+"""
+DELETE_BLOBS_OF_OBJECTS = """
+    DELETE FROM blobs WHERE zoid = ANY($1::varchar(32)[]);
+"""
 
 
-async def iterate_children(conn, parent_oid, page_size=1000):
+async def iterate_children(conn, parent_oid, page_size=1000, cursor=None):
     smt = await conn.prepare(BATCHED_GET_CHILDREN_OIDS)
-    page = 1
-    results = await smt.fetch(parent_oid, page_size, (page - 1) * page_size)
+    results = await smt.fetch(parent_oid, cursor or '', page_size)
     while len(results) > 0:
         for record in results:
             yield record['zoid']
-        page += 1
-        results = await smt.fetch(parent_oid, page_size, (page - 1) * page_size)
+        cursor = results[-1]['zoid']
+        results = await smt.fetch(parent_oid, cursor, page_size)
 
 
-class CockroachVacuum(pg.PGVacuum):
+async def iterate_children_of_parents(conn, parent_oids, page_size=1000):
+    smt = await conn.prepare(BATCHED_GET_CHILDREN_OIDS_OF_PARENTS)
+    results = await smt.fetch(parent_oids, '', page_size)
+    while len(results) > 0:
+        for record in results:
+            yield record['zoid']
+        results = await smt.fetch(parent_oids, results[-1]['zoid'], page_size)
+
 
-    async def vacuum_children(self, conn, parent_oid):
-        async for child_oid in iterate_children(conn, parent_oid):
-            await self.vacuum_children(conn, child_oid)
-        await conn.execute(DELETE_BY_PARENT_OID, parent_oid)
+class CockroachVacuum(pg.PGVacuum):
 
-    async def vacuum(self, oid):
+    async def get_children_bottom_up(self, conn, oids):
+        '''
+        Walk the trees level by level, no recursive queries on cockroach
         '''
-        Options for vacuuming...
-        1. Recursively go through objects, deleting children as you find them,
-           checking if they have their own children and so on...
-           - possibly more ram usage
-           - more application logic
-           - need to batch children
-        2. Delete initial children, then delete objects that are dangling(parent_id missing)
-           - less error prone
-           - self-correcting(will correct deletes that went wrong before)
-           - more overhead on cockroach
-
-        We're choosing #1 for now....
-
-        Long term, might need a combination of both
+        levels = []
+        parents = oids
+        while len(parents) > 0:
+            children = []
+            for idx in range(0, len(parents), self._chunk_size):
+                async for zoid in iterate_children_of_parents(
+                        conn, parents[idx:idx + self._chunk_size], self._chunk_size):
+                    children.append(zoid)
+            levels.append(children)
+            parents = children
+        zoids = []
+        for level in reversed(levels):
+            zoids.extend(level)
+        return zoids
+
+    async def vacuum_many(self, oids):
+        '''
+        No cascade support, the deleted objects are already gone so we need
+        to delete their children, annotations and blobs ourselves.
+
+        Children are deleted bottom-up in chunks so an interrupted vacuum
+        does not leave children without parents behind.
         '''
         conn = await self._storage.open()
         try:
-            await self.vacuum_children(conn, oid)
+            zoids = await self.get_children_bottom_up(conn, oids)
         finally:
-            await self._storage.close(conn)
+            await self._close(conn)
+        # deleted objects last for their annotations
+        await self._delete_chunks(zoids + list(oids))
+
+    async def delete_objects(self, conn, zoids):
+        await conn.execute(DELETE_OBJECTS_AND_ANNOTATIONS, zoids)
+        await conn.execute(DELETE_BLOBS_OF_OBJECTS, zoids)
 
 
 class CockroachDBTransaction:
@@ -215,12 +248,31 @@ class CockroachStorage(pg.PostgresqlStorage):
                            f'({transaction_strategy}). Forcing to `novote` strategy')
             transaction_strategy = 'novote'
         kwargs['transaction_strategy'] = transaction_strategy
+        if kwargs.get('cache_invalidations') == 'poll':
+            # deleted objects are removed instead of trashed with the tid
+            # of the transaction, polls would not see them
+            logger.warning('Polling cache invalidations is not supported by '
+                           'cockroachdb, deletions can not be polled. Cache '
+                           'invalidations are disabled')
+        elif kwargs.get('cache_invalidations'):
+            logger.warning('LISTEN/NOTIFY is not supported by cockroachdb, '
+                           'cache invalidations are disabled')
+        kwargs['cache_invalidations'] = False
+        if kwargs.get('partitions'):
+            logger.warning('Table partitioning is not supported by cockroachdb, '
+                           'ignoring `partitions` option')
+            kwargs['partitions'] = 0
         super().__init__(*args, **kwargs)
 
     async def initialize_tid_statements(self):
         self._stmt_next_tid = await self._read_conn.prepare(NEXT_TID)
+        self._stmt_next_tid_block = await self._read_conn.prepare(NEXT_TID_BLOCK)
         self._stmt_max_tid = await self._read_conn.prepare(MAX_TID)
 
+    async def get_replica_lag(self, conn):
+        # any node of the cluster gives consistent reads
+        return 0
+
     async def open(self):
         conn = await super().open()
         if self._transaction_strategy in ('none', 'tidonly', 'lock'):
@@ -242,9 +294,7 @@ class CockroachStorage(pg.PostgresqlStorage):
         p = writer.serialize()  # This calls __getstate__ of obj
         if len(p) >= self._large_record_size:
             logger.warning(f"Large object {obj.__class__}: {len(p)}")
-        part = writer.part
-        if part is None:
-            part = 0
+        part = self.get_part(writer)
 
         update = False
         statement_sql = NAIVE_UPSERT
@@ -253,8 +303,8 @@ class CockroachStorage(pg.PostgresqlStorage):
             statement_sql = UPDATE
             update = True
 
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(statement_sql)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, statement_sql)
             try:
                 result = await smt.fetch(
                     oid,                 # The OID of the object
@@ -284,13 +334,25 @@ class CockroachStorage(pg.PostgresqlStorage):
                     f'be an edge case. This should resolve on request retry.\n'
                     f'{conflict_summary}')
 
+    async def store_many(self, txn, objects):
+        # no batched unnest upserts on cockroach, store objects one by one
+        for oid, old_serial, writer, obj in objects:
+            await self.store(oid, old_serial, writer, obj, txn)
+
     async def delete(self, txn, oid):
         # no cascade support, so we push to vacuum
-        async with txn._lock:
-            await txn._db_conn.execute(DELETE_FROM_OBJECTS, oid)
-            await txn._db_conn.execute(DELETE_FROM_BLOBS, oid)
+        async with txn.query() as conn:
+            await conn.execute(DELETE_FROM_OBJECTS, oid)
+            await conn.execute(DELETE_FROM_BLOBS, oid)
         txn.add_after_commit_hook(self._txn_oid_commit_hook, [oid])
 
+    async def savepoint(self, txn, name):
+        # only the savepoint of transaction restarts is supported
+        raise InvalidSavepoint('Cockroach does not support savepoints')
+
+    async def rollback_to_savepoint(self, txn, name):
+        raise InvalidSavepoint('Cockroach does not support savepoints')
+
     async def commit(self, transaction):
         if transaction._db_txn is not None:
             async with transaction._lock:
@@ -93,7 +93,9 @@ class DummyStorage(BaseStorage):
             'json': json,
             'state': p
         }
-        txn._db_txn[oid] = tobj
+        # the first query of the transaction starts it
+        async with txn.query():
+            txn._db_txn[oid] = tobj
         return txn._tid, len(p)
 
     async def delete(self, txn, oid):
@@ -141,7 +143,7 @@ class DummyStorage(BaseStorage):
             keys.append(obj['id'])
         return keys
 
-    async def get_child(self, txn, parent_id, id):
+    async def get_child(self, txn, parent_id, id, part=None):
         oid = self.PARENT_ID_ID[(parent_id, id)]
         return await self.load(txn, oid)
 
@@ -156,7 +158,7 @@ class DummyStorage(BaseStorage):
             obj = await self.load(txn, record)
             yield obj
 
-    async def get_annotation(self, txn, oid, id):
+    async def get_annotation(self, txn, oid, id, part=None):
         oid = self.OF_ID[(oid, id)]
         return await self.load(txn, oid)
 
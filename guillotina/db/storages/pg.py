@@ -2,6 +2,7 @@ from asyncio import shield
 from guillotina.db import TRASHED_ID
 from guillotina.db.interfaces import IStorage
 from guillotina.db.storages.base import BaseStorage
+from guillotina.db.storages.utils import get_partition_definitions
 from guillotina.db.storages.utils import get_table_definition
 from guillotina.exceptions import ConflictError
 from guillotina.exceptions import TIDConflictError
@@ -9,10 +10,13 @@ from zope.interface import implementer
 
 import asyncio
 import asyncpg
+import asyncpg.prepared_stmt
+import collections
 import concurrent
 import logging
 import time
 import ujson
+import uuid
 
 
 log = logging.getLogger("guillotina.storage")
@@ -21,11 +25,23 @@ log = logging.getLogger("guillotina.storage")
 # we can not use FOR UPDATE or FOR SHARE unfortunately because
 # it can cause deadlocks on the database--we need to resolve them ourselves
 GET_OID = """
-    SELECT zoid, tid, state_size, resource, of, parent_id, id, type, state
+    SELECT zoid, tid, state_size, part, resource, of, parent_id, id, type, state
     FROM objects
     WHERE zoid = $1::varchar(32)
     """
 
+GET_OBJECT_TID = """
+    SELECT tid
+    FROM objects
+    WHERE zoid = $1::varchar(32)
+    """
+
+GET_OIDS = """
+    SELECT zoid, tid, state_size, part, resource, of, parent_id, id, type, state
+    FROM objects
+    WHERE zoid = ANY($1::varchar(32)[])
+    """
+
 GET_CHILDREN_KEYS = """
     SELECT id
     FROM objects
@@ -39,11 +55,30 @@ GET_ANNOTATIONS_KEYS = """
     """
 
 GET_CHILD = """
-    SELECT zoid, tid, state_size, resource, type, state, id
+    SELECT zoid, tid, state_size, part, resource, type, state, id
     FROM objects
     WHERE parent_id = $1::varchar(32) AND id = $2::text
     """
 
+GET_CHILDREN_BY_IDS = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id
+    FROM objects
+    WHERE parent_id = $1::varchar(32) AND id = ANY($2::text[])
+    """
+
+# with the partition key so partitions are pruned in partitioned databases
+GET_CHILD_IN_PARTITION = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id
+    FROM objects
+    WHERE parent_id = $1::varchar(32) AND id = $2::text AND part = $3::bigint
+    """
+
+GET_CHILDREN_BY_IDS_IN_PARTITION = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id
+    FROM objects
+    WHERE parent_id = $1::varchar(32) AND id = ANY($2::text[]) AND part = $3::bigint
+    """
+
 EXIST_CHILD = """
     SELECT zoid
     FROM objects
@@ -52,18 +87,36 @@ EXIST_CHILD = """
 
 
 HAS_OBJECT = """
-    SELECT zoid
+    SELECT zoid, part
     FROM objects
     WHERE zoid = $1::varchar(32)
     """
 
 
 GET_ANNOTATION = """
-    SELECT zoid, tid, state_size, resource, type, state, id
+    SELECT zoid, tid, state_size, part, resource, type, state, id
     FROM objects
     WHERE of = $1::varchar(32) AND id = $2::text
     """
 
+GET_ANNOTATION_IN_PARTITION = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id
+    FROM objects
+    WHERE of = $1::varchar(32) AND id = $2::text AND part = $3::bigint
+    """
+
+GET_ANNOTATIONS_OF = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id, of
+    FROM objects
+    WHERE of = ANY($1::varchar(32)[]) AND id = $2::text
+    """
+
+GET_ANNOTATIONS_OF_IN_PARTITION = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id, of
+    FROM objects
+    WHERE of = ANY($1::varchar(32)[]) AND id = $2::text AND part = $3::bigint
+    """
+
 
 def _wrap_return_count(txt):
     return """WITH rows AS (
@@ -95,6 +148,9 @@ DO UPDATE SET
 UPSERT = _wrap_return_count(NAIVE_UPSERT + """
     WHERE
         tid = EXCLUDED.otid""")
+# partitioned tables only have unique constraints including the partition key
+PARTITIONED_NAIVE_UPSERT = _wrap_return_count(
+    NAIVE_UPSERT.replace('ON CONFLICT (zoid)', 'ON CONFLICT (part, zoid)'))
 NAIVE_UPSERT = _wrap_return_count(NAIVE_UPSERT)
 
 
@@ -119,7 +175,61 @@ UPDATE = _wrap_return_count(NAIVE_UPDATE + """ AND tid = $7::int""")
 NAIVE_UPDATE = _wrap_return_count(NAIVE_UPDATE)
 
 
+_STORE_COLUMNS = """$1::varchar(32)[], $2::bigint[], $3::bigint[], $4::bigint[], $5::boolean[],
+    $6::varchar(32)[], $7::bigint[], $8::varchar(32)[], $9::text[], $10::text[],
+    $11::json[], $12::bytea[]"""
+
+
+# batched upsert of many objects in one statement, no tid check
+BATCHED_NAIVE_UPSERT = f"""
+INSERT INTO objects
+(zoid, tid, state_size, part, resource, of, otid, parent_id, id, type, json, state)
+SELECT * FROM unnest(
+    {_STORE_COLUMNS})
+ON CONFLICT (zoid)
+DO UPDATE SET
+    tid = EXCLUDED.tid,
+    state_size = EXCLUDED.state_size,
+    part = EXCLUDED.part,
+    resource = EXCLUDED.resource,
+    of = EXCLUDED.of,
+    otid = EXCLUDED.otid,
+    parent_id = EXCLUDED.parent_id,
+    id = EXCLUDED.id,
+    type = EXCLUDED.type,
+    json = EXCLUDED.json,
+    state = EXCLUDED.state
+RETURNING zoid"""
+PARTITIONED_BATCHED_NAIVE_UPSERT = BATCHED_NAIVE_UPSERT.replace(
+    'ON CONFLICT (zoid)', 'ON CONFLICT (part, zoid)')
+
+
+# batched update of many objects in one statement, only rows with matching
+# tids are updated so missing zoids in the result are tid conflicts
+BATCHED_UPDATE = f"""
+UPDATE objects
+SET
+    tid = u.tid,
+    state_size = u.state_size,
+    part = u.part,
+    resource = u.resource,
+    of = u.of,
+    otid = u.otid,
+    parent_id = u.parent_id,
+    id = u.id,
+    type = u.type,
+    json = u.json,
+    state = u.state
+FROM unnest(
+    {_STORE_COLUMNS}
+) AS u (zoid, tid, state_size, part, resource, of, otid, parent_id, id, type, json, state)
+WHERE
+    objects.zoid = u.zoid AND objects.tid = u.otid
+RETURNING objects.zoid"""
+
+
 NEXT_TID = "SELECT nextval('tid_sequence');"
+NEXT_TID_BLOCK = "SELECT nextval('tid_sequence') FROM generate_series(1, $1::int);"
 MAX_TID = "SELECT last_value FROM tid_sequence;"
 
 
@@ -133,18 +243,18 @@ NUM_RESOURCES = "SELECT count(*) FROM objects WHERE resource is TRUE"
 
 NUM_RESOURCES_BY_TYPE = "SELECT count(*) FROM objects WHERE type=$1::TEXT"
 
-RESOURCES_BY_TYPE = """
-    SELECT zoid, tid, state_size, resource, type, state, id
+# keyset pagination, $2 is the last zoid of the previous batch
+BATCHED_RESOURCES_BY_TYPE = """
+    SELECT zoid, tid, state_size, part, resource, type, state, id
     FROM objects
-    WHERE type=$1::TEXT
+    WHERE type=$1::TEXT AND zoid > $2::varchar(32)
     ORDER BY zoid
-    LIMIT $2::int
-    OFFSET $3::int
+    LIMIT $3::int
     """
 
 
 GET_CHILDREN = """
-    SELECT zoid, tid, state_size, resource, type, state, id
+    SELECT zoid, tid, state_size, part, resource, type, state, id
     FROM objects
     WHERE parent_id = $1::VARCHAR(32)
     """
@@ -158,6 +268,58 @@ WHERE
     zoid = $1::varchar(32)
 """
 
+# deleted objects get the tid of the transaction so polling finds them
+TRASH_PARENT_ID_AND_TID = f"""
+UPDATE objects
+SET
+    parent_id = '{TRASHED_ID}',
+    tid = $2::bigint
+WHERE
+    zoid = $1::varchar(32)
+"""
+
+# the partition of the object prunes the other partitions
+PARTITIONED_TRASH_PARENT_ID = f"""
+UPDATE objects
+SET
+    parent_id = '{TRASHED_ID}'
+WHERE
+    zoid = $1::varchar(32) AND part = $2::bigint
+"""
+
+PARTITIONED_TRASH_PARENT_ID_AND_TID = f"""
+UPDATE objects
+SET
+    parent_id = '{TRASHED_ID}',
+    tid = $3::bigint
+WHERE
+    zoid = $1::varchar(32) AND part = $2::bigint
+"""
+
+
+# objects moved to another container are updated with its partition, the
+# objects in their trees, their annotations and blobs are moved along
+MOVE_TREES_TO_PARTITION = """
+WITH RECURSIVE tree (zoid) AS (
+    SELECT zoid
+    FROM objects
+    WHERE zoid = ANY($1::varchar(32)[])
+  UNION ALL
+    SELECT objects.zoid
+    FROM objects
+    JOIN tree ON objects.parent_id = tree.zoid
+), moved AS (
+    UPDATE objects
+    SET part = $2::bigint
+    WHERE (zoid IN (SELECT zoid FROM tree) OR of IN (SELECT zoid FROM tree))
+        AND part != $2::bigint
+    RETURNING zoid
+)
+UPDATE blobs
+SET part = $2::bigint
+WHERE zoid IN (SELECT zoid FROM tree) AND part != $2::bigint
+"""
+
 
 INSERT_BLOB_CHUNK = """
     INSERT INTO blobs
@@ -165,6 +327,12 @@ INSERT_BLOB_CHUNK = """
     VALUES ($1::VARCHAR(32), $2::VARCHAR(32), $3::INT, $4::BYTEA)
 """
 
+PARTITIONED_INSERT_BLOB_CHUNK = """
+    INSERT INTO blobs
+    (bid, zoid, chunk_index, data, part)
+    VALUES ($1::VARCHAR(32), $2::VARCHAR(32), $3::INT, $4::BYTEA, $5::BIGINT)
+"""
+
 
 READ_BLOB_CHUNKS = """
     SELECT * from blobs
@@ -197,13 +365,39 @@ TXN_CONFLICTS_FULL = """
     WHERE tid > $1
     """
 
-BATCHED_GET_CHILDREN_KEYS = """
-    SELECT id
+POLL_INVALIDATIONS = """
+    SELECT zoid, tid, of, parent_id, id
     FROM objects
-    WHERE parent_id = $1::varchar(32)
+    WHERE tid > $1
+    """
+
+# conflicts only on the objects written by a transaction, rows that do
+# not have the serial the transaction loaded them with anymore. $3 is the
+# tid of the transaction, rows it stored, or trashed in poll mode, have it
+TXN_CONFLICTS_ON_OIDS = """
+    SELECT objects.zoid, objects.tid, state_size, resource, type, id
+    FROM objects
+    JOIN unnest($1::varchar(32)[], $2::bigint[]) AS txn_objects (zoid, serial)
+    ON objects.zoid = txn_objects.zoid
+    WHERE objects.tid != txn_objects.serial AND objects.tid != $3::bigint
+    """
+
+
+TXN_CONFLICTS_ON_OIDS_FULL = """
+    SELECT objects.zoid, objects.tid, state_size, resource, type, state, id
+    FROM objects
+    JOIN unnest($1::varchar(32)[], $2::bigint[]) AS txn_objects (zoid, serial)
+    ON objects.zoid = txn_objects.zoid
+    WHERE objects.tid != txn_objects.serial AND objects.tid != $3::bigint
+    """
+
+# keyset pagination, $2 is the last zoid of the previous batch
+BATCHED_GET_CHILDREN_KEYS_AFTER = """
+    SELECT zoid, id
+    FROM objects
+    WHERE parent_id = $1::varchar(32) AND zoid > $2::varchar(32)
     ORDER BY zoid
-    LIMIT $2::int
-    OFFSET $3::int
+    LIMIT $3::int
     """
 
 DELETE_OBJECT = f"""
@@ -211,10 +405,40 @@ DELETE FROM objects
 WHERE zoid = $1::varchar(32);
 """
 
+DELETE_OBJECTS = """
+DELETE FROM objects
+WHERE zoid = ANY($1::varchar(32)[]);
+"""
+
+# partitioned tables have no foreign keys to cascade deletes
+DELETE_OBJECTS_AND_ANNOTATIONS = """
+DELETE FROM objects
+WHERE zoid = ANY($1::varchar(32)[]) OR of = ANY($1::varchar(32)[]);
+"""
+
+DELETE_BLOBS_OF_OBJECTS = """
+DELETE FROM blobs WHERE zoid = ANY($1::varchar(32)[]);
+"""
+
 GET_TRASHED_OBJECTS = f"""
 SELECT zoid from objects where parent_id = '{TRASHED_ID}';
 """
 
+# all the objects of trashed trees, deepest first so they can be deleted
+# bottom-up without cascading
+GET_TRASHED_TREES = f"""
+WITH RECURSIVE tree (zoid, depth) AS (
+    SELECT zoid, 0
+    FROM objects
+    WHERE zoid = ANY($1::varchar(32)[]) AND parent_id = '{TRASHED_ID}'
+  UNION ALL
+    SELECT objects.zoid, tree.depth + 1
+    FROM objects
+    JOIN tree ON objects.parent_id = tree.zoid
+)
+SELECT zoid FROM tree ORDER BY depth DESC;
+"""
+
 CREATE_TRASH = f'''
 INSERT INTO objects (zoid, tid, state_size, part, resource, type)
 SELECT '{TRASHED_ID}', 0, 0, 0, FALSE, 'TRASH_REF'
@@ -223,68 +447,151 @@ RETURNING id;
 '''
 
 
+# seconds of replication lag of a standby, 0 when it has replayed all it received
+REPLICA_LAG = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_NOTIFY_PAYLOAD_SIZE = 7999
+
+
 # how long to wait before trying to recover bad connections
 BAD_CONNECTION_RESTART_DELAY = 0.25
 
 
 class PGVacuum:
 
-    def __init__(self, storage, loop):
+    # number of trashed oids taken from the queue at once
+    _batch_size = 100
+    # number of objects deleted by statement
+    _chunk_size = 500
+    # throttle deletes, 0 means no throttling
+    _rows_per_second = 0
+
+    def __init__(self, storage, loop, batch_size=None, chunk_size=None,
+                 rows_per_second=None):
         self._storage = storage
         self._loop = loop
         self._queue = asyncio.Queue(loop=loop)
         self._active = False
         self._closed = False
+        if batch_size is not None:
+            self._batch_size = batch_size
+        if chunk_size is not None:
+            self._chunk_size = chunk_size
+        if rows_per_second is not None:
+            self._rows_per_second = rows_per_second
+        self._lag = 0
+        self._objects_deleted = 0
 
     @property
     def active(self):
         return self._active
 
+    def get_stats(self):
+        return {
+            'queue_size': self._queue.qsize(),
+            'lag': self._lag,
+            'active': self._active,
+            'objects_deleted': self._objects_deleted
+        }
+
     async def initialize(self):
         # get existing trashed objects, push them on the queue...
         # there might be contention, but that is okay
         conn = await self._storage.open()
         try:
             for record in await conn.fetch(GET_TRASHED_OBJECTS):
-                await self._queue.put(record['zoid'])
+                await self.add_to_queue(record['zoid'])
         except Exception:
             log.warn('Error deleting trashed object', exc_info=True)
         finally:
             await self._storage.close(conn)
 
         while not self._closed:
+            batch = []
             try:
-                oid = await self._queue.get()
+                batch = await self._get_batch()
                 self._active = True
-                await self.vacuum(oid)
+                started = time.time()
+                deleted = self._objects_deleted
+                await self.vacuum_many([oid for oid, _ in batch])
+                log.info(f'Vacuumed {len(batch)} trashed objects, deleted '
+                         f'{self._objects_deleted - deleted} rows in '
+                         f'{time.time() - started:.2f}s. Queue size: '
+                         f'{self._queue.qsize()}, lag: {self._lag:.2f}s, '
+                         f'rows deleted: {self._objects_deleted}')
             except (concurrent.futures.CancelledError, RuntimeError):
                 pass  # task was cancelled, probably because we're shutting down
             except Exception:
-                log.warning(f'Error vacuuming oid {oid}', exc_info=True)
+                log.warning(f'Error vacuuming oids {batch}', exc_info=True)
             finally:
                 self._active = False
-                try:
-                    self._queue.task_done()
-                except ValueError:
-                    pass
+                for _ in batch:
+                    try:
+                        self._queue.task_done()
+                    except ValueError:
+                        pass
+
+    async def _get_batch(self):
+        batch = [await self._queue.get()]
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        self._lag = time.time() - batch[0][1]
+        return batch
 
     async def add_to_queue(self, oid):
-        await self._queue.put(oid)
+        await self._queue.put((oid, time.time()))
 
     async def vacuum(self, oid):
+        await self.vacuum_many([oid])
+
+    async def vacuum_many(self, oids):
         '''
         DELETED objects has parent id changed to the trashed ob for the oid...
         '''
         conn = await self._storage.open()
         try:
-            await conn.execute(DELETE_OBJECT, oid)
-        except Exception:
-            log.warn('Error deleting trashed object', exc_info=True)
+            zoids = [r['zoid'] for r in await conn.fetch(GET_TRASHED_TREES, oids)]
         finally:
+            await self._close(conn)
+        await self._delete_chunks(zoids)
+
+    async def delete_objects(self, conn, zoids):
+        if self._storage.partitioned:
+            await conn.execute(DELETE_OBJECTS_AND_ANNOTATIONS, zoids)
+            await conn.execute(DELETE_BLOBS_OF_OBJECTS, zoids)
+        else:
+            await conn.execute(DELETE_OBJECTS, zoids)
+
+    async def _delete_chunks(self, zoids):
+        for idx in range(0, len(zoids), self._chunk_size):
+            chunk = zoids[idx:idx + self._chunk_size]
+            # do not keep a connection while throttling
+            conn = await self._storage.open()
             try:
-                await self._storage.close(conn)
-            except asyncpg.exceptions.ConnectionDoesNotExistError:
-                pass
+                await self.delete_objects(conn, chunk)
+            except Exception:
+                log.warn('Error deleting trashed objects', exc_info=True)
+            finally:
+                await self._close(conn)
+            self._objects_deleted += len(chunk)
+            if self._rows_per_second:
+                await asyncio.sleep(len(chunk) / self._rows_per_second)
+
+    async def _close(self, conn):
+        try:
+            await self._storage.close(conn)
+        except asyncpg.exceptions.ConnectionDoesNotExistError:
+            pass
 
     async def finalize(self):
         self._closed = True
@@ -313,7 +620,12 @@ class PostgresqlStorage(BaseStorage):
     _pool_size = None
     _pool = None
     _large_record_size = 1 << 24
+    _replica_lag_check_interval = 1
+    _store_batch_size = 250
+    _invalidation_channel = 'guillotina_invalidations'
+    _invalidation_check_interval = 5
     _vacuum_class = PGVacuum
+    _vacuum = None
 
     _object_schema = {
         'zoid': 'VARCHAR(32) NOT NULL PRIMARY KEY',
@@ -349,9 +661,35 @@ class PostgresqlStorage(BaseStorage):
         'CREATE SEQUENCE IF NOT EXISTS tid_sequence;'
     ]
 
+    # partitioned tables can not be referenced by foreign keys and only
+    # have unique indexes including the partition key. zoids stay unique
+    # since objects are only inserted with new oids and updates move rows
+    # between partitions, lookups by zoid alone use the index on it
+    _partitioned_object_schema = dict(_object_schema, **{
+        'zoid': 'VARCHAR(32) NOT NULL',
+        'of': 'VARCHAR(32)',
+        'parent_id': 'VARCHAR(32)'
+    })
+
+    _partitioned_blob_schema = dict(_blob_schema, **{
+        'zoid': 'VARCHAR(32) NOT NULL',
+        'part': 'BIGINT NOT NULL'
+    })
+
+    _partitioned_initialize_statements = [
+        'CREATE INDEX IF NOT EXISTS object_zoid ON objects (zoid);'
+    ]
+
     def __init__(self, dsn=None, partition=None, read_only=False, name=None,
                  pool_size=13, transaction_strategy='resolve',
-                 conn_acquire_timeout=20, cache_strategy='dummy', **options):
+                 conn_acquire_timeout=20, cache_strategy='dummy', replicas=None,
+                 replica_max_lag=10, tid_block_size=1, vacuum=None, partitions=0,
+                 cache_invalidations=None, cache_max_staleness=5, cache_poll_lookback=60,
+                 statement_cache_size=100, **options):
+        if tid_block_size > 1 and transaction_strategy == 'simple':
+            log.warning('The `simple` transaction strategy needs tids ordered '
+                        'across workers, not allocating tids in blocks')
+            tid_block_size = 1
         super(PostgresqlStorage, self).__init__(
             read_only, transaction_strategy=transaction_strategy,
             cache_strategy=cache_strategy)
@@ -366,21 +704,79 @@ class PostgresqlStorage(BaseStorage):
         self._options = options
         self._connection_options = {}
         self._connection_initialized_on = time.time()
+        self._statement_cache_size = statement_cache_size
+        self._replica_dsns = replicas or []
+        self._replica_max_lag = replica_max_lag
+        self._replica_pools = []
+        self._replica_lags = {}
+        self._replica_conns = {}
+        self._replica_idx = 0
+        self._tid_block_size = tid_block_size
+        self._tid_block = collections.deque()
+        self._vacuum_options = vacuum or {}
+        self._partitions = partitions
+        if cache_invalidations is None:
+            # only caches in the memory of the process need to be told
+            cache_invalidations = cache_strategy == 'memory'
+        self._cache_invalidations = cache_invalidations
+        # identifies the invalidations published by this storage
+        self._invalidation_origin = uuid.uuid4().hex
+        self._invalidation_conn = None
+        self._invalidation_task = None
+        self._invalidations_lost = False
+        self._last_invalidation_tid = 0
+        self._invalidations_received = 0
+        # `poll` reads the objects committed since the last poll instead of
+        # listening for notifications, for connections through PgBouncer
+        self._poll_invalidations = cache_invalidations == 'poll'
+        self._cache_max_staleness = cache_max_staleness
+        self._cache_poll_lookback = cache_poll_lookback
+        self._poll_lock = asyncio.Lock()
+        self._last_poll = 0
+        # (time, max tid) of the polls within the lookback
+        self._poll_history = collections.deque()
+        self._poll_seen = set()
+        self._poll_own_tids = set()
+        self._tid_block_reserved = 0
+
+    @property
+    def partitioned(self):
+        return self._partitions > 0
+
+    async def prepare_statement(self, conn, sql):
+        # asyncpg keeps the statements prepared on each connection, across
+        # pool checkouts, so this only round trips the first time
+        return await conn.prepare(sql)
 
     async def finalize(self):
         await self._vacuum.finalize()
         self._vacuum_task.cancel()
+        await self._close_invalidation_listener()
         await shield(self._pool.release(self._read_conn))
         await self._pool.close()
+        await self._close_replica_pools()
 
     async def create(self):
         # Check DB
         log.info('Creating initial database objects')
-        statements = [
-            get_table_definition('objects', self._object_schema),
-            get_table_definition('blobs', self._blob_schema,
-                                 primary_keys=('bid', 'zoid', 'chunk_index'))
-        ]
+        if self.partitioned:
+            statements = [
+                get_table_definition('objects', self._partitioned_object_schema,
+                                     primary_keys=('part', 'zoid'),
+                                     partition_by='HASH (part)'),
+                get_table_definition('blobs', self._partitioned_blob_schema,
+                                     primary_keys=('part', 'bid', 'zoid', 'chunk_index'),
+                                     partition_by='HASH (part)')
+            ]
+            statements.extend(get_partition_definitions('objects', self._partitions))
+            statements.extend(get_partition_definitions('blobs', self._partitions))
+            statements.extend(self._partitioned_initialize_statements)
+        else:
+            statements = [
+                get_table_definition('objects', self._object_schema),
+                get_table_definition('blobs', self._blob_schema,
+                                     primary_keys=('bid', 'zoid', 'chunk_index'))
+            ]
         statements.extend(self._initialize_statements)
 
         for statement in statements:
@@ -411,12 +807,40 @@ class PostgresqlStorage(BaseStorage):
             **self._connection_options)
 
         # shared read connection on all transactions
+        self._read_conn = None
         self._read_conn = await self.open()
         await self.initialize_tid_statements()
+        await self._close_replica_pools()
+        await self._initialize_replica_pools(self._pool._loop)
         self._connection_initialized_on = time.time()
         raise ConflictError('Restarting connection to postgresql')
 
+    async def _initialize_replica_pools(self, loop):
+        for dsn in self._replica_dsns:
+            try:
+                pool = await asyncpg.create_pool(
+                    dsn=dsn,
+                    max_size=self._pool_size,
+                    min_size=1,
+                    loop=loop,
+                    **self._connection_options)
+            except (OSError, asyncpg.exceptions.PostgresError):
+                log.warning('Could not connect to replica, skipping it', exc_info=True)
+                continue
+            self._replica_pools.append(pool)
+
+    async def _close_replica_pools(self):
+        pools, self._replica_pools = self._replica_pools, []
+        self._replica_lags = {}
+        self._replica_conns = {}
+        for pool in pools:
+            try:
+                await pool.close()
+            except Exception:
+                pool.terminate()
+
     async def initialize(self, loop=None, **kw):
+        kw.setdefault('statement_cache_size', self._statement_cache_size)
         self._connection_options = kw
         if loop is None:
             loop = asyncio.get_event_loop()
@@ -437,7 +861,7 @@ class PostgresqlStorage(BaseStorage):
 
         await self._read_conn.execute(CREATE_TRASH)
 
-        self._vacuum = self._vacuum_class(self, loop)
+        self._vacuum = self._vacuum_class(self, loop, **self._vacuum_options)
         self._vacuum_task = asyncio.Task(self._vacuum.initialize(), loop=loop)
 
         def vacuum_done(task):
@@ -448,10 +872,19 @@ class PostgresqlStorage(BaseStorage):
                         'No database vacuuming will be done here anymore.')
 
         self._vacuum_task.add_done_callback(vacuum_done)
+        await self._initialize_replica_pools(loop)
+        if self._poll_invalidations:
+            await self.poll_invalidations()
+            self._invalidation_task = asyncio.Task(
+                self._poll_for_invalidations(), loop=loop)
+        elif self._cache_invalidations:
+            self._invalidation_task = asyncio.Task(
+                self._listen_for_invalidations(loop), loop=loop)
         self._connection_initialized_on = time.time()
 
     async def initialize_tid_statements(self):
         self._stmt_next_tid = await self._read_conn.prepare(NEXT_TID)
+        self._stmt_next_tid_block = await self._read_conn.prepare(NEXT_TID_BLOCK)
         self._stmt_max_tid = await self._read_conn.prepare(MAX_TID)
 
     async def remove(self):
@@ -461,6 +894,10 @@ class PostgresqlStorage(BaseStorage):
             await conn.execute("DROP TABLE IF EXISTS objects;")
 
     async def open(self):
+        if self._poll_invalidations and self._read_conn is not None:
+            # polling needs the read connection, which is being opened when
+            # initializing or restarting the pool
+            await self._poll_invalidations_if_stale()
         try:
             conn = await self._pool.acquire(timeout=self._conn_acquire_timeout)
         except asyncpg.exceptions.InterfaceError as ex:
@@ -468,20 +905,75 @@ class PostgresqlStorage(BaseStorage):
                 await self._check_bad_connection(ex)
         return conn
 
+    async def get_replica_lag(self, conn):
+        return await conn.fetchval(REPLICA_LAG)
+
+    async def _replica_is_usable(self, pool, conn):
+        checked_on, lag = self._replica_lags.get(pool, (0, None))
+        if (time.time() - checked_on) > self._replica_lag_check_interval:
+            lag = await self.get_replica_lag(conn)
+            self._replica_lags[pool] = (time.time(), lag)
+        return lag is not None and lag <= self._replica_max_lag
+
+    async def open_replica(self):
+        '''
+        Connection for read only transactions. Replicas are used round robin,
+        falls back to the primary when no replica is within the max lag.
+        '''
+        if self._poll_invalidations:
+            await self._poll_invalidations_if_stale()
+        for _ in range(len(self._replica_pools)):
+            self._replica_idx = (self._replica_idx + 1) % len(self._replica_pools)
+            pool = self._replica_pools[self._replica_idx]
+            try:
+                conn = await pool.acquire(timeout=self._conn_acquire_timeout)
+            except (asyncio.TimeoutError, OSError, asyncpg.exceptions.InterfaceError,
+                    asyncpg.exceptions.PostgresError):
+                log.warning('Could not get replica connection', exc_info=True)
+                continue
+            try:
+                usable = await self._replica_is_usable(pool, conn)
+            except (OSError, asyncpg.exceptions.InterfaceError,
+                    asyncpg.exceptions.PostgresError):
+                log.warning('Could not check replica lag', exc_info=True)
+                usable = False
+            if usable:
+                self._replica_conns[conn] = pool
+                return conn
+            await shield(pool.release(conn))
+        return await self.open()
+
+    def is_replica_connection(self, con):
+        return con in self._replica_conns
+
     async def close(self, con):
+        pool = self._replica_conns.pop(con, self._pool)
         try:
-            await shield(self._pool.release(con))
+            await shield(pool.release(con))
         except (asyncio.CancelledError, asyncpg.exceptions.ConnectionDoesNotExistError):
             pass
 
     async def load(self, txn, oid):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(GET_OID)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, GET_OID)
             objects = await self.get_one_row(smt, oid)
         if objects is None:
             raise KeyError(oid)
         return objects
 
+    async def get_object_tid(self, txn, oid):
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, GET_OBJECT_TID)
+            result = await self.get_one_row(smt, oid)
+        if result is None:
+            raise KeyError(oid)
+        return result['tid']
+
+    async def load_many(self, txn, oids):
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, GET_OIDS)
+            return await smt.fetch(list(oids))
+
     def get_conflict_summary(self, oid, txn, old_serial, writer):
         return f'''Object ID: {oid}
 TID: {txn._tid}
@@ -489,6 +981,34 @@ Old Object TID: {old_serial}
 Belongs to: {writer.of}
 Parent ID: {writer.id}'''
 
+    def get_part(self, writer):
+        '''
+        Partition of the row of an object, all of them are stored in partition
+        0 when the tables are not partitioned
+        '''
+        if not self.partitioned:
+            return 0
+        part = writer.part
+        if part is None:
+            part = 0
+        return part
+
+    async def move_to_partitions(self, txn, objects):
+        '''
+        Move the trees of stored objects that were loaded from another
+        partition to the one they have been stored in.
+
+        objects is a list of (oid, part, obj) tuples
+        '''
+        moved = {}
+        for oid, part, obj in objects:
+            if obj.__partition_id__ is not None and obj.__partition_id__ != part:
+                moved.setdefault(part, []).append(oid)
+            obj.__partition_id__ = part
+        for part, oids in moved.items():
+            async with txn.query() as conn:
+                await conn.execute(MOVE_TREES_TO_PARTITION, oids, part)
+
     async def store(self, oid, old_serial, writer, obj, txn):
         assert oid is not None
 
@@ -497,19 +1017,17 @@ Parent ID: {writer.id}'''
             log.warning(f"Large object {obj.__class__}: {len(p)}")
         json_dict = await writer.get_json()
         json = ujson.dumps(json_dict)
-        part = writer.part
-        if part is None:
-            part = 0
+        part = self.get_part(writer)
 
         update = False
-        statement_sql = NAIVE_UPSERT
+        statement_sql = PARTITIONED_NAIVE_UPSERT if self.partitioned else NAIVE_UPSERT
         if not obj.__new_marker__ and obj._p_serial is not None:
             # we should be confident this is an object update
             statement_sql = UPDATE
             update = True
 
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(statement_sql)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, statement_sql)
             try:
                 result = await smt.fetch(
                     oid,                 # The OID of the object
@@ -553,14 +1071,133 @@ Parent ID: {writer.id}'''
                 else:
                     log.error('Incorrect response count from database update. '
                               'This should not happen. tid: {}'.format(txn._tid))
+        if self.partitioned:
+            await self.move_to_partitions(txn, [(oid, part, obj)])
+
+    async def store_many(self, txn, objects):
+        '''
+        Store all the objects of a transaction with batched statements
+        instead of a round trip per object.
+
+        objects is an ordered list of (oid, old_serial, writer, obj) tuples
+        '''
+        upserts = []
+        updates = []
+        for oid, old_serial, writer, obj in objects:
+            assert oid is not None
+            p = writer.serialize()  # This calls __getstate__ of obj
+            if len(p) >= self._large_record_size:
+                log.warning(f"Large object {obj.__class__}: {len(p)}")
+            json_dict = await writer.get_json()
+            part = self.get_part(writer)
+            row = (
+                oid,                 # The OID of the object
+                txn._tid,            # Our TID
+                len(p),              # Len of the object
+                part,                # Partition indicator
+                writer.resource,     # Is a resource ?
+                writer.of,           # It belogs to a main
+                old_serial,          # Old serial
+                writer.parent_id,    # Parent OID
+                writer.id,           # Traversal ID
+                writer.type,         # Guillotina type
+                ujson.dumps(json_dict),  # JSON catalog
+                p                    # Pickle state
+            )
+            if not obj.__new_marker__ and obj._p_serial is not None:
+                # we should be confident this is an object update
+                updates.append((row, old_serial, writer, obj))
+            else:
+                upserts.append((row, old_serial, writer, obj))
+
+        # inserts first, ordering is kept since new children can reference
+        # new parents
+        upsert_sql = BATCHED_NAIVE_UPSERT
+        if self.partitioned:
+            upsert_sql = PARTITIONED_BATCHED_NAIVE_UPSERT
+        for idx in range(0, len(upserts), self._store_batch_size):
+            await self._store_batch(
+                txn, upsert_sql, upserts[idx:idx + self._store_batch_size])
+        for idx in range(0, len(updates), self._store_batch_size):
+            await self._store_batch(
+                txn, BATCHED_UPDATE, updates[idx:idx + self._store_batch_size],
+                update=True)
+        if self.partitioned:
+            await self.move_to_partitions(txn, [
+                (row[0], row[3], obj) for row, _, _, obj in upserts + updates])
+
+    async def _store_batch(self, txn, statement_sql, batch, update=False):
+        columns = [list(column) for column in zip(*[b[0] for b in batch])]
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, statement_sql)
+            try:
+                result = await smt.fetch(*columns)
+            except asyncpg.exceptions.ForeignKeyViolationError as ex:
+                # find the objects referencing the missing row
+                detail = getattr(ex, 'detail', None) or ''
+                offending = [
+                    (row, old_serial, writer, obj) for row, old_serial, writer, obj in batch
+                    if (writer.parent_id and writer.parent_id in detail) or
+                    (writer.of and writer.of in detail)]
+                if len(offending) == 0:
+                    offending = batch
+                for _, _, _, obj in offending:
+                    txn.deleted[obj._p_oid] = obj
+                conflict_summary = '\n'.join(
+                    self.get_conflict_summary(row[0], txn, old_serial, writer)
+                    for row, old_serial, writer, _ in offending)
+                raise TIDConflictError(
+                    f'Bad value inserting into database that could be caused '
+                    f'by a bad cache value. This should resolve on request retry.\n'
+                    f'{conflict_summary}')
+            except asyncpg.exceptions._base.InterfaceError as ex:
+                if 'another operation is in progress' in ex.args[0]:
+                    raise ConflictError(
+                        f'asyncpg error, another operation in progress.\n'
+                        f'Object IDs: {columns[0]}')
+                raise
+            except asyncpg.exceptions.DeadlockDetectedError:
+                raise ConflictError(f'Deadlock detected.\nObject IDs: {columns[0]}')
+
+        stored = set(record['zoid'] for record in result)
+        missing = [(row, old_serial, writer) for row, old_serial, writer, _ in batch
+                   if row[0] not in stored]
+        if len(missing) > 0:
+            if update:
+                # raise tid conflict error
+                conflict_summary = '\n'.join(
+                    self.get_conflict_summary(row[0], txn, old_serial, writer)
+                    for row, old_serial, writer in missing)
+                raise TIDConflictError(
+                    f'Mismatch of tid of objects being updated. This is likely '
+                    f'caused by a cache invalidation race condition and should '
+                    f'be an edge case. This should resolve on request retry.\n'
+                    f'{conflict_summary}')
+            else:
+                log.error('Incorrect response count from database update. '
+                          'This should not happen. tid: {}'.format(txn._tid))
 
     async def _txn_oid_commit_hook(self, status, oid):
         await self._vacuum.add_to_queue(oid)
 
     async def delete(self, txn, oid):
-        async with txn._lock:
+        args = (oid,)
+        part = None
+        if self.partitioned:
+            part = getattr(txn.deleted.get(oid), '__partition_id__', None)
+        if part is not None:
+            args += (part,)
+            trash_sql = PARTITIONED_TRASH_PARENT_ID
+            trash_tid_sql = PARTITIONED_TRASH_PARENT_ID_AND_TID
+        else:
+            trash_sql = TRASH_PARENT_ID
+            trash_tid_sql = TRASH_PARENT_ID_AND_TID
+        async with txn.query() as conn:
             # for delete, we reassign the parent id and delete in the vacuum task
-            await txn._db_conn.execute(TRASH_PARENT_ID, oid)
+            if self._poll_invalidations:
+                await conn.execute(trash_tid_sql, *args, txn._tid)
+            else:
+                await conn.execute(trash_sql, *args)
         txn.add_after_commit_hook(self._txn_oid_commit_hook, [oid])
 
     async def _check_bad_connection(self, ex):
@@ -570,7 +1207,32 @@ Parent ID: {writer.id}'''
                 # we need to make sure we aren't calling this over and over again
                 return await self.restart_connection()
 
+    async def _reserve_tid_block(self):
+        async with self._lock:
+            if len(self._tid_block) > 0:
+                # another task reserved a block while we were waiting
+                return
+            try:
+                records = await self._stmt_next_tid_block.fetch(self._tid_block_size)
+            except asyncpg.exceptions.InterfaceError as ex:
+                await self._check_bad_connection(ex)
+                raise
+            self._tid_block.extend(sorted(record[0] for record in records))
+            self._tid_block_reserved = time.time()
+
     async def get_next_tid(self, txn):
+        if self._tid_block_size > 1:
+            # tids are unique and increasing on this worker but only ordered
+            # across workers by the block they come from
+            if (self._poll_invalidations and
+                    time.time() - self._tid_block_reserved > self._cache_poll_lookback / 2):
+                # polls only read back the tids allocated within the lookback,
+                # the other half is left for the duration of transactions
+                self._tid_block.clear()
+            while len(self._tid_block) == 0:
+                await self._reserve_tid_block()
+            return self._tid_block.popleft()
+
         async with self._lock:
             # we do not use transaction lock here but a storage lock because
             # a storage object has a shard conn for reads
@@ -593,7 +1255,9 @@ Parent ID: {writer.id}'''
         # make sure asycpg knows this is a new transaction
         if txn._db_conn._con is not None:
             txn._db_conn._con._top_xact = None
-        return txn._db_conn.transaction(readonly=txn._manager._storage._read_only)
+        # replicas are read only already. asyncpg only starts serializable
+        # transactions read only, which hot standbys do not support
+        return txn._db_conn.transaction(readonly=self._read_only)
 
     async def start_transaction(self, txn, retries=0):
         error = None
@@ -628,14 +1292,240 @@ Parent ID: {writer.id}'''
                 return await self.start_transaction(txn, retries + 1)
 
     async def get_conflicts(self, txn, full=False):
+        '''
+        Objects modified or deleted by this transaction that have been
+        committed by another transaction since they were loaded. Rows already
+        written by the transaction are protected by the tid checked update
+        and the row locks it holds.
+
+        Comparing with the serials of the objects instead of the transaction
+        tid keeps this working when tids are allocated in blocks and are not
+        ordered across workers.
+        '''
+        oids = []
+        serials = []
+        for objects in (txn.modified, txn.deleted):
+            for oid, obj in objects.items():
+                oids.append(oid)
+                # stored objects already have the tid of the transaction
+                serials.append(txn._loaded_serials.get(
+                    oid, getattr(obj, '_p_serial', None)))
+        if len(oids) == 0:
+            return []
+        if full:
+            sql = TXN_CONFLICTS_ON_OIDS_FULL
+        else:
+            sql = TXN_CONFLICTS_ON_OIDS
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, sql)
+            return await smt.fetch(oids, serials, txn._tid)
+
+    def get_cache_stats(self):
+        stats = super().get_cache_stats()
+        if self._cache_invalidations:
+            stats['invalidations_received'] = self._invalidations_received
+            stats['last_invalidation_tid'] = self._last_invalidation_tid
+        if self._poll_invalidations:
+            stats['last_poll'] = self._last_poll
+        if self._vacuum is not None:
+            stats['vacuum'] = self._vacuum.get_stats()
+        return stats
+
+    async def publish_invalidations(self, transaction):
+        '''
+        notify the other processes of the cache keys invalidated by the
+        transaction, delivered when the db transaction commits
+        '''
+        keys = transaction._cache.get_transaction_cache_keys()
+        if len(keys) == 0:
+            return
+        payload = ujson.dumps({
+            'origin': self._invalidation_origin,
+            'tid': transaction._tid,
+            'keys': keys
+        })
+        if len(payload.encode('utf-8')) > MAX_NOTIFY_PAYLOAD_SIZE:
+            # too many keys, everything cached is invalidated
+            payload = ujson.dumps({
+                'origin': self._invalidation_origin,
+                'tid': transaction._tid,
+                'keys': None
+            })
+        async with transaction._lock:
+            await transaction._db_conn.execute(
+                'SELECT pg_notify($1, $2)', self._invalidation_channel, payload)
+
+    async def _listen_for_invalidations(self, loop):
+        while True:
+            try:
+                if self._invalidation_conn is None:
+                    conn = await asyncpg.connect(
+                        dsn=self._dsn, loop=loop, **self._connection_options)
+                    await conn.add_listener(
+                        self._invalidation_channel, self._on_invalidation)
+                    self._invalidation_conn = conn
+                    if self._invalidations_lost:
+                        # we were not listening, anything can be stale
+                        log.warning('Cache invalidation listener reconnected, '
+                                    'clearing cache')
+                        cache = self.get_cache()
+                        cache.clear_pinned()
+                        await cache.clear()
+                        self._invalidations_lost = False
+                else:
+                    await self._invalidation_conn.fetchval('SELECT 1;')
+            except (concurrent.futures.CancelledError, RuntimeError):
+                # task was cancelled, probably because we're shutting down
+                return
+            except Exception:
+                log.warning('Cache invalidation listener connection lost, '
+                            'reconnecting', exc_info=True)
+                self._invalidations_lost = True
+                conn, self._invalidation_conn = self._invalidation_conn, None
+                if conn is not None:
+                    conn.terminate()
+            await asyncio.sleep(self._invalidation_check_interval)
+
+    def _on_invalidation(self, conn, pid, channel, payload):
+        try:
+            data = ujson.loads(payload)
+        except ValueError:
+            log.warning(f'Invalid cache invalidation payload: {payload}')
+            return
+        if data.get('origin') == self._invalidation_origin:
+            # invalidated when the transaction closed its cache
+            return
+        asyncio.ensure_future(self._apply_invalidation(data), loop=self._pool._loop)
+
+    async def _apply_invalidation(self, data):
+        self._invalidations_received += 1
+        self._last_invalidation_tid = max(self._last_invalidation_tid, data['tid'] or 0)
+        cache = self.get_cache()
+        if data['keys'] is None:
+            cache.clear_pinned()
+            await cache.clear()
+        else:
+            cache.delete_pinned(data['keys'])
+            await cache.delete_all(data['keys'])
+
+    async def poll_invalidations(self):
+        '''
+        invalidate the cached values of the objects committed by other
+        processes since the last poll.
+
+        tids are allocated when transactions begin, not when they commit,
+        and tid blocks make them unordered across workers, so every poll
+        reads back the changes since the max tid seen `cache_poll_lookback`
+        seconds ago and skips the ones it already applied
+        '''
+        now = time.time()
         async with self._lock:
-            # use storage lock instead of transaction lock
-            if full:
-                return await self._read_conn.fetch(TXN_CONFLICTS_FULL, txn._tid)
+            max_tid = await self._stmt_max_tid.fetchval()
+            if len(self._poll_history) == 0:
+                # nothing can be cached yet
+                rows = []
+            else:
+                smt = await self.prepare_statement(self._read_conn, POLL_INVALIDATIONS)
+                rows = await smt.fetch(self._poll_history[0][1])
+        self._last_poll = now
+        self._poll_history.append((now, max_tid))
+        while (len(self._poll_history) > 1 and
+                self._poll_history[1][0] <= now - self._cache_poll_lookback):
+            self._poll_history.popleft()
+
+        cache = self.get_cache()
+        keys = []
+        clear = False
+        for row in rows:
+            if row['tid'] in self._poll_own_tids or (row['zoid'], row['tid']) in self._poll_seen:
+                continue
+            self._poll_seen.add((row['zoid'], row['tid']))
+            row_keys = await self._get_poll_keys(cache, row)
+            if row_keys is None:
+                clear = True
             else:
-                return await self._read_conn.fetch(TXN_CONFLICTS, txn._tid)
+                keys.extend(row_keys)
+
+        # changes up to the watermark are not read again
+        watermark = self._poll_history[0][1]
+        self._poll_seen = {seen for seen in self._poll_seen if seen[1] > watermark}
+        self._poll_own_tids = {tid for tid in self._poll_own_tids if tid > watermark}
+        if clear or len(keys) > 0:
+            await self._apply_invalidation({
+                'tid': max_tid,
+                'keys': None if clear else keys
+            })
+
+    async def _get_poll_keys(self, cache, row):
+        '''
+        cache keys of a changed row, None if they can not be known
+        '''
+        keys = [row['zoid']]
+        if row['of']:
+            keys.extend([
+                cache.get_key(oid=row['of'], id=row['id'], variant='annotation'),
+                cache.get_key(oid=row['of'], variant='annotation-keys')
+            ])
+            return keys
+        parent_id = row['parent_id']
+        if parent_id == TRASHED_ID:
+            # the former parent of deleted objects is only known when the
+            # object is still cached
+            cached = await cache.get(oid=row['zoid'])
+            parent_id = None
+            if cached is not None and 'parent_id' in cached.keys():
+                parent_id = cached['parent_id']
+            if parent_id in (None, TRASHED_ID):
+                return None
+        if parent_id:
+            keys.extend([
+                cache.get_key(oid=parent_id, id=row['id']),
+                cache.get_key(oid=parent_id, id=row['id'], variant='contains'),
+                cache.get_key(oid=parent_id, variant='len'),
+                cache.get_key(oid=parent_id, variant='keys')
+            ])
+        return keys
+
+    async def _poll_invalidations_if_stale(self):
+        if time.time() - self._last_poll <= self._cache_max_staleness:
+            return
+        async with self._poll_lock:
+            if time.time() - self._last_poll <= self._cache_max_staleness:
+                # polled by another task while we were waiting
+                return
+            try:
+                await self.poll_invalidations()
+            except (asyncpg.exceptions.InterfaceError, asyncpg.exceptions.PostgresError):
+                log.warning('Could not poll for cache invalidations', exc_info=True)
+
+    async def _poll_for_invalidations(self):
+        while True:
+            try:
+                await asyncio.sleep(self._cache_max_staleness)
+                await self._poll_invalidations_if_stale()
+            except (concurrent.futures.CancelledError, RuntimeError):
+                # task was cancelled, probably because we're shutting down
+                return
+            except Exception:
+                log.warning('Could not poll for cache invalidations', exc_info=True)
+
+    async def _close_invalidation_listener(self):
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
+        conn, self._invalidation_conn = self._invalidation_conn, None
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception:
+                conn.terminate()
 
     async def commit(self, transaction):
+        if self._poll_invalidations:
+            # already invalidated when the transaction closes its cache
+            self._poll_own_tids.add(transaction._tid)
+        elif self._cache_invalidations:
+            await self.publish_invalidations(transaction)
         if transaction._db_txn is not None:
             async with transaction._lock:
                 await transaction._db_txn.commit()
@@ -643,6 +1533,14 @@ Parent ID: {writer.id}'''
             log.warning('Do not have db transaction to commit')
         return transaction._tid
 
+    async def savepoint(self, txn, name):
+        async with txn.query() as conn:
+            await conn.execute(f'SAVEPOINT {name}')
+
+    async def rollback_to_savepoint(self, txn, name):
+        async with txn.query() as conn:
+            await conn.execute(f'ROLLBACK TO SAVEPOINT {name}')
+
     async def abort(self, transaction):
         if transaction._db_txn is not None:
             async with transaction._lock:
@@ -656,29 +1554,45 @@ Parent ID: {writer.id}'''
         #     log.warning('Do not have db transaction to rollback')
 
     # Introspection
-    async def get_page_of_keys(self, txn, oid, page=1, page_size=1000):
-        conn = txn._db_conn
-        smt = await conn.prepare(BATCHED_GET_CHILDREN_KEYS)
-        keys = []
-        for record in await smt.fetch(oid, page_size, (page - 1) * page_size):
-            keys.append(record['id'])
-        return keys
+    async def get_batch_of_keys(self, txn, oid, cursor=None, page_size=1000):
+        '''
+        Keyset paginated keys, cursor is the zoid of the last child of the
+        previous batch. Returns list of (zoid, id) records.
+        '''
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, BATCHED_GET_CHILDREN_KEYS_AFTER)
+            return await smt.fetch(oid, cursor or '', page_size)
 
     async def keys(self, txn, oid):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(GET_CHILDREN_KEYS)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, GET_CHILDREN_KEYS)
             result = await smt.fetch(oid)
         return result
 
-    async def get_child(self, txn, parent_oid, id):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(GET_CHILD)
-            result = await self.get_one_row(smt, parent_oid, id)
+    async def get_child(self, txn, parent_oid, id, part=None):
+        args = (parent_oid, id)
+        sql = GET_CHILD
+        if self.partitioned and part is not None:
+            args += (part,)
+            sql = GET_CHILD_IN_PARTITION
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, sql)
+            result = await self.get_one_row(smt, *args)
         return result
 
+    async def get_children(self, txn, parent_oid, ids, part=None):
+        args = (parent_oid, list(ids))
+        sql = GET_CHILDREN_BY_IDS
+        if self.partitioned and part is not None:
+            args += (part,)
+            sql = GET_CHILDREN_BY_IDS_IN_PARTITION
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, sql)
+            return await smt.fetch(*args)
+
     async def has_key(self, txn, parent_oid, id):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(EXIST_CHILD)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, EXIST_CHILD)
             result = await self.get_one_row(smt, parent_oid, id)
         if result is None:
             return False
@@ -686,87 +1600,112 @@ Parent ID: {writer.id}'''
             return True
 
     async def len(self, txn, oid):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(NUM_CHILDREN)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, NUM_CHILDREN)
             result = await smt.fetchval(oid)
         return result
 
     async def items(self, txn, oid):
+        # cursors need the connection and db transaction of the txn
+        conn = await txn.get_connection()
         async with txn._lock:
-            smt = await txn._db_conn.prepare(GET_CHILDREN)
+            smt = await self.prepare_statement(conn, GET_CHILDREN)
         async for record in smt.cursor(oid):
             # locks are dangerous in cursors since comsuming code might do
             # sub-queries and they you end up with a deadlock
             yield record
 
-    async def get_annotation(self, txn, oid, id):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(GET_ANNOTATION)
-            result = await self.get_one_row(smt, oid, id)
+    async def get_annotation(self, txn, oid, id, part=None):
+        args = (oid, id)
+        sql = GET_ANNOTATION
+        if self.partitioned and part is not None:
+            args += (part,)
+            sql = GET_ANNOTATION_IN_PARTITION
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, sql)
+            result = await self.get_one_row(smt, *args)
         return result
 
+    async def get_annotations(self, txn, oids, id, part=None):
+        args = (list(oids), id)
+        sql = GET_ANNOTATIONS_OF
+        if self.partitioned and part is not None:
+            args += (part,)
+            sql = GET_ANNOTATIONS_OF_IN_PARTITION
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, sql)
+            return await smt.fetch(*args)
+
     async def get_annotation_keys(self, txn, oid):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(GET_ANNOTATIONS_KEYS)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, GET_ANNOTATIONS_KEYS)
             result = await smt.fetch(oid)
         return result
 
-    async def write_blob_chunk(self, txn, bid, oid, chunk_index, data):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(HAS_OBJECT)
+    async def write_blob_chunk(self, txn, bid, oid, chunk_index, data, part=None):
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, HAS_OBJECT)
             result = await self.get_one_row(smt, oid)
+        if not self.partitioned:
+            part = 0
+        elif result is not None:
+            # chunks go in the partition the object is stored in, which is
+            # not the one of the blob anymore if the object has been moved
+            part = result['part']
+        elif part is None:
+            part = 0
         if result is None:
             # check if we have a referenced ob, could be new and not in db yet.
             # if so, create a stub for it here...
-            async with txn._lock:
-                await txn._db_conn.execute('''INSERT INTO objects
+            async with txn.query() as conn:
+                await conn.execute('''INSERT INTO objects
                     (zoid, tid, state_size, part, resource, type)
-                    VALUES ($1::varchar(32), -1, 0, 0, TRUE, 'stub')''', oid)
-        async with txn._lock:
-            return await txn._db_conn.execute(
+                    VALUES ($1::varchar(32), -1, 0, $2::bigint, TRUE, 'stub')''', oid, part)
+        async with txn.query() as conn:
+            if self.partitioned:
+                return await conn.execute(
+                    PARTITIONED_INSERT_BLOB_CHUNK, bid, oid, chunk_index, data, part)
+            return await conn.execute(
                 INSERT_BLOB_CHUNK, bid, oid, chunk_index, data)
 
     async def read_blob_chunk(self, txn, bid, chunk=0):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(READ_BLOB_CHUNK)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, READ_BLOB_CHUNK)
             return await self.get_one_row(smt, bid, chunk)
 
     async def read_blob_chunks(self, txn, bid):
+        conn = await txn.get_connection()
         async with txn._lock:
-            smt = await txn._db_conn.prepare(READ_BLOB_CHUNKS)
+            smt = await self.prepare_statement(conn, READ_BLOB_CHUNKS)
         async for record in smt.cursor(bid):
             # locks are dangerous in cursors since comsuming code might do
             # sub-queries and they you end up with a deadlock
             yield record
 
     async def del_blob(self, txn, bid):
-        async with txn._lock:
-            await txn._db_conn.execute(DELETE_BLOB, bid)
+        async with txn.query() as conn:
+            await conn.execute(DELETE_BLOB, bid)
 
     async def get_total_number_of_objects(self, txn):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(NUM_ROWS)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, NUM_ROWS)
             result = await smt.fetchval()
         return result
 
     async def get_total_number_of_resources(self, txn):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(NUM_RESOURCES)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, NUM_RESOURCES)
             result = await smt.fetchval()
         return result
 
     async def get_total_resources_of_type(self, txn, type_):
-        async with txn._lock:
-            smt = await txn._db_conn.prepare(NUM_RESOURCES_BY_TYPE)
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, NUM_RESOURCES_BY_TYPE)
             result = await smt.fetchval(type_)
         return result
 
     # Massive treatment without security
-    async def _get_page_resources_of_type(self, txn, type_, page, page_size):
-        conn = txn._db_conn
-        async with txn._lock:
-            smt = await conn.prepare(RESOURCES_BY_TYPE)
-        keys = []
-        for record in await smt.fetch(type_, page_size, (page - 1) * page_size):  # noqa
-            keys.append(record)
-        return keys
+    async def _get_batch_resources_of_type(self, txn, type_, cursor=None, page_size=1000):
+        async with txn.query() as conn:
+            smt = await self.prepare_statement(conn, BATCHED_RESOURCES_BY_TYPE)
+            return await smt.fetch(type_, cursor or '', page_size)
@@ -1,11 +1,25 @@
-
-
-def get_table_definition(name, schema, primary_keys=[]):
+def get_table_definition(name, schema, primary_keys=[], partition_by=None):
     pk = ''
     if len(primary_keys) > 0:
         pk = ', PRIMARY KEY({})'.format(', '.join(primary_keys))
-    return "CREATE TABLE IF NOT EXISTS {} ({});".format(
+    partition = ''
+    if partition_by is not None:
+        partition = ' PARTITION BY {}'.format(partition_by)
+    return "CREATE TABLE IF NOT EXISTS {} ({}{}){};".format(
         name,
         ',\n'.join('{} {}'.format(c, d) for c, d in schema.items()),
-        pk
+        pk,
+        partition
     )
+
+
+def get_partition_definitions(name, partitions):
+    '''
+    hash partitions of a table partitioned with `PARTITION BY HASH`
+    '''
+    return [
+        'CREATE TABLE IF NOT EXISTS {name}_{remainder} PARTITION OF {name} '
+        'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder});'.format(
+            name=name, partitions=partitions, remainder=remainder)
+        for remainder in range(partitions)
+    ]
@@ -10,14 +10,31 @@ class BaseStrategy:
 
     @property
     def writable_transaction(self):
+        if self._transaction.read_only:
+            return False
         req = self._transaction.request
         if hasattr(req, '_db_write_enabled'):
             return req._db_write_enabled
         return True
 
+    @property
+    def ordered_tids(self):
+        # storages allocating tids in blocks do not issue tids ordered
+        # across workers, a newer commit can have a lower tid
+        return getattr(self._storage, '_tid_block_size', 1) <= 1
+
+    @property
+    def connected(self):
+        # transactions get their connection on their first query, the ones
+        # without one have not written anything
+        return self._transaction._db_conn is not None
+
     async def tpc_begin(self):
         pass
 
+    async def tpc_connect(self):
+        pass
+
     async def tpc_vote(self):
         return True
 
@@ -18,26 +18,32 @@ class ResolveStrategy(SimpleStrategy):
     '''
 
     async def tpc_vote(self):
-        if not self.writable_transaction:
+        if not self.writable_transaction or not self.connected:
             return True
-        current_tid = await self._storage.get_current_tid(self._transaction)
-        if current_tid > self._transaction._tid:
-            # potential conflict error, get changes
-            # Check if there is any commit bigger than the one we already have
-            conflicts = await self._storage.get_conflicts(self._transaction)
-            for conflict in conflicts:
-                # both writing to same object...
-                if conflict['zoid'] in self._transaction.modified:
-                    modified_keys = [k for k in self._transaction.modified.keys()]
-                    logger.warn(
-                        f'Could not resolve conflicts in TID: {self._transaction._tid}\n'
-                        f'Conflicted TID: {current_tid}\n',
-                        f'IDs: {modified_keys}'
-                    )
-                    return False
-            if len(conflicts) > 0:
-                logger.info('Resolved conflict between transaction ids: {}, {}'.format(
-                    self._transaction._tid, current_tid
-                ))
+        if self.ordered_tids:
+            current_tid = await self._storage.get_current_tid(self._transaction)
+            if current_tid <= self._transaction._tid:
+                # nothing committed after our transaction started
+                return True
+        else:
+            # with tids allocated in blocks a concurrent commit can have a
+            # lower tid than ours so we always need to check our objects
+            current_tid = None
+
+        # potential conflict error, get changes to the objects we are
+        # writing that have been committed after our transaction started
+        conflicts = await self._storage.get_conflicts(self._transaction)
+        if len(conflicts) > 0:
+            conflicted_oids = [c['zoid'] for c in conflicts]
+            logger.warn(
+                f'Could not resolve conflicts in TID: {self._transaction._tid}\n'
+                f'Conflicted TID: {current_tid}\n'
+                f'IDs: {conflicted_oids}'
+            )
+            return False
+        if current_tid is not None:
+            logger.info('Resolved conflict between transaction ids: {}, {}'.format(
+                self._transaction._tid, current_tid
+            ))
 
         return True
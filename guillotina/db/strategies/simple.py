@@ -18,14 +18,20 @@ class SimpleStrategy(BaseStrategy):
     '''
 
     async def tpc_begin(self):
-        await self._storage.start_transaction(self._transaction)
+        if self.connected:
+            await self.tpc_connect()
         if self.writable_transaction:
+            # the tid is still issued on begin so conflicts are detected
+            # from the start of the transaction, not from its first query
             tid = await self._storage.get_next_tid(self._transaction)
             if tid is not None:
                 self._transaction._tid = tid
 
+    async def tpc_connect(self):
+        await self._storage.start_transaction(self._transaction)
+
     async def tpc_vote(self):
-        if not self.writable_transaction:
+        if not self.writable_transaction or not self.connected:
             return True
 
         current_tid = await self._storage.get_current_tid(self._transaction)
@@ -39,5 +45,5 @@ class SimpleStrategy(BaseStrategy):
         return True
 
     async def tpc_finish(self):
-        if self.writable_transaction:
+        if self.writable_transaction and self.connected:
             await self._storage.commit(self._transaction)
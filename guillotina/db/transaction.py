@@ -1,11 +1,16 @@
 from collections import OrderedDict
 from guillotina.component import getMultiAdapter
+from guillotina.db.cache.base import is_tombstone
+from guillotina.db.cache.base import TOMBSTONE
+from guillotina.db.conflicts import get_state
 from guillotina.db.interfaces import IStorageCache
 from guillotina.db.interfaces import ITransaction
 from guillotina.db.interfaces import ITransactionStrategy
 from guillotina.db.interfaces import IWriter
 from guillotina.db.reader import reader
+from guillotina.db.writer import get_partition_id
 from guillotina.exceptions import ConflictError
+from guillotina.exceptions import InvalidSavepoint
 from guillotina.exceptions import ReadOnlyError
 from guillotina.exceptions import RequestNotFound
 from guillotina.exceptions import TIDConflictError
@@ -14,16 +19,76 @@ from guillotina.utils import get_current_request
 from zope.interface import implementer
 
 import asyncio
+import hashlib
 import logging
 import sys
 import time
 import uuid
+import weakref
 
 
-HARD_CACHE = {}
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+def get_state_digest(state):
+    return hashlib.blake2b(state, digest_size=16).digest()
+
+
+def get_column(row, name, default=None):
+    # asyncpg records have no get()
+    try:
+        return row[name]
+    except KeyError:
+        return default
+
+
+class TransactionQuery:
+    '''
+    connection for a query of a transaction. Transactions get their
+    connection on their first query and serialize their queries on it, read
+    only transactions that do not hold one only use a connection of the pool
+    for the query itself
+    '''
+
+    def __init__(self, txn):
+        self.txn = txn
+        self.conn = None
+        self.acquired = None
+
+    async def __aenter__(self):
+        txn = self.txn
+        if txn._db_conn is None and not txn._strategy.writable_transaction:
+            self.conn = await txn._open_connection()
+            self.acquired = time.time()
+            return self.conn
+        conn = await txn.get_connection()
+        await txn._lock.acquire()
+        return conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        txn = self.txn
+        txn.queries += 1
+        if self.conn is None:
+            txn._lock.release()
+        else:
+            await txn._manager._storage.close(self.conn)
+            txn.connection_time += time.time() - self.acquired
+
+
+class Savepoint:
+    '''
+    state of a transaction to roll back to
+    '''
+
+    def __init__(self, txn, name):
+        self.name = name
+        self.deleted = dict(txn.deleted)
+        self.savepoint_added = OrderedDict(txn.savepoint_added)
+        self.savepoint_modified = dict(txn.savepoint_modified)
+        self.loaded_states = dict(txn._loaded_states)
+        self.stored = len(txn._objects_to_invalidate)
+        self.before_commit = len(txn._before_commit)
+        self.after_commit = len(txn._after_commit)
 
 
 class Status:
@@ -37,10 +102,13 @@ class Status:
 @implementer(ITransaction)
 class Transaction(object):
 
-    def __init__(self, manager, request=None, loop=None):
+    def __init__(self, manager, request=None, loop=None, read_only=False):
         self._txn_time = None
         self._tid = None
         self.status = Status.ACTIVE
+        # transactions opened read only without a request, they get no tid
+        # and can not write
+        self.read_only = read_only
 
         # Transaction Manager
         self._manager = manager
@@ -52,9 +120,41 @@ class Transaction(object):
         self.modified = {}
         self.deleted = {}
 
+        # objects loaded by the transaction, so every lookup of an oid
+        # returns the same instance while it is in use
+        self._objects = weakref.WeakValueDictionary()
+
+        # digest and location of the rows loaded by writable transactions,
+        # registered objects that are unchanged are not written. The state is
+        # kept for objects merging conflicts
+        self._loaded_states = {}
+        # serials the objects stored by the transaction had when they were
+        # loaded, they get the tid of the transaction once stored
+        self._loaded_serials = {}
+        self.skipped_writes = 0
+        self.resolved_conflicts = 0
+
         # OIDS to invalidate
         self._objects_to_invalidate = []
 
+        # savepoints of the db transaction, oldest first
+        self._savepoints = []
+        # objects stored at savepoints, their cached values are invalidated
+        # on commit with the ones of the objects still registered
+        self.savepoint_added = OrderedDict()
+        self.savepoint_modified = {}
+
+        # size of the records loaded from the storage
+        self.loaded_bytes = 0
+
+        # replicas can lag behind the invalidations of the caches, rows read
+        # from them are not kept in the caches
+        self._replica_reads = False
+
+        # number of queries and seconds connections were held for them
+        self.queries = 0
+        self.connection_time = 0.0
+
         # List of (hook, args, kws) tuples added by addBeforeCommitHook().
         self._before_commit = []
 
@@ -63,8 +163,10 @@ class Transaction(object):
 
         logger.debug("new transaction")
 
-        # Connection to DB
+        # Connection to DB, acquired on the first query
         self._db_conn = None
+        self._db_conn_acquired = None
+        self._connection_lock = asyncio.Lock(loop=loop)
         # Transaction on DB
         self._db_txn = None
         # Lock on the transaction
@@ -138,16 +240,82 @@ class Transaction(object):
 
     # BEGIN TXN
 
-    async def tpc_begin(self, conn):
+    async def tpc_begin(self, conn=None):
         """Begin commit of a transaction
 
-        conn is a real db that will be got by db.open()
+        conn is a real db that will be got by db.open(), when it is not
+        provided the transaction gets one on its first query
         """
         self._txn_time = time.time()
         self._db_conn = conn
+        self._replica_reads = False
+        if conn is not None:
+            self._db_conn_acquired = time.time()
         await self._strategy.tpc_begin()
 
+    async def _open_connection(self):
+        storage = self._manager._storage
+        if self._strategy.writable_transaction or self.read_only:
+            # transactions opened read only fill the caches, rows of
+            # replicas are not cached
+            return await storage.open()
+        # read only requests can be served by a replica
+        conn = await storage.open_replica()
+        if storage.is_replica_connection(conn):
+            self._replica_reads = True
+        return conn
+
+    async def get_connection(self):
+        '''
+        connection of the transaction, acquired from the pool the first time
+        it is needed so transactions served by the caches do not take one
+        '''
+        if self._db_conn is None:
+            async with self._connection_lock:
+                if self._db_conn is None:
+                    self._db_conn = await self._open_connection()
+                    self._db_conn_acquired = time.time()
+                    self._manager._last_db_conn = self._db_conn
+                    await self._strategy.tpc_connect()
+        return self._db_conn
+
+    def query(self):
+        '''
+        async context manager with the connection to run a query on
+        '''
+        return TransactionQuery(self)
+
+    def _caches_reads(self):
+        '''
+        whether the rows read can be kept in the caches shared with other
+        transactions. Replicas can lag behind the invalidations of the caches
+        and rows stored at savepoints are not committed
+        '''
+        return (not self._replica_reads and len(self.savepoint_added) == 0 and
+                len(self.savepoint_modified) == 0)
+
+    async def _cache_set(self, value, generation=None, **kwargs):
+        '''
+        generation is the one of the cache before value was loaded, values
+        invalidated since could be older than the invalidation
+        '''
+        if not self._caches_reads():
+            return
+        if generation is not None and self._cache.invalidated_since(generation, **kwargs):
+            return
+        await self._cache.set(value, **kwargs)
+
+    def _cache_set_pinned(self, result, generation=None):
+        if not self._caches_reads():
+            return
+        if generation is not None and self._cache.pinned_invalidated_since(
+                result['zoid'], generation):
+            return
+        self._cache.set_pinned(result)
+
     def check_read_only(self):
+        if self.read_only:
+            raise ReadOnlyError()
         if self.request is None:
             try:
                 self.request = get_current_request()
@@ -193,7 +361,7 @@ class Transaction(object):
             self.deleted[oid] = obj
 
     async def clean_cache(self):
-        HARD_CACHE.clear()
+        self._cache.clear_pinned()
         await self._cache.clear()
 
     async def refresh(self, ob):
@@ -207,36 +375,97 @@ class Transaction(object):
             ob.__dict__[key] = value
         ob._p_serial = new._p_serial
 
+    def _read(self, result, ignore_registered=False, parent_id=None, of=None):
+        '''
+        object of a row, parent_id and of are the ones the row was queried
+        by when they are not selected
+        '''
+        if not ignore_registered:
+            obj = self._objects.get(result['zoid'])
+            if obj is not None:
+                return obj
+        obj = reader(result)
+        obj._p_jar = self
+        if not ignore_registered:
+            self._objects[result['zoid']] = obj
+            if self._strategy.writable_transaction:
+                self._loaded_states[result['zoid']] = (
+                    get_state_digest(result['state']),
+                    get_column(result, 'parent_id', parent_id),
+                    result['id'],
+                    get_column(result, 'of', of),
+                    result['state'] if obj.__merge_conflicts__ else None)
+        return obj
+
     async def get(self, oid, ignore_registered=False):
         """Getting a oid from the db"""
 
         if not ignore_registered:
             obj = self.modified.get(oid, None)
+            if obj is None:
+                obj = self._objects.get(oid)
             if obj is not None:
                 return obj
 
-        result = HARD_CACHE.get(oid, None)
+        result = await self._cache.get_pinned(oid)
         if result is None:
             result = await self._cache.get(oid=oid)
 
         if result is not None:
-            obj = reader(result)
-            obj._p_jar = self
-            return obj
+            return self._read(result, ignore_registered)
 
+        generation = self._cache.get_generation()
         result = await self._manager._storage.load(self, oid)
-        obj = reader(result)
-        obj._p_jar = self
+        self.loaded_bytes += len(result['state'])
+        obj = self._read(result, ignore_registered)
 
         if obj.__immutable_cache__:
-            # ttl of zero means we want to provide a hard cache here
-            HARD_CACHE[oid] = result
+            self._cache_set_pinned(result, generation)
         else:
             if self._cache.max_cache_record_size > len(result['state']):
-                await self._cache.set(result, oid=oid)
+                await self._cache_set(result, generation, oid=oid)
 
         return obj
 
+    async def get_many(self, oids):
+        """Getting many oids from the db, with one query for the uncached ones.
+        Objects are returned in the same order as the oids"""
+
+        results = {}
+        missing = []
+        for oid in oids:
+            obj = self.modified.get(oid, None)
+            if obj is None:
+                obj = self._objects.get(oid)
+            if obj is not None:
+                results[oid] = obj
+                continue
+            result = await self._cache.get_pinned(oid)
+            if result is None:
+                result = await self._cache.get(oid=oid)
+            if result is not None:
+                results[oid] = self._read(result)
+            else:
+                missing.append(oid)
+
+        if len(missing) > 0:
+            generation = self._cache.get_generation()
+            for result in await self._manager._storage.load_many(self, missing):
+                self.loaded_bytes += len(result['state'])
+                obj = self._read(result)
+                results[result['zoid']] = obj
+                if obj.__immutable_cache__:
+                    self._cache_set_pinned(result, generation)
+                elif self._cache.max_cache_record_size > len(result['state']):
+                    await self._cache_set(result, generation, oid=result['zoid'])
+
+        objects = []
+        for oid in oids:
+            if oid not in results:
+                raise KeyError(oid)
+            objects.append(results[oid])
+        return objects
+
     async def commit(self):
         await self._call_before_commit_hooks()
         self.status = Status.COMMITTING
@@ -268,7 +497,7 @@ class Transaction(object):
             await hook(*args, **kws)
         self._before_commit = []
 
-    async def _store_object(self, obj, oid, added=False):
+    def _get_store_record(self, obj, oid, added=False):
         # Modified objects
         if obj._p_jar is not self and obj._p_jar is not None:
             raise Exception('Invalid reference to txn')
@@ -278,27 +507,192 @@ class Transaction(object):
             serial = None
         else:
             serial = getattr(obj, "_p_serial", 0)
+        return oid, serial, IWriter(obj), obj
 
-        await self._manager._storage.store(
-            oid, serial, IWriter(obj), obj, self)
-        obj._p_serial = self._tid
-        obj._p_oid = oid
-        if obj._p_jar is None:
-            obj._p_jar = self
-        self._objects_to_invalidate.append(obj)
+    def _is_unchanged(self, oid, writer):
+        '''
+        registered objects with the same location and serialized state
+        they were loaded with
+        '''
+        loaded = self._loaded_states.get(oid)
+        if loaded is None:
+            return False
+        digest, parent_id, id, of, _ = loaded
+        return ((parent_id, id, of) == (writer.parent_id, writer.id, writer.of) and
+                digest == get_state_digest(writer.serialize()))
+
+    def _merges_conflicts(self, oid):
+        # the stored state is only kept for types merging conflicts
+        loaded = self._loaded_states.get(oid)
+        return loaded is not None and loaded[4] is not None
+
+    async def _resolve_conflicts(self, records):
+        '''
+        merge the objects that failed to be stored with a tid conflict with
+        the versions committed by other transactions since they were loaded
+        and store them again. Returns the records of the stored objects or
+        None when a conflict can not be resolved
+        '''
+        rows = await self._manager._storage.load_many(
+            self, [oid for oid, _, _, _ in records])
+        rows = {row['zoid']: row for row in rows}
+        stored = []
+        to_store = []
+        for record in records:
+            oid, _, _, obj = record
+            row = rows.get(oid)
+            if row is None:
+                # deleted by the other transaction
+                return None
+            if row['tid'] == self._tid:
+                # written before the conflict
+                stored.append(record)
+                continue
+            if row['tid'] != obj._p_serial:
+                _, parent_id, id, of, state = self._loaded_states[oid]
+                if (get_column(row, 'parent_id', parent_id), row['id'],
+                        get_column(row, 'of', of)) != (parent_id, id, of):
+                    # moved by the other transaction
+                    return None
+                try:
+                    new_state = obj._p_resolve_conflict(
+                        get_state(state), get_state(row['state']), obj.__getstate__())
+                except ConflictError:
+                    logger.info(f'Could not resolve conflict on {oid}', exc_info=True)
+                    return None
+                obj.__setstate__(new_state)
+                obj._p_serial = row['tid']
+                self._loaded_states[oid] = (
+                    get_state_digest(row['state']), parent_id, id, of, row['state'])
+                self.resolved_conflicts += 1
+            # merged objects are stored on top of the committed versions
+            to_store.append(self._get_store_record(obj, oid))
+        if len(to_store) > 0:
+            await self._manager._storage.store_many(self, to_store)
+            logger.info(f'Resolved conflicts on {[oid for oid, _, _, _ in to_store]}')
+        return stored + to_store
+
+    async def _store_registered(self):
+        """Store added and modified objects"""
+        to_store = []
+        for oid, obj in self.added.items():
+            to_store.append(self._get_store_record(obj, oid, True))
+        unchanged = []
+        for oid, obj in self.modified.items():
+            record = self._get_store_record(obj, oid)
+            if self._is_unchanged(oid, record[2]):
+                unchanged.append(oid)
+            else:
+                to_store.append(record)
+        for oid in unchanged:
+            # nothing written, so nothing to invalidate or conflict with
+            del self.modified[oid]
+        self.skipped_writes += len(unchanged)
+        # objects merging conflicts are stored last, on their own, so the
+        # other objects are all written when they fail with a tid conflict
+        mergeable = [record for record in to_store
+                     if record[0] in self.modified and self._merges_conflicts(record[0])]
+        if len(mergeable) > 0:
+            merged_oids = set(oid for oid, _, _, _ in mergeable)
+            to_store = [record for record in to_store if record[0] not in merged_oids]
+        # registered for invalidation before storing so a tid conflict in
+        # the batch still invalidates the cached values
+        self._objects_to_invalidate.extend(obj for _, _, _, obj in to_store + mergeable)
+        if len(to_store) > 0:
+            await self._manager._storage.store_many(self, to_store)
+        if len(mergeable) > 0:
+            try:
+                await self._manager._storage.store_many(self, mergeable)
+            except TIDConflictError:
+                mergeable = await self._resolve_conflicts(mergeable)
+                if mergeable is None:
+                    raise
+            to_store.extend(mergeable)
+        for oid, serial, _, obj in to_store:
+            if serial is not None:
+                self._loaded_serials.setdefault(oid, serial)
+            obj._p_serial = self._tid
+            obj._p_oid = oid
+            if obj._p_jar is None:
+                obj._p_jar = self
+        return to_store
 
     async def real_commit(self):
         """Commit changes to an object"""
-        for oid, obj in self.added.items():
-            await self._store_object(obj, oid, True)
-        for oid, obj in self.modified.items():
-            await self._store_object(obj, oid)
+        await self._store_registered()
         for oid, obj in self.deleted.items():
             if obj._p_jar is not self and obj._p_jar is not None:
                 raise Exception('Invalid reference to txn')
             await self._manager._storage.delete(self, oid)
             self._objects_to_invalidate.append(obj)
 
+    async def savepoint(self):
+        '''
+        Store the added and modified objects and create a savepoint of the
+        db transaction to roll back to with `rollback_to`. Deletions are
+        still done on commit.
+        '''
+        await self.get_connection()
+        if self._db_txn is None:
+            raise InvalidSavepoint('Savepoints need a db transaction')
+        for oid, _, writer, obj in await self._store_registered():
+            # later changes are compared with what is now in the db
+            self._objects[oid] = obj
+            self._loaded_states[oid] = (
+                get_state_digest(writer.serialize()), writer.parent_id, writer.id,
+                writer.of, writer.serialize() if obj.__merge_conflicts__ else None)
+        self.savepoint_added.update(self.added)
+        self.savepoint_modified.update(self.modified)
+        self.added = OrderedDict()
+        self.modified = {}
+        savepoint = Savepoint(self, f'guillotina_{len(self._savepoints)}')
+        await self._manager._storage.savepoint(self, savepoint.name)
+        self._savepoints.append(savepoint)
+        return savepoint
+
+    async def rollback_to(self, savepoint):
+        '''
+        Roll back the changes done after the savepoint. Objects stored or
+        registered since get the state they had at the savepoint, objects
+        added since are discarded.
+        '''
+        if savepoint not in self._savepoints:
+            raise InvalidSavepoint(f'Can not roll back to {savepoint.name}')
+        await self._manager._storage.rollback_to_savepoint(self, savepoint.name)
+        # the savepoint is kept, the ones after it are released
+        del self._savepoints[self._savepoints.index(savepoint) + 1:]
+
+        changed = self._objects_to_invalidate[savepoint.stored:]
+        changed.extend(self.modified.values())
+        for oid in self.added:
+            self._objects.pop(oid, None)
+        self.added = OrderedDict()
+        self.modified = {}
+        self.deleted = dict(savepoint.deleted)
+        self.savepoint_added = OrderedDict(savepoint.savepoint_added)
+        self.savepoint_modified = dict(savepoint.savepoint_modified)
+        self._loaded_states = dict(savepoint.loaded_states)
+        del self._objects_to_invalidate[savepoint.stored:]
+        del self._before_commit[savepoint.before_commit:]
+        del self._after_commit[savepoint.after_commit:]
+
+        rows = await self._manager._storage.load_many(
+            self, list(set(obj._p_oid for obj in changed)))
+        rows = {row['zoid']: row for row in rows}
+        for obj in changed:
+            row = rows.get(obj._p_oid)
+            if row is None:
+                # added after the savepoint
+                self._objects.pop(obj._p_oid, None)
+                continue
+            parent = obj.__parent__
+            obj.__setstate__(reader(row).__getstate__())
+            # the stored state holds a copy of the parent
+            obj.__parent__ = self._objects.get(row['parent_id'], parent)
+            obj._p_serial = row['tid']
+        # setting the state of slots registers the objects again
+        self.modified = {}
+
     async def tpc_vote(self):
         """Verify that a data manager can commit the transaction."""
         ok = await self._strategy.tpc_vote()
@@ -318,7 +712,13 @@ class Transaction(object):
         self.added = {}
         self.modified = {}
         self.deleted = {}
+        self._objects.clear()
+        self._loaded_states = {}
+        self._loaded_serials = {}
         self._objects_to_invalidate = []
+        self._savepoints = []
+        self.savepoint_added = OrderedDict()
+        self.savepoint_modified = {}
         self._db_txn = None
 
     # Inspection
@@ -326,66 +726,183 @@ class Transaction(object):
     async def keys(self, oid):
         keys = await self._cache.get(oid=oid, variant='keys')
         if keys is None:
+            generation = self._cache.get_generation()
             keys = []
             for record in await self._manager._storage.keys(self, oid):
                 keys.append(record['id'])
-            await self._cache.set(keys, oid=oid, variant='keys')
+            await self._cache_set(keys, generation, oid=oid, variant='keys')
         return keys
 
     async def get_child(self, container, key):
         result = await self._cache.get(container=container, id=key)
+        if is_tombstone(result):
+            return None
         if result is None:
-            result = await self._manager._storage.get_child(self, container._p_oid, key)
+            generation = self._cache.get_generation()
+            result = await self._manager._storage.get_child(
+                self, container._p_oid, key, part=self._get_children_part(container))
             if result is None:
+                await self._cache_set(TOMBSTONE, generation, container=container, id=key)
                 return None
+            self.loaded_bytes += len(result['state'])
             if self._cache.max_cache_record_size > len(result['state']):
-                await self._cache.set(result, container=container, id=key)
+                await self._cache_set(result, generation, container=container, id=key)
 
-        obj = reader(result)
+        obj = self._read(result, parent_id=container._p_oid)
         obj.__parent__ = container
-        obj._p_jar = self
         return obj
 
+    def _get_children_part(self, container):
+        # children of objects outside of containers can be containers
+        # with partitions of their own
+        return get_partition_id(container) or None
+
+    async def get_children(self, container, keys):
+        """Get the children of container for keys with one query for the
+        uncached ones. Missing keys are skipped, order of keys is kept"""
+        results = {}
+        missing = []
+        for key in keys:
+            result = await self._cache.get(container=container, id=key)
+            if result is None:
+                missing.append(key)
+            elif not is_tombstone(result):
+                results[key] = result
+
+        if len(missing) > 0:
+            generation = self._cache.get_generation()
+            for result in await self._manager._storage.get_children(
+                    self, container._p_oid, missing,
+                    part=self._get_children_part(container)):
+                results[result['id']] = result
+                self.loaded_bytes += len(result['state'])
+                if self._cache.max_cache_record_size > len(result['state']):
+                    await self._cache_set(
+                        result, generation, container=container, id=result['id'])
+            for key in missing:
+                if key not in results:
+                    await self._cache_set(TOMBSTONE, generation, container=container, id=key)
+
+        objects = []
+        for key in keys:
+            if key not in results:
+                continue
+            obj = self._read(results[key], parent_id=container._p_oid)
+            obj.__parent__ = container
+            objects.append(obj)
+        return objects
+
     async def contains(self, oid, key):
-        return await self._manager._storage.has_key(self, oid, key)  # noqa
+        result = await self._cache.get(oid=oid, id=key)
+        if result is not None:
+            return not is_tombstone(result)
+        if await self._cache.get(oid=oid, id=key, variant='contains'):
+            return True
+        generation = self._cache.get_generation()
+        if await self._manager._storage.has_key(self, oid, key):  # noqa
+            await self._cache_set(True, generation, oid=oid, id=key, variant='contains')
+            return True
+        await self._cache_set(TOMBSTONE, generation, oid=oid, id=key)
+        return False
 
     async def len(self, oid):
         result = await self._cache.get(oid=oid, variant='len')
         if result is None:
+            generation = self._cache.get_generation()
             result = await self._manager._storage.len(self, oid)
-            await self._cache.set(result, oid=oid, variant='len')
+            await self._cache_set(result, generation, oid=oid, variant='len')
         return result
 
-    async def items(self, container):
+    async def items(self, container, page_size=100, annotations=()):
+        """Iterate the children of container, the annotations ids are
+        loaded for each page of children with one query per id"""
         # XXX not using cursor because we can't cache with cursor results...
         keys = await self.keys(container._p_oid)
-        for key in keys:
-            yield key, await self.get_child(container, key)
+        for idx in range(0, len(keys), page_size):
+            children = await self.get_children(container, keys[idx:idx + page_size])
+            for id in annotations:
+                await self.get_annotations(children, id)
+            for obj in children:
+                yield obj.__name__, obj
 
     async def get_annotation(self, base_obj, id):
         result = await self._cache.get(container=base_obj, id=id, variant='annotation')
+        if is_tombstone(result):
+            raise KeyError(id)
         if result is None:
-            result = await self._manager._storage.get_annotation(self, base_obj._p_oid, id)
+            generation = self._cache.get_generation()
+            result = await self._manager._storage.get_annotation(
+                self, base_obj._p_oid, id, part=get_partition_id(base_obj))
             if result is None:
                 raise KeyError(id)
+            self.loaded_bytes += len(result['state'])
             if self._cache.max_cache_record_size > len(result['state']):
-                await self._cache.set(result, container=base_obj, id=id, variant='annotation')
-        obj = reader(result)
+                await self._cache_set(
+                    result, generation, container=base_obj, id=id, variant='annotation')
+        return self._read_annotation(result, base_obj)
+
+    def _read_annotation(self, result, base_obj):
+        obj = self._read(result, of=base_obj._p_oid)
+        # annotations follow the object they annotate when it is moved to
+        # another partition, cached rows can have the partition it had
+        obj.__partition_id__ = get_partition_id(base_obj)
         obj.__of__ = base_obj._p_oid
-        obj._p_jar = self
         return obj
 
+    async def get_annotations(self, base_objs, id):
+        """Get the id annotation of base_objs with one query for the uncached
+        ones and keep them in the annotations of the objects. Returns the
+        annotations found by the oid of the object they annotate"""
+        results = {}
+        missing = []
+        for base_obj in base_objs:
+            if id in base_obj.__annotations__:
+                results[base_obj._p_oid] = base_obj.__annotations__[id]
+                continue
+            result = await self._cache.get(container=base_obj, id=id, variant='annotation')
+            if result is None:
+                missing.append(base_obj)
+            elif not is_tombstone(result):
+                results[base_obj._p_oid] = self._read_annotation(result, base_obj)
+
+        if len(missing) > 0:
+            parts = set(get_partition_id(base_obj) for base_obj in missing)
+            generation = self._cache.get_generation()
+            rows = await self._manager._storage.get_annotations(
+                self, [base_obj._p_oid for base_obj in missing], id,
+                part=parts.pop() if len(parts) == 1 else None)
+            rows = {row['of']: row for row in rows}
+            for base_obj in missing:
+                result = rows.get(base_obj._p_oid)
+                if result is None:
+                    # objects without the annotation do not query it again
+                    await self._cache_set(
+                        TOMBSTONE, generation, container=base_obj, id=id, variant='annotation')
+                    continue
+                self.loaded_bytes += len(result['state'])
+                if self._cache.max_cache_record_size > len(result['state']):
+                    await self._cache_set(
+                        result, generation, container=base_obj, id=id, variant='annotation')
+                results[base_obj._p_oid] = self._read_annotation(result, base_obj)
+
+        for base_obj in base_objs:
+            if base_obj._p_oid in results:
+                base_obj.__annotations__[id] = results[base_obj._p_oid]
+        return results
+
     async def get_annotation_keys(self, oid):
         result = await self._cache.get(oid=oid, variant='annotation-keys')
         if result is None:
+            generation = self._cache.get_generation()
             result = [r['id'] for r in await self._manager._storage.get_annotation_keys(self, oid)]
-            await self._cache.set(result, oid=oid, variant='annotation-keys')
+            await self._cache_set(result, generation, oid=oid, variant='annotation-keys')
 
     async def del_blob(self, bid):
         return await self._manager._storage.del_blob(self, bid)
 
-    async def write_blob_chunk(self, bid, oid, chunk_index, data):
-        return await self._manager._storage.write_blob_chunk(self, bid, oid, chunk_index, data)
+    async def write_blob_chunk(self, bid, oid, chunk_index, data, part=None):
+        return await self._manager._storage.write_blob_chunk(
+            self, bid, oid, chunk_index, data, part=part)
 
     async def read_blob_chunk(self, bid, chunk=0):
         return await self._manager._storage.read_blob_chunk(self, bid, chunk)
@@ -403,24 +920,36 @@ class Transaction(object):
         return await self._manager._storage.get_total_resources_of_type(
             self, type_)
 
-    async def _get_resources_of_type(self, type_, page_size=1000):
-        page = 1
-        keys = await self._manager._storage._get_page_resources_of_type(
-            self, type_, page=page, page_size=page_size)
-        while len(keys) > 0:
-            for key in keys:
-                yield key
-            page += 1
-            keys = await self._manager._storage._get_page_resources_of_type(
-                self, type_, page=page, page_size=page_size)
-
-    async def iterate_keys(self, oid, page_size=1000):
-        page = 1
-        keys = await self._manager._storage.get_page_of_keys(
-            self, oid, page=page, page_size=page_size)
-        while len(keys) > 0:
+    async def _get_resources_of_type(self, type_, page_size=1000, cursor=None):
+        '''
+        Iterate all the records of a type, pass the zoid of the last
+        record seen as cursor to resume iteration
+        '''
+        records = await self._manager._storage._get_batch_resources_of_type(
+            self, type_, cursor=cursor, page_size=page_size)
+        while len(records) > 0:
+            for record in records:
+                yield record
+            records = await self._manager._storage._get_batch_resources_of_type(
+                self, type_, cursor=records[-1]['zoid'], page_size=page_size)
+
+    async def get_batch_of_keys(self, oid, cursor=None, page_size=1000):
+        '''
+        Returns a batch of keys and the cursor to get the next one with.
+        The cursor is None when there are no more keys.
+        '''
+        records = await self._manager._storage.get_batch_of_keys(
+            self, oid, cursor=cursor, page_size=page_size)
+        next_cursor = None
+        if len(records) == page_size:
+            next_cursor = records[-1]['zoid']
+        return [record['id'] for record in records], next_cursor
+
+    async def iterate_keys(self, oid, page_size=1000, cursor=None):
+        while True:
+            keys, cursor = await self.get_batch_of_keys(
+                oid, cursor=cursor, page_size=page_size)
             for key in keys:
                 yield key
-            page += 1
-            keys = await self._manager._storage.get_page_of_keys(
-                self, oid, page=page, page_size=page_size)
+            if cursor is None:
+                break
@@ -10,6 +10,7 @@ from guillotina.utils import get_authenticated_user_id
 from guillotina.utils import get_current_request
 
 import asyncpg
+import time
 
 
 logger = glogging.getLogger('guillotina')
@@ -34,11 +35,12 @@ class TransactionManager(object):
             txn = self._last_txn
         return await txn.get(ROOT_ID)
 
-    async def begin(self, request=None):
+    async def begin(self, request=None, read_only=False):
         """Starts a new transaction.
-        """
 
-        db_conn = self._last_db_conn = await self._storage.open()
+        read_only transactions get no tid and can not write, whatever the
+        request is
+        """
 
         if request is None:
             try:
@@ -50,19 +52,21 @@ class TransactionManager(object):
 
         txn = None
         # already has txn registered, as long as connection is closed, it
-        # is safe
+        # is safe. Transactions of other databases are not reused
         if (getattr(request, '_txn', None) is not None and
+                request._txn._manager is self and
                 request._txn._db_conn is None and
                 request._txn.status in (Status.ABORTED, Status.COMMITTED)):
             # re-use txn if possible
             txn = request._txn
             txn.status = Status.ACTIVE
+            txn.read_only = read_only
         # XXX do we want to auto clean up here? Or throw an error?
         # This will break tests that are starting multiple transactions
         # else:
         #     await self._close_txn(request._txn)
         else:
-            txn = Transaction(self, request=request)
+            txn = Transaction(self, request=request, read_only=read_only)
 
         self._last_txn = txn
 
@@ -74,7 +78,8 @@ class TransactionManager(object):
 
         if user is not None:
             txn.user = user
-        await txn.tpc_begin(db_conn)
+        # the connection is only acquired by the first query of the txn
+        await txn.tpc_begin()
 
         return txn
 
@@ -111,6 +116,11 @@ class TransactionManager(object):
                 else:
                     raise
             txn._db_conn = None
+            txn.connection_time += time.time() - txn._db_conn_acquired
+        if txn is not None:
+            logger.debug(f'Transaction {txn._tid} held connections '
+                         f'{txn.connection_time:.4f}s for {txn.queries} queries, '
+                         f'{txn.skipped_writes} unchanged objects not written')
         if txn == self._last_txn:
             self._last_txn = None
             self._last_db_conn = None
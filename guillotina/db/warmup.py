@@ -0,0 +1,116 @@
+from collections import Counter
+from guillotina._settings import app_settings
+from guillotina.component import getUtility
+from guillotina.db import ROOT_ID
+from guillotina.interfaces import IApplication
+from guillotina.interfaces import IDatabase
+from guillotina.registry import REGISTRY_DATA_KEY
+
+import asyncio
+import logging
+import re
+import time
+
+
+logger = logging.getLogger('guillotina')
+
+# request line of the common and combined log formats
+ACCESS_LOG_REQUEST = re.compile(r'"[A-Z]+ (?P<path>[^ "]+)[^"]*"')
+
+
+def get_top_paths(filename, size):
+    '''
+    most accessed paths of an access log. Lines can be in common log format
+    or just the path
+    '''
+    counter = Counter()
+    with open(filename) as fi:
+        for line in fi:
+            match = ACCESS_LOG_REQUEST.search(line)
+            if match is not None:
+                path = match.group('path')
+            else:
+                path = line.strip()
+            if not path.startswith('/'):
+                continue
+            counter[path.split('?')[0].strip('/')] += 1
+    return [path for path, _ in counter.most_common(size) if path]
+
+
+class Warmup:
+    '''
+    Load the database roots, containers, container registries and the most
+    accessed paths in the storage caches. Every load runs in its own read
+    only transaction and no more than `max_connections` run at the same time.
+    '''
+
+    def __init__(self, root, settings=None):
+        self.root = root
+        self.settings = settings or app_settings['warmup']
+        self.semaphore = asyncio.Semaphore(self.settings.get('max_connections') or 1)
+        self.loaded_bytes = 0
+        self.duration = 0
+
+    def get_databases(self):
+        for _id, db in self.root:
+            if IDatabase.providedBy(db):
+                yield _id, db
+
+    async def run_in_txn(self, db, func, *args):
+        async with self.semaphore:
+            tm = db.get_transaction_manager()
+            # loads only, no tid or db transaction is needed
+            txn = await tm.begin(read_only=True)
+            try:
+                return await func(txn, *args)
+            finally:
+                self.loaded_bytes += txn.loaded_bytes
+                await tm.abort(txn=txn)
+
+    async def load_containers(self, txn):
+        root = await txn.get(ROOT_ID)
+        containers = await txn.get_children(root, await txn.keys(ROOT_ID))
+        return [container.__name__ for container in containers]
+
+    async def load_registry(self, txn, name):
+        root = await txn.get(ROOT_ID)
+        container = await txn.get_child(root, name)
+        if container is not None:
+            try:
+                await txn.get_annotation(container, REGISTRY_DATA_KEY)
+            except KeyError:
+                pass
+
+    async def load_path(self, txn, path):
+        ob = await txn.get(ROOT_ID)
+        for name in path:
+            if name.startswith('@') or name.startswith('_'):
+                # views and private names are not traversed
+                break
+            ob = await txn.get_child(ob, name)
+            if ob is None:
+                break
+
+    async def warmup_database(self, db):
+        names = await self.run_in_txn(db, self.load_containers)
+        await asyncio.gather(*[
+            self.run_in_txn(db, self.load_registry, name) for name in names])
+
+    async def run(self):
+        start = time.time()
+        tasks = [self.warmup_database(db) for _, db in self.get_databases()]
+        if self.settings.get('access_log'):
+            for path in get_top_paths(self.settings['access_log'],
+                                      self.settings.get('top_paths', 100)):
+                db_id, *path = path.split('/')
+                if db_id in self.root and IDatabase.providedBy(self.root[db_id]):
+                    tasks.append(self.run_in_txn(self.root[db_id], self.load_path, path))
+        await asyncio.gather(*tasks)
+        self.duration = time.time() - start
+        logger.info(f'Cache warmup loaded {self.loaded_bytes} bytes '
+                    f'in {self.duration:.2f} seconds')
+        return self
+
+
+async def warmup_on_startup(app):
+    await Warmup(getUtility(IApplication, name='root')).run()
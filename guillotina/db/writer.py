@@ -1,13 +1,36 @@
 from guillotina import configure
 from guillotina._settings import app_settings
 from guillotina.component import queryAdapter
+from guillotina.db.compression import encode_state
 from guillotina.db.interfaces import IWriter
 from guillotina.db.orm.interfaces import IBaseObject
 from guillotina.interfaces import ICatalogDataAdapter
+from guillotina.interfaces import IContainer
 from guillotina.interfaces import IResource
 from guillotina.utils import get_dotted_name
 
 import pickle
+import zlib
+
+
+def get_partition_id(ob):
+    '''
+    Objects are partitioned by container: a container gets a partition from
+    its id and everything in it the partition of its parent, so objects moved
+    to another container get the partition of the new one. Objects without
+    parent, like annotations, keep the partition they were given and the
+    other ones outside of containers are in partition 0.
+    '''
+    if IContainer.providedBy(ob):
+        # needs to fit the int parameter of store statements
+        return zlib.crc32(ob.__name__.encode('utf-8')) & 0x7fffffff
+    parent = getattr(ob, '__parent__', None)
+    if parent is not None:
+        return get_partition_id(parent)
+    part = getattr(ob, '__partition_id__', None)
+    if part is not None:
+        return part
+    return 0
 
 
 @configure.adapter(
@@ -19,6 +42,7 @@ class Writer(object):
 
     def __init__(self, obj):
         self._obj = obj
+        self._state = None
 
     async def get_json(self):
         return None
@@ -37,10 +61,14 @@ class Writer(object):
 
     @property
     def part(self):
-        return getattr(self._obj, '__partition_id__', 0)
+        return get_partition_id(self._obj)
 
     def serialize(self):
-        return pickle.dumps(self._obj, protocol=pickle.HIGHEST_PROTOCOL)
+        # compared with the loaded state before being stored
+        if self._state is None:
+            self._state = encode_state(
+                pickle.dumps(self._obj, protocol=pickle.HIGHEST_PROTOCOL))
+        return self._state
 
     @property
     def parent_id(self):
@@ -135,3 +135,10 @@ class ResourceLockedTimeout(Exception):
     The resource you are trying to lock for writing is already locked by
     another process and the wait time for the lock has expired
     '''
+
+
+class InvalidSavepoint(Exception):
+    '''
+    The savepoint was rolled back past, belongs to another transaction or
+    the transaction does not support savepoints
+    '''
@@ -14,6 +14,7 @@ from guillotina.content import load_cached_schema
 from guillotina.content import StaticDirectory
 from guillotina.content import StaticFile
 from guillotina.contentnegotiation import ContentNegotiatorUtility
+from guillotina.db.warmup import warmup_on_startup
 from guillotina.exceptions import ConflictError
 from guillotina.exceptions import TIDConflictError
 from guillotina.factory.content import ApplicationRoot
@@ -95,6 +96,12 @@ class GuillotinaAIOHTTPApplication(web.Application):
                     getattr(getattr(request, '_txn', None), '_tid', 'not issued')
                 ))
             return aiohttp.web_exceptions.HTTPConflict()
+        finally:
+            if retries == 0:
+                # request data kept to replay it on retries
+                cache_data = getattr(request, '_cache_data', None)
+                if cache_data is not None:
+                    cache_data.close()
 
     def _make_request(self, message, payload, protocol, writer, task,
                       _cls=Request):
@@ -253,6 +260,9 @@ def make_app(config_file=None, settings=None, loop=None, server_app=None):
 
     server_app.on_cleanup.append(close_utilities)
 
+    if app_settings['warmup'].get('on_startup'):
+        server_app.on_startup.append(warmup_on_startup)
+
     for util in app_settings['utilities']:
         root.add_async_utility(util, loop=loop)
 
@@ -41,6 +41,7 @@ class DatabaseSpecialPermissions(PrincipalPermissionManager):
         self.grant_permission_to_principal('guillotina.AccessContent', ROOT_USER_ID)
         self.grant_permission_to_principal('guillotina.GetDatabases', ROOT_USER_ID)
         self.grant_permission_to_principal('guillotina.GetAPIDefinition', ROOT_USER_ID)
+        self.grant_permission_to_principal('guillotina.ManageCache', ROOT_USER_ID)
 
 
 @configure.adapter(for_=IApplication, provides=IPrincipalPermissionManager)
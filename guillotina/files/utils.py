@@ -1,46 +1,90 @@
 from .const import MAX_REQUEST_CACHE_SIZE
-from guillotina.exceptions import UnRetryableRequestError
 
 import asyncio
 import base64
 import mimetypes
+import mmap
 import os
+import tempfile
+
+
+class RequestDataBuffer:
+    '''
+    data read from a request, to replay it on conflict retries. It is kept
+    in memory up to max_memory_size and spooled to a temporary file after,
+    read back with mmap
+    '''
+
+    def __init__(self, max_memory_size=MAX_REQUEST_CACHE_SIZE):
+        self.max_memory_size = max_memory_size
+        self._data = bytearray()
+        self._file = None
+        self._mmap = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, data):
+        if self._file is None and self._size + len(data) > self.max_memory_size:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._data)
+            self._data = None
+        if self._file is not None:
+            self._close_mmap()
+            self._file.write(data)
+        else:
+            self._data.extend(data)
+        self._size += len(data)
+
+    def read(self, start, size):
+        if self._file is None:
+            return bytes(self._data[start:start + size])
+        if self._mmap is None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[start:start + size]
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def close(self):
+        self._close_mmap()
+        if self._file is not None:
+            # temporary files are deleted when closed
+            self._file.close()
+            self._file = None
+        self._data = bytearray()
+        self._size = 0
 
 
 async def read_request_data(request, chunk_size):
     '''
     cachable request data reader to help with conflict error requests
     '''
+    buffer = getattr(request, '_cache_data', None)
+    if buffer is None:
+        buffer = request._cache_data = RequestDataBuffer()
+
     if getattr(request, '_retry_attempt', 0) > 0:
-        # we are on a retry request, see if we have read cached data yet...
+        # we are on a retry request, replay the data read by previous attempts
         if request._retry_attempt > getattr(request, '_last_cache_data_retry_count', 0):
-            if getattr(request, '_cache_data', None) is None:
-                # request payload was too large to fit into request cache.
-                # so retrying this request is not supported and we need to throw
-                # another error
-                raise UnRetryableRequestError()
-            data = request._cache_data[request._last_read_pos:request._last_read_pos + chunk_size]
+            data = buffer.read(request._last_read_pos, chunk_size)
             request._last_read_pos += len(data)
-            if request._last_read_pos >= len(request._cache_data):
+            if request._last_read_pos >= len(buffer):
                 # done reading cache data
                 request._last_cache_data_retry_count = request._retry_attempt
-            return data
-
-    if not hasattr(request, '_cache_data'):
-        request._cache_data = b''
+            if data:
+                return data
 
     try:
         data = await request.content.readexactly(chunk_size)
     except asyncio.IncompleteReadError as e:
         data = e.partial
 
-    if request._cache_data is not None:
-        if len(request._cache_data) + len(data) > MAX_REQUEST_CACHE_SIZE:
-            # we only allow caching up to chunk size, otherwise, no cache data..
-            request._cache_data = None
-        else:
-            request._cache_data += data
-
+    buffer.write(data)
     request._last_read_pos += len(data)
     return data
 
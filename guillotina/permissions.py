@@ -16,6 +16,7 @@ configure.permission('guillotina.DeleteContainers', 'Delete a portal')
 configure.permission('guillotina.MountDatabase', 'Mount a Database')
 configure.permission('guillotina.GetDatabases', 'Get Databases')
 configure.permission('guillotina.UmountDatabase', 'Umount a Database')
+configure.permission('guillotina.ManageCache', 'Manage the storage caches')
 
 configure.permission('guillotina.AccessPreflight', 'Access Preflight View')
 
@@ -1,11 +1,24 @@
+from guillotina import glogging
+from guillotina._settings import app_settings
 from guillotina.annotations import AnnotationData
 from guillotina.browser import get_physical_path
+from guillotina.db.cache.base import get_pinned_cache
+from guillotina.db.cache.objects import clone
 from guillotina.db.orm.interfaces import IBaseObject
+from guillotina.db.writer import get_partition_id
+from guillotina.interfaces import ACTIVE_LAYERS_KEY
+from guillotina.interfaces import IAnnotations
 from guillotina.interfaces import IRegistry
 from guillotina.schema._bootstrapinterfaces import IContextAwareDefaultFactory
+from guillotina.utils import import_class
 from zope.interface import alsoProvides
 from zope.interface import implementer
+from zope.interface.declarations import Declaration
 
+import time
+
+
+logger = glogging.getLogger('guillotina')
 
 REGISTRY_DATA_KEY = '_registry'
 
@@ -88,3 +101,61 @@ class Registry(AnnotationData):
                     proxy[name] = field.defaultFactory()
             elif field.default is not None:
                 proxy[name] = field.default
+
+
+def get_layers(registry):
+    layers = []
+    for layer in registry.get(ACTIVE_LAYERS_KEY, []):
+        try:
+            layers.append(import_class(layer))
+        except ModuleNotFoundError:
+            logger.error('Can not apply layer ' + layer)
+    return Declaration(*layers)
+
+
+async def get_container_registry(container):
+    '''
+    registry of the container and the spec of its active layers.
+
+    Parsed registries are pinned in the process by container and registry
+    tid, under the cache key of the registry annotation so they are
+    invalidated with it, and validated against the tid of the registry
+    once older than the `validate_interval` of the pinned cache. Every
+    call gets its own copy of the registry.
+    '''
+    txn = container._p_jar
+    key = txn._cache.get_key(container=container, id=REGISTRY_DATA_KEY, variant='annotation')
+    pinned = get_pinned_cache()
+    entry = pinned.get(key)
+    if entry is not None:
+        (oid, tid, template, layers), validated = entry
+        interval = (app_settings.get('pinned_cache') or {}).get('validate_interval', 10)
+        if time.time() - validated > interval:
+            try:
+                current_tid = await txn._manager._storage.get_object_tid(txn, oid)
+            except KeyError:
+                current_tid = None
+            if current_tid != tid:
+                pinned.delete(key)
+                entry = None
+            else:
+                pinned.set(key, ((oid, tid, template, layers), time.time()))
+
+    if entry is None:
+        registry = await IAnnotations(container).async_get(REGISTRY_DATA_KEY)
+        if registry is None:
+            return None, None
+        layers = get_layers(registry)
+        pinned.set(key, ((registry._p_oid, registry._p_serial, clone(registry), layers),
+                         time.time()))
+        return registry, layers
+
+    registry = clone(template)
+    registry._p_oid = oid
+    registry._p_serial = tid
+    registry.__name__ = REGISTRY_DATA_KEY
+    registry.__of__ = container._p_oid
+    registry.__partition_id__ = get_partition_id(container)
+    registry._p_jar = txn
+    container.__annotations__[REGISTRY_DATA_KEY] = registry
+    return registry, layers
@@ -1,8 +1,8 @@
 from guillotina import testing
 from guillotina.component import getUtility
 from guillotina.content import load_cached_schema
+from guillotina.db.cache.base import get_pinned_cache
 from guillotina.db.storages.cockroach import CockroachStorage
-from guillotina.db.transaction import HARD_CACHE
 from guillotina.factory import make_app
 from guillotina.interfaces import IApplication
 from guillotina.tests import docker_containers as containers
@@ -156,7 +156,7 @@ class DummyRequestAsyncContextManager(object):
 
 @pytest.fixture(scope='function')
 def dummy_request(dummy_guillotina, monkeypatch):
-    HARD_CACHE.clear()
+    get_pinned_cache().clear()
     from guillotina.interfaces import IApplication
     from guillotina.component import getUtility
     root = getUtility(IApplication, name='root')
@@ -183,13 +183,13 @@ class RootAsyncContextManager(object):
 
 @pytest.fixture(scope='function')
 async def dummy_txn_root(dummy_request):
-    HARD_CACHE.clear()
+    get_pinned_cache().clear()
     return RootAsyncContextManager(dummy_request)
 
 
 @pytest.fixture(scope='function')
 def guillotina_main(loop):
-    HARD_CACHE.clear()
+    get_pinned_cache().clear()
     from guillotina import test_package  # noqa
     aioapp = make_app(settings=get_pg_settings(), loop=loop)
     aioapp.config.execute_actions()
@@ -199,7 +199,7 @@ def guillotina_main(loop):
 
 @pytest.fixture(scope='function')
 async def guillotina(test_server, postgres, guillotina_main, loop):
-    HARD_CACHE.clear()
+    get_pinned_cache().clear()
     server = await test_server(guillotina_main)
     requester = GuillotinaDBRequester(server=server, loop=loop)
     return requester
@@ -17,6 +17,21 @@ class MockDBTransaction:
         self._transacion = trns
 
 
+class MockRecord:
+    '''
+    row with the interface of asyncpg records, which have no get()
+    '''
+
+    def __init__(self, **columns):
+        self._columns = columns
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def keys(self):
+        return iter(self._columns.keys())
+
+
 @implementer(ITransaction)
 class MockTransaction:
     def __init__(self, manager=None):
@@ -26,6 +41,7 @@ class MockTransaction:
         self._tid = 1
         self.modified = {}
         self.request = None
+        self.read_only = False
         self._strategy = getMultiAdapter(
             (manager._storage, self), ITransactionStrategy,
             name=manager._storage._transaction_strategy)
@@ -57,8 +73,17 @@ class MockStorage:
         self._objects = {}
         self._parent_objs = {}
 
-    async def get_annotation(self, trns, oid, id):
-        return None
+    async def get_annotation(self, trns, oid, id, part=None):
+        annotation_oid = self._objects.get(oid, {}).get('annotations', {}).get(id)
+        return self._objects.get(annotation_oid)
+
+    async def get_annotations(self, trns, oids, id, part=None):
+        results = []
+        for oid in oids:
+            result = await self.get_annotation(trns, oid, id, part=part)
+            if result is not None:
+                results.append(dict(result, of=oid))
+        return results
 
     async def start_transaction(self, trns):
         self._transaction = MockDBTransaction(self, trns)
@@ -76,7 +101,13 @@ class MockStorage:
     async def load(self, txn, oid):
         return self._objects[oid]
 
-    async def get_child(self, txn, container_p_oid, key):
+    async def load_many(self, txn, oids):
+        return [self._objects[oid] for oid in oids if oid in self._objects]
+
+    async def get_object_tid(self, txn, oid):
+        return self._objects[oid]['tid']
+
+    async def get_child(self, txn, container_p_oid, key, part=None):
         if container_p_oid not in self._objects:
             return
         children = self._objects[container_p_oid]['children']
@@ -85,16 +116,34 @@ class MockStorage:
             if oid in self._objects:
                 return self._objects[oid]
 
+    async def has_key(self, txn, container_p_oid, key):
+        return key in self._objects.get(container_p_oid, {}).get('children', {})
+
+    async def get_children(self, txn, container_p_oid, keys, part=None):
+        results = []
+        for key in keys:
+            result = await self.get_child(txn, container_p_oid, key, part=part)
+            if result is not None:
+                results.append(result)
+        return results
+
+    async def store_many(self, txn, objects):
+        for _, _, _, ob in objects:
+            self.store(ob)
+
     def store(self, ob):
         writer = IWriter(ob)
         self._objects[ob._p_oid] = {
             'state': writer.serialize(),
             'zoid': ob._p_oid,
             'tid': 1,
-            'id': writer.id,
-            'children': self._objects.get(ob._p_oid, {}).get('children', {})
+            'id': writer.id or ob.__name__,
+            'children': self._objects.get(ob._p_oid, {}).get('children', {}),
+            'annotations': self._objects.get(ob._p_oid, {}).get('annotations', {})
         }
-        if ob.__parent__ and ob.__parent__._p_oid in self._objects:
+        if ob.__of__ and ob.__of__ in self._objects:
+            self._objects[ob.__of__]['annotations'][ob.__name__] = ob._p_oid
+        elif ob.__parent__ and ob.__parent__._p_oid in self._objects:
             self._objects[ob.__parent__._p_oid]['children'][ob.id] = ob._p_oid
 
 
@@ -1,7 +1,11 @@
 from guillotina.behaviors.attachment import IAttachment
+from guillotina.files.utils import read_request_data
+from guillotina.files.utils import RequestDataBuffer
 from guillotina.tests import utils
 from guillotina.transactions import managed_transaction
+from types import SimpleNamespace
 
+import asyncio
 import json
 
 
@@ -128,3 +132,49 @@ async def test_tus(container_requester):
             behavior = IAttachment(obj)
             await behavior.load()
             assert behavior.file._blob.chunks == 10
+
+
+def test_request_data_buffer_spools_to_disk():
+    buffer = RequestDataBuffer(max_memory_size=10)
+    buffer.write(b'01234')
+    assert buffer._file is None
+    buffer.write(b'567890123')
+    assert buffer._file is not None
+    assert len(buffer) == 14
+    assert buffer.read(3, 5) == b'34567'
+    buffer.write(b'45')
+    assert buffer.read(10, 10) == b'012345'
+    buffer.close()
+    assert len(buffer) == 0
+    assert buffer._file is None
+
+
+class RequestContent:
+
+    def __init__(self, data):
+        self.data = data
+
+    async def readexactly(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        if len(chunk) < size:
+            raise asyncio.IncompleteReadError(chunk, size)
+        return chunk
+
+
+async def test_read_request_data_replays_on_retry(loop):
+    body = bytes(range(25))
+    request = SimpleNamespace(content=RequestContent(body), _last_read_pos=0)
+    request._cache_data = RequestDataBuffer(max_memory_size=10)
+    assert await read_request_data(request, 10) == body[:10]
+    assert await read_request_data(request, 10) == body[10:20]
+
+    # conflict error, the data already read is replayed from the buffer
+    request._retry_attempt = 1
+    request._last_read_pos = 0
+    chunks = []
+    data = await read_request_data(request, 10)
+    while data:
+        chunks.append(data)
+        data = await read_request_data(request, 10)
+    assert b''.join(chunks) == body
+    assert len(request._cache_data) == 25
@@ -1,8 +1,30 @@
+from guillotina._settings import app_settings
+from guillotina.component import getUtility
+from guillotina.content import Container
+from guillotina.content import Item
+from guillotina.db import ROOT_ID
+from guillotina.db.cache import base
+from guillotina.db.cache import memory
+from guillotina.db.cache import objects
 from guillotina.db.cache.base import BaseCache
+from guillotina.db.cache.base import get_pinned_cache
+from guillotina.db.reader import reader
 from guillotina.db.transaction import Transaction
+from guillotina.db.warmup import get_top_paths
+from guillotina.db.warmup import Warmup
+from guillotina.interfaces import ACTIVE_LAYERS_KEY
+from guillotina.interfaces import IApplication
+from guillotina.interfaces import IDefaultLayer
+from guillotina.registry import get_container_registry
+from guillotina.registry import Registry
+from guillotina.registry import REGISTRY_DATA_KEY
 from guillotina.tests import mocks
 from guillotina.tests.utils import create_content
 
+import json
+import pickle
+import uuid
+
 
 class MemoryCache(BaseCache):
 
@@ -58,7 +80,10 @@ async def test_cache_object(dummy_guillotina):
     assert loaded._p_oid == ob._p_oid
     assert cache._actions[0]['action'] == 'stored'
 
-    # and load from cache
+    # and load from cache, in another transaction since the loaded object
+    # is kept by this one
+    txn = Transaction(tm)
+    txn._cache = cache
     await txn.get(ob._p_oid)
     assert cache._actions[-1]['action'] == 'loaded'
 
@@ -98,3 +123,418 @@ async def test_do_not_cache_large_object(dummy_guillotina):
     assert id(loaded) != id(ob)
     assert loaded._p_oid == ob._p_oid
     assert len(cache._actions) == 0
+
+
+async def test_cache_children_loaded_in_bulk(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    cache = MemoryCache(storage, txn)
+    txn._cache = cache
+    parent = create_content()
+    storage.store(parent)
+    children = []
+    for _ in range(3):
+        ob = create_content()
+        ob.__parent__ = parent
+        storage.store(ob)
+        children.append(ob)
+
+    keys = [ob.id for ob in reversed(children)] + ['missing']
+    loaded = await txn.get_children(parent, keys)
+    assert [ob.id for ob in loaded] == keys[:-1]
+    # missing children are cached too
+    assert len([a for a in cache._actions if a['action'] == 'stored']) == 4
+
+    loaded = await txn.get_children(parent, keys)
+    assert [ob.id for ob in loaded] == keys[:-1]
+    assert len([a for a in cache._actions if a['action'] == 'loaded']) == 4
+
+
+def test_lru_cache_bounded_by_size():
+    lru = memory.LRUCache(1000)
+    lru.set('foo', b'x', size=400)
+    lru.set('bar', b'x', size=400)
+    assert lru.get('foo') == b'x'
+    # bar is the least recently used
+    lru.set('foobar', b'x', size=400)
+    assert 'bar' not in lru
+    assert 'foo' in lru
+    assert lru.size == 800
+    # too big to be cached
+    lru.set('big', b'x', size=2000)
+    assert 'big' not in lru
+    assert lru.get('bar') is None
+    assert lru.get_stats() == {
+        'hits': 1,
+        'misses': 1,
+        'hit_ratio': 0.5,
+        'evictions': 1,
+        'invalidations': 0,
+        'entries': 2,
+        'size': 800,
+        'max_size': 1000
+    }
+
+
+async def test_memory_cache_invalidated_on_close(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    cache = memory.MemoryCache(storage, txn)
+    cache._lru = memory.LRUCache(1024 * 1024)
+    txn._cache = cache
+    parent = create_content()
+    storage.store(parent)
+    ob = create_content()
+    ob.__parent__ = parent
+    storage.store(ob)
+
+    await txn.get_child(parent, ob.id)
+    await txn.get(ob._p_oid)
+    await txn.get(ob._p_oid)
+    assert cache.get_stats()['memory']['hits'] == 1
+    assert cache.get_stats()['memory']['entries'] == 2
+
+    # aborted transactions do not invalidate
+    txn.modified[ob._p_oid] = ob
+    await cache.close(invalidate=False)
+    assert cache.get_stats()['memory']['entries'] == 2
+
+    await cache.close()
+    assert cache.get_stats()['memory']['entries'] == 0
+    assert cache.get_stats()['memory']['invalidations'] == 2
+
+
+def test_lru_cache_tracks_invalidations():
+    lru = memory.LRUCache(1000)
+    lru.max_invalidated_keys = 2
+    generation = base.get_generation()
+    assert not lru.invalidated_since('foo', generation)
+    # keys not in the cache can be being loaded too
+    lru.delete('foo')
+    assert lru.invalidated_since('foo', generation)
+    assert not lru.invalidated_since('foo', base.get_generation())
+    assert not lru.invalidated_since('bar', generation)
+
+    # once foo is not tracked anymore, all the values loaded before its
+    # invalidation are assumed to be invalidated
+    lru.delete('bar')
+    lru.delete('foobar')
+    assert lru.invalidated_since('foo', generation)
+    assert lru.invalidated_since('other', generation)
+    assert not lru.invalidated_since('other', base.get_generation())
+
+    generation = base.get_generation()
+    lru.clear()
+    assert lru.invalidated_since('other', generation)
+    assert not lru.invalidated_since('other', base.get_generation())
+
+
+async def test_invalidations_while_loading_are_not_overwritten(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    cache = memory.MemoryCache(storage, txn)
+    cache._lru = memory.LRUCache(1024 * 1024)
+    txn._cache = cache
+    ob = create_content()
+    storage.store(ob)
+
+    load = storage.load
+
+    async def load_invalidated(txn, oid):
+        result = await load(txn, oid)
+        # committed by another process while the row was being read
+        await cache.delete(cache.get_key(oid=oid))
+        return result
+
+    storage.load = load_invalidated
+    await txn.get(ob._p_oid)
+    assert cache.get_stats()['memory']['entries'] == 0
+
+    storage.load = load
+    await txn.get(ob._p_oid)
+    assert cache.get_stats()['memory']['entries'] == 1
+
+
+class PinnedItem(Item):
+    __immutable_cache__ = True
+
+
+async def test_pinned_objects_validated_by_tid(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    cache = MemoryCache(storage, txn)
+    txn._cache = cache
+    get_pinned_cache().clear()
+    ob = create_content(PinnedItem)
+    storage.store(ob)
+
+    await txn.get(ob._p_oid)
+    assert ob._p_oid in get_pinned_cache()
+    # pinned objects are not in the main cache
+    assert len([a for a in cache._actions if a['action'] == 'stored']) == 0
+    # the pinned cache is shared by all the tests of the process
+    hits = get_pinned_cache().get_stats()['hits']
+    await txn.get(ob._p_oid, ignore_registered=True)
+    assert get_pinned_cache().get_stats()['hits'] == hits + 1
+
+    # modified in the database, the pinned record is dropped once validated
+    storage._objects[ob._p_oid] = dict(storage._objects[ob._p_oid], tid=2)
+    settings = app_settings['pinned_cache']
+    app_settings['pinned_cache'] = {'validate_interval': -1}
+    try:
+        loaded = await txn.get(ob._p_oid)
+    finally:
+        app_settings['pinned_cache'] = settings
+    assert loaded._p_serial == 2
+    assert get_pinned_cache().get(ob._p_oid)[0]['tid'] == 2
+
+    # and invalidated by transactions writing them
+    txn.modified[ob._p_oid] = loaded
+    await cache.close()
+    assert ob._p_oid not in get_pinned_cache()
+
+
+async def test_cache_missing_children(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    cache = MemoryCache(storage, txn)
+    txn._cache = cache
+    parent = create_content()
+    storage.store(parent)
+
+    assert await txn.get_child(parent, 'foobar') is None
+    assert cache._actions[-1]['action'] == 'stored'
+    assert await txn.get_child(parent, 'foobar') is None
+    assert cache._actions[-1]['action'] == 'loaded'
+    assert not await txn.contains(parent._p_oid, 'foobar')
+    assert cache._actions[-1]['action'] == 'loaded'
+
+    # adding the child invalidates the tombstone
+    ob = create_content(id='foobar')
+    ob.__parent__ = parent
+    storage.store(ob)
+    for key in cache.get_cache_keys(ob, 'added'):
+        await cache.delete(key)
+    assert await txn.contains(parent._p_oid, 'foobar')
+    assert cache._actions[-1]['key'] == f'{parent._p_oid}/foobar-contains'
+    assert (await txn.get_child(parent, 'foobar'))._p_oid == ob._p_oid
+
+
+async def test_object_cache_copies_do_not_share_state(dummy_guillotina):
+    ob = create_content()
+    ob.title = 'Item'
+    ob.tags = ['foo']
+    result = {
+        'zoid': ob._p_oid,
+        'tid': 1,
+        'id': ob.id,
+        'state': pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL)
+    }
+    app_settings['object_cache'] = {'max_size': 1024 * 1024}
+    try:
+        first = reader(result)
+        second = reader(result)
+        assert objects._object_cache.get_stats()['hits'] == 1
+        assert first is not second
+        first.title = 'Changed'
+        first.tags.append('bar')
+        third = reader(result)
+        assert third.title == second.title == 'Item'
+        assert third.tags == second.tags == ['foo']
+        assert third._p_serial == 1
+        assert third._p_jar is None
+    finally:
+        app_settings['object_cache'] = {'max_size': 0}
+        objects._object_cache = None
+
+
+def test_get_top_paths_of_access_log(tmpdir):
+    access_log = tmpdir.join('access.log')
+    access_log.write('\n'.join([
+        '127.0.0.1 - - [18/Oct/2017:10:00:00 +0000] "GET /db/guillotina/foobar HTTP/1.1" 200 12',
+        '127.0.0.1 - - [18/Oct/2017:10:00:01 +0000] "GET /db/guillotina/foobar?b=1 HTTP/1.1" 200 12',
+        '/db/guillotina/',
+        'invalid line'
+    ]))
+    assert get_top_paths(str(access_log), 10) == ['db/guillotina/foobar', 'db/guillotina']
+    assert get_top_paths(str(access_log), 1) == ['db/guillotina/foobar']
+
+
+async def test_warmup_loads_containers_and_paths(container_requester, tmpdir):
+    async with await container_requester as requester:
+        await requester('POST', '/db/guillotina/', data=json.dumps({
+            '@type': 'Item',
+            'id': 'foobar'
+        }))
+        access_log = tmpdir.join('access.log')
+        access_log.write('\n'.join([
+            '/db/guillotina/foobar',
+            '/db/guillotina/foobar/@sharing',
+            '/db/guillotina/missing',
+            '/missing/guillotina'
+        ]))
+        warmup = await Warmup(getUtility(IApplication, name='root'), {
+            'max_connections': 2,
+            'access_log': str(access_log),
+            'top_paths': 10
+        }).run()
+        assert warmup.loaded_bytes > 0
+        assert warmup.duration > 0
+
+
+async def test_cache_stats_by_variant(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    cache = memory.MemoryCache(tm._storage, Transaction(tm))
+    cache._lru = memory.LRUCache(1024 * 1024)
+    base._lookups.clear()
+
+    await cache.set(['foobar'], oid='foo', variant='keys')
+    await cache.get(oid='foo', variant='keys')
+    await cache.get(oid='bar', variant='keys')
+    await cache.get(oid='foo')
+    stats = cache.get_stats()
+    assert stats['lookups']['keys'] == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+    assert stats['lookups']['object'] == {'hits': 0, 'misses': 1, 'hit_ratio': 0}
+    assert stats['memory']['entries'] == 1
+
+    await cache.set({'state': b'x'}, oid='foo')
+    await cache.set({'state': b'x'}, oid='foo', id='bar')
+    await cache.delete_prefix('foo/')
+    assert cache._lru.keys() == ['foo-keys', 'foo']
+
+
+async def test_cache_stats_and_clear_services(container_requester):
+    async with await container_requester as requester:
+        response, status = await requester('GET', '/@cache-stats')
+        assert status == 200
+        assert 'pinned' in response['db']
+        response, status = await requester('GET', '/db/@cache-stats')
+        assert status == 200
+        assert list(response.keys()) == ['db']
+
+        _, status = await requester('POST', '/db/@cache-clear', data=json.dumps({}))
+        assert status == 400
+        _, status = await requester('POST', '/db/@cache-clear', data=json.dumps({
+            'oid': ROOT_ID
+        }))
+        assert status == 200
+        _, status = await requester('POST', '/@cache-clear', data=json.dumps({
+            'prefix': ROOT_ID
+        }))
+        assert status == 200
+
+
+async def test_container_registry_pinned_by_tid(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    container = create_content(Container, type_name='Container')
+    container._p_jar = txn
+    storage.store(container)
+    registry = Registry()
+    registry._p_oid = uuid.uuid4().hex
+    registry.__of__ = container._p_oid
+    registry.data[ACTIVE_LAYERS_KEY] = frozenset({'guillotina.interfaces.layer.IDefaultLayer'})
+    storage.store(registry)
+
+    first, layers = await get_container_registry(container)
+    assert IDefaultLayer in layers
+    first.data['foo'] = 'bar'
+    container.__annotations__.clear()
+    second, layers = await get_container_registry(container)
+    assert IDefaultLayer in layers
+    assert second is not first
+    assert 'foo' not in second
+    assert second._p_oid == registry._p_oid
+    assert second._p_jar is txn
+    assert container.__annotations__[REGISTRY_DATA_KEY] is second
+
+    # committing changes to the registry invalidates it
+    key = txn._cache.get_key(container=container, id=REGISTRY_DATA_KEY, variant='annotation')
+    assert key in get_pinned_cache()
+    txn._cache.delete_pinned(txn._cache.get_cache_keys(second))
+    assert key not in get_pinned_cache()
+
+    # changed by another process, seen by a new transaction
+    txn._objects.clear()
+    container.__annotations__.clear()
+    await get_container_registry(container)
+    storage._objects[registry._p_oid] = dict(storage._objects[registry._p_oid], tid=2)
+    container.__annotations__.clear()
+    # only validated after the interval
+    settings = app_settings['pinned_cache']
+    app_settings['pinned_cache'] = {'validate_interval': 60}
+    try:
+        stale, _ = await get_container_registry(container)
+        assert stale._p_serial == 1
+        container.__annotations__.clear()
+        app_settings['pinned_cache'] = {'validate_interval': -1}
+        third, _ = await get_container_registry(container)
+    finally:
+        app_settings['pinned_cache'] = settings
+    assert third._p_serial == 2
+
+
+async def test_container_registry_not_validated_on_every_request(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    container = create_content(Container, type_name='Container')
+    storage.store(container)
+    registry = Registry()
+    registry._p_oid = uuid.uuid4().hex
+    registry.__of__ = container._p_oid
+    storage.store(registry)
+    get_pinned_cache().clear()
+
+    calls = []
+    get_object_tid = storage.get_object_tid
+
+    async def counted_get_object_tid(txn, oid):
+        calls.append(oid)
+        return await get_object_tid(txn, oid)
+
+    storage.get_object_tid = counted_get_object_tid
+    # the transactions of two requests with the default dummy cache
+    for _ in range(2):
+        txn = Transaction(tm)
+        container._p_jar = txn
+        container.__annotations__.clear()
+        registry, _ = await get_container_registry(container)
+        assert registry._p_serial == 1
+    assert len(calls) == 0
+
+
+async def test_transaction_identity_map(dummy_guillotina):
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    txn = Transaction(tm)
+    container = create_content(Container, type_name='Container')
+    container._p_jar = txn
+    storage.store(container)
+    ob = create_content(Item, id='foobar')
+    ob._p_jar = txn
+    ob.__parent__ = container
+    storage.store(ob)
+    registry = Registry()
+    registry._p_oid = uuid.uuid4().hex
+    registry.__of__ = container._p_oid
+    storage.store(registry)
+
+    first = await txn.get(ob._p_oid)
+    assert first is not ob
+    assert await txn.get(ob._p_oid) is first
+    assert await txn.get_child(container, 'foobar') is first
+    assert (await txn.get_many([ob._p_oid]))[0] is first
+    annotation = await txn.get_annotation(container, REGISTRY_DATA_KEY)
+    assert await txn.get_annotation(container, REGISTRY_DATA_KEY) is annotation
+
+    # refreshing loads a new copy
+    assert await txn.get(ob._p_oid, ignore_registered=True) is not first
+
+    txn.tpc_cleanup()
+    assert await txn.get(ob._p_oid) is not first
@@ -0,0 +1,75 @@
+from guillotina._settings import app_settings
+from guillotina.db import compression
+from guillotina.db.reader import reader
+from guillotina.db.writer import Writer
+from guillotina.tests.utils import create_content
+
+import pickle
+import pytest
+
+
+@pytest.fixture
+def state_compression():
+    original = app_settings['state_compression']
+    app_settings['state_compression'] = {
+        'codec': 'zlib',
+        'min_size': 100
+    }
+    yield app_settings['state_compression']
+    app_settings['state_compression'] = original
+
+
+def _read(state):
+    return reader({
+        'state': state,
+        'zoid': 'foobar',
+        'tid': 1,
+        'id': 'foobar'
+    })
+
+
+def test_compressed_state_round_trip(dummy_guillotina, state_compression):
+    ob = create_content()
+    ob.title = 'foobar' * 100
+    state = Writer(ob).serialize()
+    assert state[:2] == compression.MAGIC + b'z'
+    assert len(state) < len(pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL))
+    assert _read(state).title == ob.title
+
+
+def test_small_state_not_compressed(dummy_guillotina, state_compression):
+    state_compression['min_size'] = 1024 * 1024
+    ob = create_content()
+    state = Writer(ob).serialize()
+    assert state[:1] != compression.MAGIC
+    assert _read(state).title == ob.title
+
+
+def test_uncompressed_rows_stay_readable(dummy_guillotina, state_compression):
+    ob = create_content()
+    ob.title = 'foobar' * 100
+    state = pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL)
+    assert _read(state).title == ob.title
+
+
+class ReverseCodec:
+    id = b'r'
+    name = 'reverse'
+
+    def compress(self, data):
+        return data[::-1][:len(data) // 2]
+
+    def decompress(self, data):
+        return bytes(data)
+
+
+def test_unknown_codec_raises():
+    with pytest.raises(KeyError):
+        compression.decode_state(compression.MAGIC + b'?' + b'foobar')
+
+
+def test_custom_codec_by_dotted_name(dummy_guillotina, state_compression):
+    state_compression['codec'] = 'guillotina.tests.test_compression.ReverseCodec'
+    state = compression.encode_state(b'x' * 200)
+    assert state == compression.MAGIC + b'r' + b'x' * 100
+    assert compression.decode_state(state) == b'x' * 100
@@ -1,8 +1,16 @@
+from guillotina.annotations import AnnotationData
+from guillotina.content import Container
 from guillotina.content import Folder
+from guillotina.content import Item
+from guillotina.db.cache import memory
 from guillotina.db.storages.cockroach import CockroachStorage
 from guillotina.db.storages.pg import PostgresqlStorage
 from guillotina.db.transaction_manager import TransactionManager
+from guillotina.db.writer import get_partition_id
 from guillotina.exceptions import ConflictError
+from guillotina.exceptions import InvalidSavepoint
+from guillotina.exceptions import TIDConflictError
+from guillotina.interfaces import IAnnotations
 from guillotina.tests.utils import create_content
 
 import asyncio
@@ -10,11 +18,16 @@ import asyncpg
 import concurrent
 import os
 import pytest
+import ujson
 
 
 USE_COCKROACH = 'USE_COCKROACH' in os.environ
 
 
+class MergingItem(Item):
+    __merge_conflicts__ = True
+
+
 async def cleanup(aps):
     conn = await aps.open()
     txn = conn.transaction()
@@ -29,7 +42,7 @@ async def cleanup(aps):
     await aps.finalize()
 
 
-async def get_aps(strategy=None, pool_size=16):
+async def get_aps(strategy=None, pool_size=16, **kwargs):
     dsn = "postgres://postgres:@localhost:5432/guillotina"
     klass = PostgresqlStorage
     if strategy is None:
@@ -43,7 +56,7 @@ async def get_aps(strategy=None, pool_size=16):
     aps = klass(
         dsn=dsn, name='db',
         transaction_strategy=strategy, pool_size=pool_size,
-        conn_acquire_timeout=0.1)
+        conn_acquire_timeout=0.1, **kwargs)
     await aps.initialize()
     return aps
 
@@ -148,6 +161,51 @@ async def test_deleting_parent_deletes_children(postgres, dummy_request):
     await cleanup(aps)
 
 
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not have cascade support")
+async def test_vacuum_deletes_trees_in_chunks(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(vacuum={'chunk_size': 2})
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    sub_folder = create_content(Folder, 'Folder')
+    await folder.async_set('sub', sub_folder)
+    items = []
+    for idx in range(3):
+        item = create_content()
+        await sub_folder.async_set(f'item{idx}', item)
+        items.append(item)
+    other = create_content()
+    txn.register(other)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    txn.delete(await txn.get(folder._p_oid))
+    await tm.commit(txn=txn)
+    # objects that are not trashed are never vacuumed
+    await aps._vacuum.add_to_queue(other._p_oid)
+
+    await aps._vacuum._queue.join()
+    await aps._vacuum.wait_until_no_longer_active()
+    stats = aps.get_cache_stats()['vacuum']
+    assert stats['queue_size'] == 0
+    assert stats['objects_deleted'] == 5
+    assert not stats['active']
+
+    txn = await tm.begin()
+    for ob in [folder, sub_folder] + items:
+        with pytest.raises(KeyError):
+            await txn.get(ob._p_oid)
+    assert (await txn.get(other._p_oid))._p_oid == other._p_oid
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
 async def test_create_blob(postgres, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -282,6 +340,89 @@ async def test_should_resolve_conflict_error(postgres, dummy_request):
     await cleanup(aps)
 
 
+async def test_resolve_conflict_on_deleted_object_modified_concurrently(
+        postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps('resolve')
+    tm = TransactionManager(aps)
+
+    txn = await tm.begin()
+    ob1 = create_content()
+    ob2 = create_content()
+    txn.register(ob1)
+    txn.register(ob2)
+    await tm.commit(txn=txn)
+
+    # 1 started before 2
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+
+    ob1_1 = await txn1.get(ob1._p_oid)
+    ob2_1 = await txn1.get(ob2._p_oid)
+    ob1_2 = await txn2.get(ob1._p_oid)
+    ob1_2.title = 'foobar'
+    txn2.register(ob1_2)
+    txn1.register(ob2_1)
+    txn1.delete(ob1_1)
+
+    conflicts = await aps.get_conflicts(txn1)
+    assert len(conflicts) == 0
+
+    # commit 2 before 1
+    await tm.commit(txn=txn2)
+    conflicts = await aps.get_conflicts(txn1)
+    assert [c['zoid'] for c in conflicts] == [ob1._p_oid]
+    with pytest.raises(ConflictError):
+        await tm.commit(txn=txn1)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support savepoints")
+async def test_conflicts_of_concurrent_writers_of_an_object(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps('resolve')
+    tm = TransactionManager(aps)
+
+    txn = await tm.begin()
+    ob = create_content()
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+    ob1 = await txn1.get(ob._p_oid)
+    ob2 = await txn2.get(ob._p_oid)
+    serial = ob1._p_serial
+    ob1.title = 'first'
+    ob2.title = 'second'
+    txn1.register(ob1)
+    txn2.register(ob2)
+
+    # 1 writes the object first, it now has the tid of 1
+    await txn1.savepoint()
+    assert ob1._p_serial == txn1._tid
+    assert txn1._loaded_serials == {ob._p_oid: serial}
+    assert await aps.get_conflicts(txn1) == []
+    assert await aps.get_conflicts(txn2) == []
+    await tm.commit(txn=txn1)
+
+    conflicts = await aps.get_conflicts(txn2)
+    assert [(c['zoid'], c['tid']) for c in conflicts] == [(ob._p_oid, txn1._tid)]
+    with pytest.raises(ConflictError):
+        await tm.commit(txn=txn2)
+
+    txn = await tm.begin()
+    assert (await txn.get(ob._p_oid)).title == 'first'
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
 async def test_should_not_resolve_conflict_error_with_simple_strat(postgres, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -494,11 +635,15 @@ async def test_exhausting_pool_size(postgres, dummy_request):
     aps = await get_aps(pool_size=2)
     tm = TransactionManager(aps)
     txn = await tm.begin()
+    # connections are acquired by the first query of the transactions
+    await txn.get_connection()
+    other = await tm.begin()
 
     with pytest.raises(concurrent.futures._base.TimeoutError):
         # should throw an error because we've run out of connections in pool
-        await tm.begin()
+        await other.get_connection()
 
+    await tm.abort(txn=other)
     await tm.abort(txn=txn)
 
     await aps.remove()
@@ -529,6 +674,641 @@ async def test_mismatched_tid_causes_conflict_error(postgres, dummy_request):
     await cleanup(aps)
 
 
+async def test_concurrent_changes_merged(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    ob = create_content(MergingItem)
+    ob.title = 'foo'
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    ours = await txn.get(ob._p_oid)
+    ours.title = 'mine'
+    ours._p_register()
+
+    other_tm = TransactionManager(aps)
+    other_txn = await other_tm.begin()
+    theirs = await other_txn.get(ob._p_oid)
+    theirs.description = 'theirs'
+    theirs._p_register()
+    await other_tm.commit(txn=other_txn)
+
+    await tm.commit(txn=txn)
+    assert txn.resolved_conflicts == 1
+
+    txn = await tm.begin()
+    ob = await txn.get(ob._p_oid)
+    assert ob.title == 'mine'
+    assert ob.description == 'theirs'
+    await tm.abort(txn=txn)
+    await aps.remove()
+    await cleanup(aps)
+
+
+async def test_store_many_objects_in_one_commit(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    for idx in range(aps._store_batch_size + 10):
+        await folder.async_set(f'item{idx}', create_content())
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    folder = await txn.get(folder._p_oid)
+    assert await folder.async_len() == aps._store_batch_size + 10
+    item = await folder.async_get('item3')
+    assert item._p_serial == folder._p_serial
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+async def test_store_many_names_mismatched_tid_oids(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    ob1 = create_content()
+    ob2 = create_content()
+    txn.register(ob1)
+    txn.register(ob2)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    ob1 = await txn.get(ob1._p_oid)
+    ob2 = await txn.get(ob2._p_oid)
+    ob1._p_serial = 3242432
+    txn.register(ob1)
+    txn.register(ob2)
+
+    with pytest.raises(TIDConflictError) as exc_info:
+        await tm.commit(txn=txn)
+    assert ob1._p_oid in str(exc_info.value)
+    assert ob2._p_oid not in str(exc_info.value)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+async def test_get_many_and_children_in_bulk(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    items = []
+    for idx in range(5):
+        item = create_content()
+        await folder.async_set(item.id, item)
+        items.append(item)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    oids = [item._p_oid for item in reversed(items)]
+    loaded = await txn.get_many(oids)
+    assert [ob._p_oid for ob in loaded] == oids
+
+    with pytest.raises(KeyError):
+        await txn.get_many(oids + ['foobar'])
+
+    folder = await txn.get(folder._p_oid)
+    keys = []
+    async for key, value in folder.async_items():
+        assert key == value.id
+        keys.append(key)
+    assert sorted(keys) == sorted(item.id for item in items)
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+async def test_annotations_of_items_loaded_in_bulk(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    items = []
+    for idx in range(6):
+        item = create_content()
+        await folder.async_set(item.id, item)
+        items.append(item)
+        if idx % 2 == 0:
+            data = AnnotationData()
+            data['foo'] = idx
+            await IAnnotations(item).async_set('foobar', data)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    folder = await txn.get(folder._p_oid)
+    queries = txn.queries
+    loaded = {}
+    async for key, value in folder.async_items(annotations=('foobar',)):
+        loaded[key] = value
+    # keys, children and annotations of the page
+    assert txn.queries == queries + 3
+    for idx, item in enumerate(items):
+        if idx % 2 == 0:
+            data = await IAnnotations(loaded[item.id]).async_get('foobar')
+            assert data['foo'] == idx
+            assert data.__of__ == item._p_oid
+    assert txn.queries == queries + 3
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+async def test_read_only_transactions_use_replica(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    # use the same database as replica, we only check the routing here
+    replica = await get_aps(replicas=[aps._dsn])
+    tm = TransactionManager(replica)
+    txn = await tm.begin()
+    ob = create_content()
+    txn.register(ob)
+    await tm.commit(txn=txn)
+    assert len(replica._replica_conns) == 0
+
+    request._db_write_enabled = False
+    txn = await tm.begin(request=request)
+    assert replica.is_replica_connection(await txn.get_connection())
+    ob2 = await txn.get(ob._p_oid)
+    assert ob2._p_oid == ob._p_oid
+    await tm.abort(txn=txn)
+    assert len(replica._replica_conns) == 0
+
+    # replicas lagging too much are not used
+    replica._replica_max_lag = -1
+    replica._replica_lags = {}
+    txn = await tm.begin(request=request)
+    assert not replica.is_replica_connection(await txn.get_connection())
+    await tm.abort(txn=txn)
+
+    await replica.finalize()
+    await aps.remove()
+    await cleanup(aps)
+
+
+async def test_rows_read_from_replica_are_not_cached(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    memory._lru = memory.LRUCache(1024 * 1024)
+    aps = await get_aps()
+    replica = await get_aps(replicas=[aps._dsn], cache_strategy='memory',
+                            cache_invalidations=False)
+    tm = TransactionManager(replica)
+    txn = await tm.begin()
+    ob = create_content()
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    request._db_write_enabled = False
+    txn = await tm.begin(request=request)
+    await txn.get(ob._p_oid)
+    assert txn._replica_reads
+    await tm.abort(txn=txn)
+    assert ob._p_oid not in memory._lru
+
+    # rows of the primary are cached
+    replica._replica_max_lag = -1
+    replica._replica_lags = {}
+    txn = await tm.begin(request=request)
+    await txn.get(ob._p_oid)
+    assert not txn._replica_reads
+    await tm.abort(txn=txn)
+    assert ob._p_oid in memory._lru
+
+    await replica.finalize()
+    await aps.remove()
+    await cleanup(aps)
+    memory._lru = None
+
+
+async def test_transactions_get_connection_on_first_query(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    assert txn._db_conn is None
+    assert txn._tid is not None
+    ob = create_content()
+    txn.register(ob)
+    await tm.commit(txn=txn)
+    assert txn.queries > 0
+    assert txn.connection_time > 0
+
+    # read only transactions only hold a connection for their queries,
+    # metrics add up for all the transactions of the request
+    request._db_write_enabled = False
+    txn = await tm.begin(request=request)
+    queries = txn.queries
+    ob2 = await txn.get(ob._p_oid)
+    assert ob2._p_oid == ob._p_oid
+    assert txn._db_conn is None
+    assert txn.queries == queries + 1
+    await tm.abort(txn=txn)
+
+    # transactions that do not query the db never take a connection
+    request._db_write_enabled = True
+    txn = await tm.begin(request=request)
+    queries, connection_time = txn.queries, txn.connection_time
+    await tm.commit(txn=txn)
+    assert txn._db_conn is None
+    assert txn.queries == queries
+    assert txn.connection_time == connection_time
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not use a tid sequence")
+async def test_tids_allocated_in_blocks(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(tid_block_size=10)
+    tids = [await aps.get_next_tid(None) for _ in range(15)]
+    assert tids == sorted(tids)
+    assert len(set(tids)) == 15
+    # only two round trips for 15 tids
+    assert await aps.get_current_tid(None) == tids[0] + 19
+
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    ob = create_content()
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+    ob1 = await txn1.get(ob._p_oid)
+    ob2 = await txn2.get(ob._p_oid)
+    txn1.delete(ob1)
+    txn2.register(ob2)
+    # commit with the higher tid first
+    await tm.commit(txn=txn2)
+    with pytest.raises(ConflictError):
+        await tm.commit(txn=txn1)
+
+    await aps.remove()
+    await cleanup(aps)
+
+    aps = await get_aps('simple', tid_block_size=10)
+    assert aps._tid_block_size == 1
+    await aps.finalize()
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support table partitioning")
+async def test_objects_partitioned_by_container(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(partitions=4)
+    await aps.remove()
+    await aps.create()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    container = create_content(Container, 'Container')
+    txn.register(container)
+    folder = create_content(Folder, 'Folder')
+    await container.async_set(folder.id, folder)
+    item = create_content()
+    await folder.async_set(item.id, item)
+    await IAnnotations(item).async_set('foobar', AnnotationData())
+    await tm.commit(txn=txn)
+
+    part = get_partition_id(container)
+    assert part != 0
+    async with aps._pool.acquire() as conn:
+        records = await conn.fetch(
+            'SELECT zoid, part, tableoid::regclass::text AS partition FROM objects '
+            'WHERE zoid = ANY($1::varchar(32)[])',
+            [container._p_oid, folder._p_oid, item._p_oid,
+             item.__annotations__['foobar']._p_oid])
+    assert len(records) == 4
+    assert set(r['part'] for r in records) == {part}
+    assert len(set(r['partition'] for r in records)) == 1
+
+    txn = await tm.begin()
+    container = await txn.get(container._p_oid)
+    assert container.__partition_id__ == part
+    folder = await container.async_get(folder.id)
+    item = await folder.async_get(item.id)
+    assert item.__partition_id__ == part
+    assert await IAnnotations(item).async_get('foobar') is not None
+    item.title = 'foobar'
+    item._p_register()
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    item = await txn.get(item._p_oid)
+    assert item.title == 'foobar'
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    aps._partitions = 0
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support partitioning")
+async def test_objects_moved_to_another_container_change_partition(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(partitions=4)
+    await aps.remove()
+    await aps.create()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    container1 = create_content(Container, 'Container')
+    container1.id = container1.__name__ = 'container1'
+    txn.register(container1)
+    container2 = create_content(Container, 'Container')
+    container2.id = container2.__name__ = 'container2'
+    txn.register(container2)
+    folder = create_content(Folder, 'Folder')
+    await container1.async_set(folder.id, folder)
+    item = create_content()
+    await folder.async_set(item.id, item)
+    await IAnnotations(item).async_set('foobar', AnnotationData())
+    await tm.commit(txn=txn)
+
+    part1 = get_partition_id(container1)
+    part2 = get_partition_id(container2)
+    assert part1 != part2
+
+    txn = await tm.begin()
+    container1 = await txn.get(container1._p_oid)
+    container2 = await txn.get(container2._p_oid)
+    folder = await container1.async_get(folder.id)
+    assert folder.__partition_id__ == part1
+    # how the @move service moves objects
+    folder.__parent__ = container2
+    folder._p_register()
+    await tm.commit(txn=txn)
+
+    annotation_oid = item.__annotations__['foobar']._p_oid
+    async with aps._pool.acquire() as conn:
+        records = await conn.fetch(
+            'SELECT zoid, part FROM objects WHERE zoid = ANY($1::varchar(32)[])',
+            [folder._p_oid, item._p_oid, annotation_oid])
+    assert len(records) == 3
+    assert set(r['part'] for r in records) == {part2}
+
+    txn = await tm.begin()
+    container2 = await txn.get(container2._p_oid)
+    folder = await container2.async_get(folder.id)
+    assert folder.__partition_id__ == part2
+    item = await folder.async_get(item.id)
+    assert item.__partition_id__ == part2
+    assert await IAnnotations(item).async_get('foobar') is not None
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    aps._partitions = 0
+    await cleanup(aps)
+
+
+async def test_cockroach_disables_cache_invalidations():
+    for cache_invalidations in (True, 'poll'):
+        storage = CockroachStorage(
+            dsn='postgres://root@localhost:26257/guillotina', cache_strategy='memory',
+            cache_invalidations=cache_invalidations)
+        assert not storage._cache_invalidations
+        assert not storage._poll_invalidations
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support LISTEN/NOTIFY")
+async def test_cache_invalidations_published_to_other_processes(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    memory._lru = memory.LRUCache(1024 * 1024)
+    aps = await get_aps(cache_strategy='memory')
+    assert aps._cache_invalidations
+    notifications = []
+    conn = await aps.open()
+    await conn.add_listener(
+        aps._invalidation_channel,
+        lambda conn, pid, channel, payload: notifications.append(ujson.loads(payload)))
+
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    ob = create_content()
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    # wait for the listener connection
+    for _ in range(50):
+        if len(notifications) > 0 and aps._invalidation_conn is not None:
+            break
+        await asyncio.sleep(0.1)
+    assert notifications[0]['tid'] == txn._tid
+    assert notifications[0]['origin'] == aps._invalidation_origin
+
+    # invalidations from other processes are applied to the local cache
+    memory._lru.set('foobar', b'foobar')
+    await conn.execute('SELECT pg_notify($1, $2)', aps._invalidation_channel, ujson.dumps({
+        'origin': 'other', 'tid': txn._tid + 1, 'keys': ['foobar']
+    }))
+    for _ in range(50):
+        if 'foobar' not in memory._lru:
+            break
+        await asyncio.sleep(0.1)
+    assert 'foobar' not in memory._lru
+    assert aps._last_invalidation_tid == txn._tid + 1
+
+    # too many keys for a notification, everything is invalidated
+    memory._lru.set('foobar', b'foobar')
+    txn = await tm.begin()
+    oids = []
+    for _ in range(200):
+        item = create_content()
+        txn.register(item)
+        oids.append(item._p_oid)
+    await tm.commit(txn=txn)
+    txn = await tm.begin()
+    for item in await txn.get_many(oids):
+        item.title = 'foobar'
+        item._p_register()
+    await tm.commit(txn=txn)
+    for _ in range(50):
+        if notifications[-1]['tid'] == txn._tid:
+            break
+        await asyncio.sleep(0.1)
+    assert notifications[-1]['tid'] == txn._tid
+    assert notifications[-1]['keys'] is None
+
+    await aps._pool.release(conn)
+    await aps.remove()
+    await cleanup(aps)
+    memory._lru = None
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support cache invalidations")
+async def test_cache_invalidations_polled_from_other_processes(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    memory._lru = memory.LRUCache(1024 * 1024)
+    aps = await get_aps(cache_strategy='memory', cache_invalidations='poll')
+    # tid blocks make the resolve strategy check the conflicts of deletes
+    other = await get_aps(cache_invalidations='poll', tid_block_size=10)
+    tm = TransactionManager(aps)
+    other_tm = TransactionManager(other)
+
+    txn = await tm.begin()
+    folder = create_content(Folder, type_name='Folder')
+    txn.register(folder)
+    ob = create_content()
+    ob.__parent__ = folder
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    # commits of the process are not invalidated again
+    txn = await tm.begin()
+    await txn.get(ob._p_oid)
+    await txn.get_child(folder, ob.id)
+    await tm.abort(txn=txn)
+    await aps.poll_invalidations()
+    assert ob._p_oid in memory._lru
+    assert f'{folder._p_oid}/{ob.id}' in memory._lru
+
+    # loaded through their parent, the parent of objects loaded on their
+    # own is a copy without oid
+    txn = await other_tm.begin()
+    item = await txn.get_child(await txn.get(folder._p_oid), ob.id)
+    item.title = 'foobar'
+    item._p_register()
+    await other_tm.commit(txn=txn)
+    await aps.poll_invalidations()
+    assert ob._p_oid not in memory._lru
+    assert f'{folder._p_oid}/{ob.id}' not in memory._lru
+
+    # deleted objects invalidate the keys of their former parent
+    txn = await tm.begin()
+    await txn.get(ob._p_oid)
+    assert len(await txn.keys(folder._p_oid)) == 1
+    await tm.abort(txn=txn)
+    assert ob._p_oid in memory._lru
+    assert f'{folder._p_oid}-keys' in memory._lru
+    txn = await other_tm.begin()
+    txn.delete(await txn.get_child(await txn.get(folder._p_oid), ob.id))
+    # trashing sets the tid of the transaction on the row, which is not a
+    # conflict when voting
+    await other_tm.commit(txn=txn)
+    await aps.poll_invalidations()
+    assert ob._p_oid not in memory._lru
+    assert f'{folder._p_oid}-keys' not in memory._lru
+    assert aps._invalidations_received == 2
+
+    await other.finalize()
+    await aps.remove()
+    await cleanup(aps)
+    memory._lru = None
+
+
+async def test_objects_loaded_by_oid_invalidate_their_parent_keys(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    memory._lru = memory.LRUCache(1024 * 1024)
+    aps = await get_aps(cache_strategy='memory', cache_invalidations=False)
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    folder = create_content(Folder, type_name='Folder')
+    txn.register(folder)
+    ob = create_content()
+    ob.__parent__ = folder
+    txn.register(ob)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    await txn.get_child(folder, ob.id)
+    await tm.abort(txn=txn)
+    assert f'{folder._p_oid}/{ob.id}' in memory._lru
+
+    txn = await tm.begin()
+    item = await txn.get(ob._p_oid)
+    # the stored state has a copy of the parent, without oid
+    assert item.__parent__._p_oid is None
+    item.title = 'changed'
+    item._p_register()
+    await tm.commit(txn=txn)
+    assert txn.status == 'Committed'
+    assert f'{folder._p_oid}/{ob.id}' not in memory._lru
+
+    await aps.remove()
+    await cleanup(aps)
+    memory._lru = None
+
+
+async def test_prepared_statements_are_cached_across_checkouts(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    # one connection is held for reads, the other one is the only free one
+    aps = await get_aps(pool_size=2)
+    sql = 'SELECT count(*) FROM objects WHERE zoid = $1'
+    pids = set()
+    names = set()
+    for _ in range(2):
+        conn = await aps._pool.acquire()
+        try:
+            # preparing it again on the same checkout does not prepare a
+            # new statement either
+            for _ in range(2):
+                smt = await aps.prepare_statement(conn, sql)
+                assert await smt.fetchval('foobar') == 0
+            pids.add(await conn.fetchval('SELECT pg_backend_pid()'))
+            prepared = await conn.fetch(
+                'SELECT name FROM pg_prepared_statements WHERE statement = $1',
+                sql)
+        finally:
+            await aps._pool.release(conn)
+        assert len(prepared) == 1
+        names.add(prepared[0]['name'])
+    # same connection, and the statement prepared the first time is reused
+    assert len(pids) == 1
+    assert len(names) == 1
+
+    # without statement cache every prepare is a new statement
+    await aps.finalize()
+    aps = await get_aps(pool_size=2, statement_cache_size=0)
+    conn = await aps._pool.acquire()
+    try:
+        first = await aps.prepare_statement(conn, sql)
+        second = await aps.prepare_statement(conn, sql)
+        prepared = await conn.fetchval(
+            'SELECT count(*) FROM pg_prepared_statements WHERE statement = $1', sql)
+        assert prepared == 2
+        assert await first.fetchval('foobar') == 0
+        assert await second.fetchval('foobar') == 0
+    finally:
+        await aps._pool.release(conn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
 async def test_iterate_keys(postgres, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -558,6 +1338,173 @@ async def test_iterate_keys(postgres, dummy_request):
     await tm.abort(txn=txn)
 
 
+async def test_resume_keys_from_cursor(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    parent = create_content()
+    txn.register(parent)
+    original_keys = []
+    for _ in range(25):
+        item = create_content()
+        original_keys.append(item.id)
+        item.__parent__ = parent
+        txn.register(item)
+
+    await tm.commit(txn=txn)
+    txn = await tm.begin()
+
+    keys, cursor = await txn.get_batch_of_keys(parent._p_oid, page_size=10)
+    assert len(keys) == 10
+    assert cursor is not None
+    async for key in txn.iterate_keys(parent._p_oid, 10, cursor=cursor):
+        keys.append(key)
+
+    assert len(keys) == 25
+    assert set(keys) == set(original_keys)
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support savepoints")
+async def test_savepoints(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps()
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    item1 = create_content()
+    item1.title = 'foo'
+    await folder.async_set(item1.id, item1)
+    savepoint = await txn.savepoint()
+    assert len(txn.modified) == 0
+    assert await txn.get(item1._p_oid) is item1
+
+    item1.title = 'changed'
+    item2 = create_content()
+    await folder.async_set(item2.id, item2)
+    await txn.savepoint()
+    txn.delete(item1)
+    await txn.rollback_to(savepoint)
+    assert item1.title == 'foo'
+    assert len(txn.modified) == 0
+    assert len(txn.deleted) == 0
+    assert not await folder.async_contains(item2.id)
+
+    # savepoints can be rolled back to more than once
+    item1.title = 'other'
+    await txn.rollback_to(savepoint)
+    assert item1.title == 'foo'
+
+    await tm.commit(txn=txn)
+    with pytest.raises(InvalidSavepoint):
+        await txn.rollback_to(savepoint)
+
+    txn = await tm.begin()
+    folder = await txn.get(folder._p_oid)
+    assert await folder.async_contains(item1.id)
+    assert not await folder.async_contains(item2.id)
+    assert (await folder.async_get(item1.id)).title == 'foo'
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support savepoints")
+async def test_rollback_across_savepoints(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    memory._lru = memory.LRUCache(1024 * 1024)
+    aps = await get_aps(cache_strategy='memory', cache_invalidations=False)
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    ob = create_content()
+    other = create_content()
+    txn.register(ob)
+    txn.register(other)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    await txn.get(other._p_oid)
+    await tm.abort(txn=txn)
+    assert other._p_oid in memory._lru
+
+    txn = await tm.begin()
+    item = await txn.get(ob._p_oid)
+    item.title = 'first'
+    item._p_register()
+    savepoint = await txn.savepoint()
+    other_item = await txn.get(other._p_oid)
+    other_item.title = 'second'
+    other_item._p_register()
+    await txn.savepoint()
+    assert list(txn.savepoint_modified) == [ob._p_oid, other._p_oid]
+
+    await txn.rollback_to(savepoint)
+    assert list(txn.savepoint_modified) == [ob._p_oid]
+    assert other_item.title is None
+    await tm.commit(txn=txn)
+    # the rolled back write was not committed, its cached value is kept
+    assert other._p_oid in memory._lru
+
+    txn = await tm.begin()
+    assert (await txn.get(ob._p_oid)).title == 'first'
+    assert (await txn.get(other._p_oid)).title is None
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+    memory._lru = None
+
+
+@pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not support savepoints")
+async def test_savepoint_writes_are_invalidated(postgres, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    memory._lru = memory.LRUCache(1024 * 1024)
+    aps = await get_aps(cache_strategy='memory', cache_invalidations=False)
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    ob = create_content()
+    other = create_content()
+    txn.register(ob)
+    txn.register(other)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    await txn.get(ob._p_oid)
+    await tm.abort(txn=txn)
+    assert ob._p_oid in memory._lru
+
+    txn = await tm.begin()
+    item = await txn.get(ob._p_oid)
+    item.title = 'changed'
+    item._p_register()
+    await txn.savepoint()
+    assert len(txn.modified) == 0
+    # rows read after storing at a savepoint may not be committed
+    await txn.get(other._p_oid)
+    assert other._p_oid not in memory._lru
+    await tm.commit(txn=txn)
+    assert ob._p_oid not in memory._lru
+
+    txn = await tm.begin()
+    assert (await txn.get(ob._p_oid)).title == 'changed'
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+    memory._lru = None
+
+
 @pytest.mark.skipif(USE_COCKROACH, reason="Cockroach does not like this test...")
 async def test_handles_asyncpg_trying_savepoints(postgres, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
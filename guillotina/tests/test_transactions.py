@@ -1,8 +1,48 @@
+from guillotina.content import Item
+from guillotina.db.conflicts import merge_states
+from guillotina.db.reader import reader
 from guillotina.db.transaction import Transaction
+from guillotina.exceptions import ConflictError
+from guillotina.exceptions import ReadOnlyError
+from guillotina.exceptions import TIDConflictError
 from guillotina.tests import mocks
 from guillotina.tests import utils
 from guillotina.transactions import managed_transaction
 
+import pytest
+
+
+class MergingItem(Item):
+    __merge_conflicts__ = True
+
+
+class TIDCheckingStorage(mocks.MockStorage):
+    '''
+    stores objects only when they have the tid they were loaded with, like
+    the tid checked updates of the postgresql storage
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self._tid = 100
+        self.loads = 0
+
+    async def get_next_tid(self, trns):
+        self._tid += 1
+        return self._tid
+
+    async def load_many(self, txn, oids):
+        self.loads += 1
+        return [mocks.MockRecord(**row) for row in await super().load_many(txn, oids)]
+
+    async def store_many(self, txn, objects):
+        for oid, old_serial, _, ob in objects:
+            if oid in self._objects and self._objects[oid]['tid'] != old_serial:
+                raise TIDConflictError(oid)
+        for oid, _, _, ob in objects:
+            self.store(ob)
+            self._objects[oid]['tid'] = txn._tid
+
 
 async def test_no_tid_created_for_reads(dummy_request, loop):
     dummy_request._db_write_enabled = False
@@ -20,6 +60,147 @@ async def test_tid_created_for_writes(dummy_request, loop):
     assert trns._tid is 1
 
 
+async def test_read_only_transactions_without_request(loop):
+    tm = mocks.MockTransactionManager()
+    trns = Transaction(tm, loop=loop, read_only=True)
+    await trns.tpc_begin(None)
+    assert trns._tid is None
+    assert not trns._strategy.writable_transaction
+    with pytest.raises(ReadOnlyError):
+        trns.register(utils.create_content())
+
+
+async def test_unchanged_objects_are_not_written(dummy_request, loop):
+    dummy_request._db_write_enabled = True
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    trns = Transaction(tm, dummy_request, loop=loop)
+    await trns.tpc_begin(None)
+    ob = utils.create_content()
+    ob.title = 'foobar'
+    storage.store(ob)
+    # rows are written from loaded objects, new objects share strings with
+    # their class and are pickled with references to them
+    storage.store(reader(storage._objects[ob._p_oid]))
+
+    ob = await trns.get(ob._p_oid)
+    ob.title = 'foobar'
+    assert ob._p_oid in trns.modified
+    await trns.real_commit()
+    assert trns.skipped_writes == 1
+    assert ob._p_oid not in trns.modified
+    assert trns.objects_needing_invalidation == []
+
+    ob.title = 'changed'
+    await trns.real_commit()
+    assert trns.skipped_writes == 1
+    assert trns.objects_needing_invalidation == [ob]
+    assert reader(storage._objects[ob._p_oid]).title == 'changed'
+
+
+async def test_loaded_states_of_records(dummy_request, loop):
+    dummy_request._db_write_enabled = True
+    tm = mocks.MockTransactionManager()
+    storage = tm._storage
+    trns = Transaction(tm, dummy_request, loop=loop)
+    await trns.tpc_begin(None)
+    ob = utils.create_content()
+    storage.store(ob)
+
+    row = storage._objects[ob._p_oid]
+    # children are queried by parent, the parent id is not selected
+    record = mocks.MockRecord(
+        zoid=row['zoid'], tid=row['tid'], id=row['id'], state=row['state'])
+    loaded = trns._read(record, parent_id='foobar')
+    assert loaded._p_oid == ob._p_oid
+    assert trns._loaded_states[ob._p_oid][1:4] == ('foobar', row['id'], None)
+
+
+def test_merge_states():
+    old = {'title': 'foo', 'description': 'bar', 'tags': ['foo']}
+    committed = {'title': 'foo', 'description': 'changed', 'tags': ['foo']}
+    new = {'title': 'mine', 'description': 'bar'}
+    assert merge_states(old, committed, new) == {
+        'title': 'mine', 'description': 'changed'}
+    # same change on both sides
+    assert merge_states(old, committed, dict(committed)) == committed
+    with pytest.raises(ConflictError):
+        merge_states(old, committed, {'title': 'foo', 'description': 'mine'})
+    assert merge_states(
+        (old, {'slot': 1}), (committed, {'slot': 1}), (old, {'slot': 2})) == (
+            committed, {'slot': 2})
+
+
+async def test_merge_conflicting_commits(dummy_request, loop):
+    dummy_request._db_write_enabled = True
+    storage = TIDCheckingStorage()
+    tm = mocks.MockTransactionManager(storage)
+    trns = Transaction(tm, dummy_request, loop=loop)
+    await trns.tpc_begin(None)
+    ob = utils.create_content(MergingItem)
+    ob.title = 'foo'
+    ob.description = 'bar'
+    storage.store(ob)
+    ob = await trns.get(ob._p_oid)
+
+    def commit_other(**values):
+        other = reader(storage._objects[ob._p_oid])
+        for name, value in values.items():
+            setattr(other, name, value)
+        # tid of the other transaction
+        storage._tid += 1
+        storage.store(other)
+        storage._objects[ob._p_oid]['tid'] = storage._tid
+        return storage._tid
+
+    commit_other(description='changed')
+    ob.title = 'mine'
+    await trns.real_commit()
+    assert trns.resolved_conflicts == 1
+    assert ob._p_serial == trns._tid
+    assert storage._objects[ob._p_oid]['tid'] == trns._tid
+    stored = reader(storage._objects[ob._p_oid])
+    assert stored.title == 'mine'
+    assert stored.description == 'changed'
+
+    # changes to the same attribute are not merged and fail to store
+    trns.tpc_cleanup()
+    await trns.tpc_begin(None)
+    ob = await trns.get(ob._p_oid)
+    committed_tid = commit_other(title='theirs')
+    ob.title = 'ours'
+    with pytest.raises(TIDConflictError):
+        await trns.real_commit()
+    assert trns.resolved_conflicts == 1
+    stored = reader(storage._objects[ob._p_oid])
+    assert storage._objects[ob._p_oid]['tid'] == committed_tid
+    assert stored.title == 'theirs'
+    assert stored.description == 'changed'
+
+
+async def test_committed_states_only_loaded_on_conflicts(dummy_request, loop):
+    dummy_request._db_write_enabled = True
+    storage = TIDCheckingStorage()
+    tm = mocks.MockTransactionManager(storage)
+    trns = Transaction(tm, dummy_request, loop=loop)
+    await trns.tpc_begin(None)
+    ob = utils.create_content(MergingItem)
+    other = utils.create_content()
+    storage.store(ob)
+    storage.store(other)
+    ob = await trns.get(ob._p_oid)
+    other = await trns.get(other._p_oid)
+    loads = storage.loads
+
+    ob.title = 'mine'
+    other.title = 'mine'
+    await trns.real_commit()
+    assert storage.loads == loads
+    assert trns.resolved_conflicts == 0
+    assert reader(storage._objects[ob._p_oid]).title == 'mine'
+    assert reader(storage._objects[other._p_oid]).title == 'mine'
+
+
 async def test_managed_transaction_with_adoption(container_requester):
     async with await container_requester as requester:
         request = utils.get_mocked_request(requester.db)
@@ -21,8 +21,6 @@ from guillotina.exceptions import ConflictError
 from guillotina.exceptions import TIDConflictError
 from guillotina.exceptions import Unauthorized
 from guillotina.i18n import default_message_factory as _
-from guillotina.interfaces import ACTIVE_LAYERS_KEY
-from guillotina.interfaces import IAnnotations
 from guillotina.interfaces import IApplication
 from guillotina.interfaces import IAsyncContainer
 from guillotina.interfaces import IContainer
@@ -36,12 +34,12 @@ from guillotina.interfaces import ITranslated
 from guillotina.interfaces import ITraversable
 from guillotina.interfaces import ITraversableView
 from guillotina.interfaces import SUBREQUEST_METHODS
-from guillotina.registry import REGISTRY_DATA_KEY
+from guillotina.registry import get_container_registry
 from guillotina.security.utils import get_view_permission
 from guillotina.transactions import abort
 from guillotina.transactions import commit
-from guillotina.utils import import_class
-from zope.interface import alsoProvides
+from zope.interface import directlyProvidedBy
+from zope.interface import directlyProvides
 
 import aiohttp
 import traceback
@@ -142,14 +140,9 @@ async def traverse(request, parent, path):
     if IContainer.providedBy(context):
         request._container_id = context.id
         request.container = context
-        annotations_container = IAnnotations(request.container)
-        request.container_settings = await annotations_container.async_get(REGISTRY_DATA_KEY)
-        layers = request.container_settings.get(ACTIVE_LAYERS_KEY, [])
-        for layer in layers:
-            try:
-                alsoProvides(request, import_class(layer))
-            except ModuleNotFoundError:
-                logger.error('Can not apply layer ' + layer, request=request)
+        request.container_settings, layers = await get_container_registry(context)
+        if layers is not None:
+            directlyProvides(request, directlyProvidedBy(request), layers)
 
     return await traverse(request, context, path[1:])
 
@@ -238,6 +231,11 @@ class MatchInfo(AbstractMatchInfo):
         retry_attempts = getattr(request, '_retry_attempt', 0)
         if retry_attempts > 0:
             view_result.headers['X-Retry-Transaction-Count'] = str(retry_attempts)
+        txn = getattr(request, '_txn', None)
+        if app_settings.get('debug') and txn is not None:
+            view_result.headers['X-Debug-DB-Queries'] = str(txn.queries)
+            view_result.headers['X-Debug-DB-Connection-Time'] = f'{txn.connection_time:.4f}'
+            view_result.headers['X-Debug-DB-Skipped-Writes'] = str(txn.skipped_writes)
 
         resp = await self.rendered(view_result)
 
@@ -61,7 +61,7 @@ setup(
         'zope.interface',
         'aioconsole',
         'pyjwt',
-        'asyncpg',
+        'asyncpg>=0.12.0,<0.13.0',
         'cffi',
         'PyYAML'
     ],
@@ -73,6 +73,9 @@ setup(
             'psycopg2',
             'pytest-asyncio<=0.5.0',
             'pytest-aiohttp'
+        ],
+        'lz4': [
+            'lz4'
         ]
     },
     entry_points={